@@ -1,11 +1,21 @@
 import argparse
+import atexit
 import sys
 from datetime import datetime
 from pathlib import Path
 
-from speech_diarization.analyze_audio import analyze_audio
+from decorators.tracing import CHROME_TRACE_SUFFIX, enable_tracing, write_trace
+from speech_diarization.analyze_audio import analyze_audio, analyze_audio_streaming
+from speech_diarization.audio_worker import (MODE_FULL, MODE_STREAMING, analyze_audio_dir, analyze_video_audio,
+                                             diarize_files)
+from speech_diarization.batch_diarization import get_segment_files
 from speech_diarization.dir_has_wav_files import contains_wav_files
 from speech_diarization.generate_clips import process_audio_clips
+from speech_diarization.merge_turns import DEFAULT_MAX_GAP_S, DEFAULT_MIN_TURN_S
+from speech_diarization.streaming import DEFAULT_OVERLAP_S, DEFAULT_WINDOW_S
+from video_cutter.cut_clip import CUT_ENCODE, CUT_MODES
+from video_cutter.interval_file import FORMAT_JSON, FORMATS
+from video_cutter.render_pool import DEFAULT_ENCODER_THREADS
 
 
 def get_timestamp():
@@ -17,13 +27,57 @@ def parse_args():
     parser.add_argument('--input_audio', type=str, help='Path to the input audio file')
     parser.add_argument('--input_audio_dir', type=str, help='Path to the input audio file')
     parser.add_argument('--input_video', type=str, help='Path to the input video')
-    parser.add_argument('--input_json', type=str, help='Path to the input JSON data file')
+    parser.add_argument('--input_json', type=str, help='Path to the input JSON data file (or interval file)')
     parser.add_argument('--output_dir', type=str, help='Path to the output directory', required=True)
+    parser.add_argument('--streaming', action='store_true',
+                        help='Diarize --input_audio in overlapping windows, to keep memory use bounded on long '
+                             'recordings')
+    parser.add_argument('--window', type=float, default=DEFAULT_WINDOW_S,
+                        help='Length of the --streaming windows, in seconds')
+    parser.add_argument('--overlap', type=float, default=DEFAULT_OVERLAP_S,
+                        help='Overlap between consecutive --streaming windows, in seconds')
+    parser.add_argument('--output_format', type=str, choices=FORMATS, default=FORMAT_JSON,
+                        help='Format of the diarization results of --input_audio and of unrelated --input_audio_dir '
+                             'files: "json", or "intervals", a compact binary file of millisecond turns with a table '
+                             'of speakers, memory-mapped when read (see convert-intervals to export it to JSON)')
+    parser.add_argument('--device', type=str, default=None,
+                        help='Device the diarization model runs on, e.g. "cpu" or "cuda". Defaults to "auto": the '
+                             'GPU when there is one')
+    parser.add_argument('--audio_workers', type=int, default=None,
+                        help='Number of --input_audio_dir files diarized at once, each by a process holding its own '
+                             'copy of the model. Defaults to 1 on the GPU, and 1 per 4 cores on the CPU')
+    parser.add_argument('--in_memory', action='store_true',
+                        help='When diarizing --input_video without --input_json, diarize its whole audio track at once '
+                             'from memory, instead of in parallel segments')
+    parser.add_argument('--cut_mode', type=str, choices=CUT_MODES, default=CUT_ENCODE,
+                        help='How clips are cut out of the input video: "encode" re-encodes them, "snap" stream-copies '
+                             'them from the preceding keyframe, and "smart" only re-encodes the partial GOPs at each '
+                             'end')
+    parser.add_argument('--max_gap', type=float, default=DEFAULT_MAX_GAP_S,
+                        help='Consecutive turns of a speaker at most this many seconds apart are cut as a single clip')
+    parser.add_argument('--min_turn', type=float, default=DEFAULT_MIN_TURN_S,
+                        help='Clips shorter than this many seconds, once merged, are dropped as crosstalk')
+    parser.add_argument('--single_decode', action='store_true',
+                        help='Write every speaker\'s video from a single decode of the input video, split between the '
+                             'speakers, instead of one concurrent job per speaker. Only with --cut_mode encode')
+    parser.add_argument('--render_workers', type=int, default=None,
+                        help='Maximum number of clips rendered concurrently. Defaults to the number of CPU cores '
+                             'divided by --encoder_threads')
+    parser.add_argument('--encoder_threads', type=int, default=DEFAULT_ENCODER_THREADS,
+                        help='Number of threads given to each ffmpeg encoder')
+    parser.add_argument('--trace', type=str, default=None,
+                        help='Path to a JSON file where the time, CPU time, peak memory and counters of every stage '
+                             f'are written when the program exits. Files ending with {CHROME_TRACE_SUFFIX} are written '
+                             'as Chrome trace events instead, for chrome://tracing or Perfetto')
     return parser.parse_args()
 
 
 def main():
     args = parse_args()
+    if args.trace:
+        enable_tracing()
+        # Also written when exiting on an error
+        atexit.register(write_trace, args.trace)
     input_audio = args.input_audio
     input_audio_dir = args.input_audio_dir
     input_video = args.input_video
@@ -46,7 +100,11 @@ def main():
         try:
             if not Path(output_dir).exists():
                 Path(output_dir).mkdir(exist_ok=True)
-            analyze_audio(input_audio, f"{output_dir}/{get_timestamp()}")
+            if args.streaming:
+                analyze_audio_streaming(input_audio, f"{output_dir}/{get_timestamp()}", args.window, args.overlap,
+                                        args.device, args.output_format)
+            else:
+                analyze_audio(input_audio, f"{output_dir}/{get_timestamp()}", args.device, args.output_format)
         except Exception as e:
             print(f"An error occurred while analyzing the audio: {str(e)}")
             sys.exit(1)
@@ -60,9 +118,28 @@ def main():
             sys.exit(1)
 
         try:
-            process_audio_clips(input_audio_dir, None, output_dir)
+            Path(output_dir).mkdir(parents=True, exist_ok=True)
+            if get_segment_files(input_audio_dir):
+                # Segments of a single recording, written by split-wav: diarized in parallel, then merged
+                analyze_audio_dir(input_audio_dir, f"{output_dir}/{get_timestamp()}", args.audio_workers,
+                                  args.device)
+                ok = True
+            else:
+                # Unrelated recordings: one JSON file each. Workers load the model once, for all of them.
+                jobs = [(input_file, Path(output_dir) / input_file.stem)
+                        for input_file in sorted(Path(input_audio_dir).glob('*.[wW][aA][vV]'))]
+                if args.streaming:
+                    results = diarize_files(jobs, args.audio_workers, args.device, MODE_STREAMING,
+                                            window_s=args.window, overlap_s=args.overlap,
+                                            output_format=args.output_format)
+                else:
+                    results = diarize_files(jobs, args.audio_workers, args.device, MODE_FULL,
+                                            output_format=args.output_format)
+                ok = all(result['ok'] for result in results)
         except Exception as e:
-            print(f"An error occurred while generating audio clips: {str(e)}")
+            print(f"An error occurred while analyzing the audio: {str(e)}")
+            sys.exit(1)
+        if not ok:
             sys.exit(1)
     elif input_video and input_json:
         if not Path(input_video).exists():
@@ -75,12 +152,27 @@ def main():
         try:
             if not Path(output_dir).exists():
                 Path(output_dir).mkdir(exist_ok=True)
-            process_audio_clips(input_video, input_json, output_dir)
+            process_audio_clips(input_video, input_json, output_dir, args.cut_mode, args.render_workers,
+                                args.encoder_threads, args.single_decode, args.max_gap, args.min_turn)
         except Exception as e:
             print(f"An error occurred while generating audio clips: {str(e)}")
             sys.exit(1)
+    elif input_video:
+        if not Path(input_video).exists():
+            print(f"Error: The input video file '{input_video}' does not exist.")
+            sys.exit(1)
+
+        try:
+            Path(output_dir).mkdir(parents=True, exist_ok=True)
+            # The audio track is decoded once, straight into what the pipeline expects: no intermediate WAV file
+            analyze_video_audio(input_video, f"{output_dir}/{get_timestamp()}", args.in_memory, args.audio_workers,
+                                args.device)
+        except Exception as e:
+            print(f"An error occurred while analyzing the audio: {str(e)}")
+            sys.exit(1)
     else:
-        print("Error: You must provide either input_audio OR input_video and input_json")
+        print("Error: You must provide either input_audio, input_audio_dir, or input_video (and input_json to generate "
+              "clips)")
         sys.exit(1)
 
 
@@ -0,0 +1,32 @@
+import argparse
+
+from vision_test.batch import DEFAULT_BATCH_DIR, analyze_batch, parse_analysis_params
+from video_cutter.render_pool import DEFAULT_ENCODER_THREADS
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Detect the intensive movements of a batch of videos within a budget of CPU cores. Any other "
+                    "option of run-vision-test (e.g. --mvmt 800 --generateclips) applies to every video.")
+    parser.add_argument('--input', type=str, required=True,
+                        help='Directory of videos, or manifest: a text file with one video per line, or a JSON list '
+                             'of paths or of {"input", "name", "params"} objects.')
+    parser.add_argument('--output_dir', type=str, default=str(DEFAULT_BATCH_DIR),
+                        help='Directory of the batch. The results of each video go to a subdirectory named after it.')
+    parser.add_argument('--cpu_budget', type=int, default=None,
+                        help='Number of cores shared by the analyses and the ffmpeg encoders. Defaults to all of them.')
+    parser.add_argument('--encoder_threads', type=int, default=DEFAULT_ENCODER_THREADS,
+                        help='Number of threads of the ffmpeg encoder cutting the clips of each video.')
+    parser.add_argument('--force', action='store_true', default=False,
+                        help='If true, will analyze videos again even if their results are already there.')
+    parser.add_argument('--report', type=str, default=None,
+                        help='Path to the JSON report of the batch. Defaults to '
+                             '<output_dir>/batch-report-<timestamp>.json.')
+
+    args, analysis_argv = parser.parse_known_args()
+    analyze_batch(args.input, args.output_dir, parse_analysis_params(analysis_argv), args.cpu_budget,
+                  args.encoder_threads, args.force, args.report)
+
+
+if __name__ == "__main__":
+    main()
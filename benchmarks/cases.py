@@ -0,0 +1,69 @@
+from functools import partial
+
+import cv2 as cv
+
+from speech_diarization.generate_clips import generate_clips as generate_speaker_clips, parse_data
+from vision_test import (DEFAULT_MOG2_HISTORY, DEFAULT_MOG2_SHADOWS, DEFAULT_MOG2_VAR_THRESHOLD,
+                         DEFAULT_MOVEMENT_GAP_MS, DEFAULT_PADDING_MS, DEFAULT_WHITE_PIXEL_COUNT)
+from vision_test.analyze_movements import analyze_movements, compute_motion_scores, create_back_sub
+from vision_test.ffmpeg_decode import compute_motion_scores_ffmpeg
+from vision_test.generate_clips import generate_clips as generate_movement_clips
+from wav_splitter.split_wav import split_wav_in_parallel
+
+SPLIT_SEGMENT_DURATION = 10 * 60
+SPLIT_NUM_CORES = 1
+# Reduced analysis profile, where most of the decoding work can be moved to ffmpeg
+SCALED_ANALYSIS = dict(analysis_width=480, grayscale=True)
+
+FIXTURE_VIDEO = 'video'
+FIXTURE_AUDIO = 'audio'
+
+
+def bench_analyze_movements(fixture, work_dir):
+    capture = cv.VideoCapture(fixture['video'])
+    try:
+        back_sub = create_back_sub(DEFAULT_MOG2_HISTORY, DEFAULT_MOG2_VAR_THRESHOLD, DEFAULT_MOG2_SHADOWS)
+        movements = analyze_movements(capture, back_sub, white_pixel_threshold=DEFAULT_WHITE_PIXEL_COUNT,
+                                      movement_gap_ms=DEFAULT_MOVEMENT_GAP_MS, padding_ms=DEFAULT_PADDING_MS)
+    finally:
+        capture.release()
+    return {"movements": len(movements)}
+
+
+def bench_motion_scores(fixture, work_dir, decoder='opencv', **analysis):
+    back_sub = create_back_sub(DEFAULT_MOG2_HISTORY, DEFAULT_MOG2_VAR_THRESHOLD, DEFAULT_MOG2_SHADOWS)
+    if decoder == 'ffmpeg':
+        motion_scores = compute_motion_scores_ffmpeg(fixture['video'], back_sub, **analysis)
+    else:
+        capture = cv.VideoCapture(fixture['video'])
+        try:
+            motion_scores = compute_motion_scores(capture, back_sub, **analysis)
+        finally:
+            capture.release()
+    return {"scores": len(motion_scores['frames'])}
+
+
+def bench_movement_clips(fixture, work_dir):
+    generate_movement_clips(fixture['movements'], fixture['video'], work_dir)
+
+
+def bench_speaker_clips(fixture, work_dir):
+    generate_speaker_clips(fixture['video'], parse_data(fixture['speakers']), work_dir)
+
+
+def bench_split_wav(fixture, work_dir):
+    split_wav_in_parallel(fixture['audio'], work_dir, SPLIT_SEGMENT_DURATION, SPLIT_NUM_CORES)
+
+
+# Name: (function, fixture kind). Each function is given the fixture dict (see fixtures.get_video_fixture() and
+# fixtures.get_audio_fixture()) and an empty directory for its outputs, and may return extra values to report
+CASES = {
+    'analyze_movements': (bench_analyze_movements, FIXTURE_VIDEO),
+    'motion_scores_opencv': (bench_motion_scores, FIXTURE_VIDEO),
+    'motion_scores_ffmpeg': (partial(bench_motion_scores, decoder='ffmpeg'), FIXTURE_VIDEO),
+    'motion_scores_opencv_scaled': (partial(bench_motion_scores, **SCALED_ANALYSIS), FIXTURE_VIDEO),
+    'motion_scores_ffmpeg_scaled': (partial(bench_motion_scores, decoder='ffmpeg', **SCALED_ANALYSIS), FIXTURE_VIDEO),
+    'movement_clips': (bench_movement_clips, FIXTURE_VIDEO),
+    'speaker_clips': (bench_speaker_clips, FIXTURE_VIDEO),
+    'split_wav': (bench_split_wav, FIXTURE_AUDIO),
+}
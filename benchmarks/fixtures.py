@@ -0,0 +1,209 @@
+import json
+import wave
+from pathlib import Path
+
+import cv2 as cv
+import ffmpeg
+import numpy as np
+
+DEFAULT_FIXTURES_DIR = Path('output/benchmarks/fixtures')
+DEFAULT_SEED = 0
+
+# Name: (width, height, fps)
+VIDEO_PROFILES = {
+    '360p30': (640, 360, 30),
+    '720p30': (1280, 720, 30),
+    '1080p30': (1920, 1080, 30),
+    '720p60': (1280, 720, 60),
+}
+VIDEO_FOURCC = 'mp4v'
+
+SAMPLE_RATE = 16000
+# One pitch per "speaker", far enough apart to fall in different bands of stub_pipeline.StubPipeline
+SPEAKER_TONES_HZ = [220, 440, 660, 880]
+TONE_AMPLITUDE = 0.3
+
+# Length range of movements, of the still periods between them, and of speaker turns, in seconds
+MOVEMENT_S = (1.0, 3.0)
+STILL_S = (1.0, 4.0)
+TURN_S = (1.0, 6.0)
+TURN_GAP_S = 0.5
+
+
+def get_fixture_path(fixtures_dir, name, suffix, **params):
+    """
+    Return the path of a fixture, named after every parameter it is generated from, so that changing one of them
+    generates a new file instead of reusing a stale one.
+    """
+    # No dots, which would be taken for the start of the suffix
+    tag = '_'.join(f'{key}{value}'.replace('.', 'p') for key, value in sorted(params.items()))
+    return Path(fixtures_dir) / f'{name}_{tag}{suffix}'
+
+
+def make_schedule(rng, duration_s, on_s, off_s):
+    """
+    Return (from, to) periods alternating with gaps over duration_s seconds, both of random lengths within the given
+    (min, max) ranges. The first period starts after a gap.
+    """
+    periods = []
+    t = rng.uniform(*off_s)
+    while t < duration_s:
+        end = min(t + rng.uniform(*on_s), duration_s)
+        periods.append((round(t, 3), round(end, 3)))
+        t = end + rng.uniform(*off_s)
+    return periods
+
+
+def draw_background(width, height, rng):
+    """
+    Return a static textured background, so that frames don't compress to nothing and the background subtractor has
+    some noise to model.
+    """
+    gradient = np.linspace(40, 200, width, dtype=np.float32)[None, :, None]
+    texture = rng.normal(0, 12, size=(height, width, 3)).astype(np.float32)
+    return np.clip(gradient + texture, 0, 255).astype(np.uint8)
+
+
+def make_motion_video(output_file, width, height, fps, duration_s, seed=DEFAULT_SEED):
+    """
+    Write a video of a rectangle moving over a static background during random periods, and absent in between.
+
+    Returns:
+        list: The {"from", "to"} movement periods, in seconds.
+    """
+    rng = np.random.default_rng(seed)
+    background = draw_background(width, height, rng)
+    movements = make_schedule(rng, duration_s, MOVEMENT_S, STILL_S)
+    size = max(height // 6, 8)
+
+    writer = cv.VideoWriter(str(output_file), cv.VideoWriter_fourcc(*VIDEO_FOURCC), fps, (width, height))
+    if not writer.isOpened():
+        raise RuntimeError(f'OpenCV cannot write {VIDEO_FOURCC} videos to {output_file}.')
+    frame = np.empty_like(background)
+    try:
+        for i in range(round(duration_s * fps)):
+            t = i / fps
+            np.copyto(frame, background)
+            for start, end in movements:
+                if start <= t < end:
+                    # Bounce across the frame, one full sweep per movement
+                    progress = (t - start) / (end - start)
+                    x = round(progress * (width - size))
+                    y = round((height - size) / 2 * (1 + np.sin(2 * np.pi * progress)))
+                    cv.rectangle(frame, (x, y), (x + size, y + size), (30, 30, 230), thickness=-1)
+                    break
+            writer.write(frame)
+    finally:
+        writer.release()
+
+    return [{"from": start, "to": end} for start, end in movements]
+
+
+def make_speaker_samples(duration_s, num_speakers, sample_rate=SAMPLE_RATE, seed=DEFAULT_SEED):
+    """
+    Return (samples, turns): a mono float32 signal where each "speaker" is a pure tone, talking in turns separated by
+    short silences, and the {"start", "stop", "speaker"} turns, in the layout of a diarization JSON file.
+    """
+    rng = np.random.default_rng(seed)
+    samples = np.zeros(round(duration_s * sample_rate), dtype=np.float32)
+    turns = []
+    t = 0.0
+    while t < duration_s:
+        end = min(t + rng.uniform(*TURN_S), duration_s)
+        speaker = int(rng.integers(num_speakers))
+        start_sample, end_sample = round(t * sample_rate), round(end * sample_rate)
+        time_s = np.arange(end_sample - start_sample, dtype=np.float32) / sample_rate
+        samples[start_sample:end_sample] = TONE_AMPLITUDE * np.sin(2 * np.pi * SPEAKER_TONES_HZ[speaker] * time_s)
+        turns.append({"start": round(t, 1), "stop": round(end, 1), "speaker": f"speaker_SPEAKER_{speaker:02d}"})
+        t = end + TURN_GAP_S
+    return samples, turns
+
+
+def make_speaker_wav(output_file, duration_s, num_speakers, sample_rate=SAMPLE_RATE, seed=DEFAULT_SEED):
+    """
+    Write a 16-bit mono WAV file of tone "speakers" (see make_speaker_samples()).
+
+    Returns:
+        list: The {"start", "stop", "speaker"} turns.
+    """
+    samples, turns = make_speaker_samples(duration_s, num_speakers, sample_rate, seed)
+    with wave.open(str(output_file), 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes((samples * 32767).astype('<i2').tobytes())
+    return turns
+
+
+def mux_audio(input_video, input_audio, output_video):
+    """
+    Add an audio track to a video without re-encoding its frames, so that the clip generators cut both streams.
+    """
+    video = ffmpeg.input(str(input_video)).video
+    audio = ffmpeg.input(str(input_audio)).audio
+    (ffmpeg
+     .output(video, audio, str(output_video), vcodec='copy', acodec='aac', shortest=None)
+     .run(overwrite_output=True, quiet=True))
+
+
+def save_json(data, output_file):
+    with open(output_file, 'w') as f:
+        json.dump(data, f, indent=4)
+
+
+def load_json(input_file):
+    with open(input_file, 'r') as f:
+        return json.load(f)
+
+
+def get_video_fixture(profile, duration_s, fixtures_dir=DEFAULT_FIXTURES_DIR, num_speakers=2, seed=DEFAULT_SEED):
+    """
+    Return a motion video fixture, generating it on first use. The video has a tone "speaker" audio track.
+
+    Returns:
+        dict: "video" (path), "movements" (path to an intensive movements JSON file), "speakers" (path to a diarization
+            JSON file), "frames", "fps" and "duration_s".
+    """
+    width, height, fps = VIDEO_PROFILES[profile]
+    params = dict(d=duration_s, s=seed, n=num_speakers)
+    video = get_fixture_path(fixtures_dir, f'motion_{profile}', '.mp4', **params)
+    movements = video.with_suffix('.movements.json')
+    speakers = video.with_suffix('.speakers.json')
+
+    if not (video.exists() and movements.exists() and speakers.exists()):
+        print(f'Generating {video}...')
+        Path(fixtures_dir).mkdir(parents=True, exist_ok=True)
+        silent_video = video.with_suffix('.silent.mp4')
+        audio = video.with_suffix('.wav')
+        save_json(make_motion_video(silent_video, width, height, fps, duration_s, seed), movements)
+        save_json(make_speaker_wav(audio, duration_s, num_speakers, seed=seed), speakers)
+        mux_audio(silent_video, audio, video)
+        silent_video.unlink()
+        audio.unlink()
+
+    return {
+        "video": str(video),
+        "movements": str(movements),
+        "speakers": str(speakers),
+        "frames": round(duration_s * fps),
+        "fps": fps,
+        "duration_s": duration_s,
+    }
+
+
+def get_audio_fixture(duration_s, fixtures_dir=DEFAULT_FIXTURES_DIR, num_speakers=4, seed=DEFAULT_SEED):
+    """
+    Return a tone "speaker" WAV fixture, generating it on first use.
+
+    Returns:
+        dict: "audio" (path), "speakers" (path to the true diarization JSON file) and "duration_s".
+    """
+    audio = get_fixture_path(fixtures_dir, 'speakers', '.wav', d=duration_s, s=seed, n=num_speakers)
+    speakers = audio.with_suffix('.speakers.json')
+
+    if not (audio.exists() and speakers.exists()):
+        print(f'Generating {audio}...')
+        Path(fixtures_dir).mkdir(parents=True, exist_ok=True)
+        save_json(make_speaker_wav(audio, duration_s, num_speakers, seed=seed), speakers)
+
+    return {"audio": str(audio), "speakers": str(speakers), "duration_s": duration_s}
@@ -0,0 +1,241 @@
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import cv2 as cv
+
+from decorators.tracing import MAXRSS_SCALE
+from .cases import CASES, FIXTURE_VIDEO
+from .fixtures import get_audio_fixture, get_video_fixture
+
+DEFAULT_BASELINE = Path('benchmarks/baseline.json')
+DEFAULT_REPEAT = 3
+# Relative slowdown (or memory growth) above which a case counts as a regression
+DEFAULT_TOLERANCE = 0.2
+DEFAULT_MEMORY_TOLERANCE = 0.2
+
+
+def get_machine_info():
+    """
+    Describe what the timings depend on, so that a baseline is only trusted on a comparable machine.
+    """
+    return {
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "opencv": cv.__version__,
+    }
+
+
+def get_peak_rss_mb(who):
+    return resource.getrusage(who).ru_maxrss * MAXRSS_SCALE / 1024 / 1024
+
+
+def get_own_peak_rss_mb():
+    """
+    Return the peak RSS of this process. On Linux, ru_maxrss carries over the peak of the process that spawned it,
+    so the high-water mark of this process' own memory is read from /proc instead.
+    """
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return get_peak_rss_mb(resource.RUSAGE_SELF)
+
+
+def silence_output():
+    """
+    Send the output of this process, and of the ffmpeg processes it starts, to /dev/null.
+    """
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, sys.stdout.fileno())
+    os.dup2(devnull, sys.stderr.fileno())
+    os.close(devnull)
+
+
+def run_case(case_name, fixture, work_dir, quiet=True):
+    """
+    Run a benchmark case once and measure it. Meant to run in a fresh process, so that its peak memory is its own.
+
+    Returns:
+        dict: "wall_s", "cpu_s", "children_cpu_s" (ffmpeg), "peak_rss_mb", "children_peak_rss_mb" (largest ffmpeg
+            process), plus whatever the case reports.
+    """
+    if quiet:
+        silence_output()
+    bench, _ = CASES[case_name]
+
+    start_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start_cpu_s = time.process_time()
+    start_s = time.perf_counter()
+    extra = bench(fixture, work_dir) or {}
+    wall_s = time.perf_counter() - start_s
+    cpu_s = time.process_time() - start_cpu_s
+    end_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    return {
+        "wall_s": wall_s,
+        "cpu_s": cpu_s,
+        "children_cpu_s": (end_children.ru_utime + end_children.ru_stime
+                           - start_children.ru_utime - start_children.ru_stime),
+        "peak_rss_mb": get_own_peak_rss_mb(),
+        "children_peak_rss_mb": get_peak_rss_mb(resource.RUSAGE_CHILDREN),
+        **extra,
+    }
+
+
+def run_case_in_process(case_name, fixture, quiet=True):
+    """
+    Run a benchmark case in a freshly spawned process, with an empty temporary directory for its outputs.
+    """
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as work_dir:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            return executor.submit(run_case, case_name, fixture, work_dir, quiet).result()
+
+
+def summarize_runs(runs, fixture):
+    """
+    Reduce the runs of a case to its median wall time, and the throughput that follows from it.
+    """
+    wall_s = statistics.median(run['wall_s'] for run in runs)
+    summary = {
+        "wall_s": wall_s,
+        "min_wall_s": min(run['wall_s'] for run in runs),
+        "cpu_s": statistics.median(run['cpu_s'] for run in runs),
+        "children_cpu_s": statistics.median(run['children_cpu_s'] for run in runs),
+        "peak_rss_mb": max(run['peak_rss_mb'] for run in runs),
+        "children_peak_rss_mb": max(run['children_peak_rss_mb'] for run in runs),
+        "realtime_factor": fixture['duration_s'] / wall_s,
+        "runs": len(runs),
+    }
+    if 'frames' in fixture:
+        summary["fps"] = fixture['frames'] / wall_s
+    # Values reported by the case itself, e.g. the number of movements found
+    for key, value in runs[-1].items():
+        summary.setdefault(key, value)
+    return summary
+
+
+def get_case_fixtures(case_names, profiles, video_duration_s, audio_duration_s, fixtures_dir):
+    """
+    Return [(result name, case name, fixture)] for every case to run: video cases run once per video profile. Result
+    names include the fixture length, so that results are only ever compared to a baseline of the same workload.
+    """
+    runs = []
+    for case_name in case_names:
+        _, fixture_kind = CASES[case_name]
+        if fixture_kind == FIXTURE_VIDEO:
+            for profile in profiles:
+                runs.append((f'{case_name}/{profile}/{video_duration_s}s', case_name,
+                             get_video_fixture(profile, video_duration_s, fixtures_dir)))
+        else:
+            runs.append((f'{case_name}/{audio_duration_s}s', case_name,
+                         get_audio_fixture(audio_duration_s, fixtures_dir)))
+    return runs
+
+
+def run_benchmarks(case_names, profiles, video_duration_s, audio_duration_s, fixtures_dir, repeat=DEFAULT_REPEAT,
+                   quiet=True):
+    """
+    Run every benchmark case repeat times, each time in a fresh process, on fixtures generated on first use.
+
+    Returns:
+        dict: "machine" (see get_machine_info()), "settings", and "cases" ({result name: summary}).
+    """
+    results = {}
+    for result_name, case_name, fixture in get_case_fixtures(case_names, profiles, video_duration_s,
+                                                             audio_duration_s, fixtures_dir):
+        runs = []
+        for i in range(repeat):
+            print(f'Running {result_name} ({i + 1}/{repeat})...')
+            runs.append(run_case_in_process(case_name, fixture, quiet))
+        results[result_name] = summarize_runs(runs, fixture)
+
+    return {
+        "machine": get_machine_info(),
+        "settings": {
+            "video_duration_s": video_duration_s,
+            "audio_duration_s": audio_duration_s,
+            "repeat": repeat,
+        },
+        "cases": results,
+    }
+
+
+def compare_to_baseline(results, baseline, tolerance=DEFAULT_TOLERANCE, memory_tolerance=DEFAULT_MEMORY_TOLERANCE):
+    """
+    Compare every case to the same case of the baseline.
+
+    Returns:
+        list: One {"case", "metric", "baseline", "current", "change"} dict per regression, where change is the
+            relative increase over the baseline.
+    """
+    if baseline['machine'] != results['machine']:
+        print(f'Warning: the baseline was recorded on a different machine ({baseline["machine"]}), timings may not be '
+              f'comparable.')
+
+    regressions = []
+    for case, summary in results['cases'].items():
+        baseline_summary = baseline['cases'].get(case)
+        if baseline_summary is None:
+            print(f'No baseline for {case}.')
+            continue
+        for metric, metric_tolerance in [('wall_s', tolerance), ('peak_rss_mb', memory_tolerance),
+                                         ('children_peak_rss_mb', memory_tolerance)]:
+            if not baseline_summary.get(metric):
+                continue
+            change = summary[metric] / baseline_summary[metric] - 1
+            if change > metric_tolerance:
+                regressions.append({
+                    "case": case,
+                    "metric": metric,
+                    "baseline": baseline_summary[metric],
+                    "current": summary[metric],
+                    "change": change,
+                })
+    return regressions
+
+
+def format_change(summary, baseline_summary, metric):
+    if not baseline_summary or not baseline_summary.get(metric):
+        return ''
+    return f'{(summary[metric] / baseline_summary[metric] - 1) * 100:+.0f}%'
+
+
+def print_report(results, baseline=None):
+    baseline_cases = baseline['cases'] if baseline else {}
+    width = max([len(case) for case in results['cases']] + [32])
+    print(f'{"case":<{width}} {"wall":>8} {"vs base":>8} {"fps":>8} {"realtime":>9} {"cpu":>7} {"ffmpeg cpu":>10} '
+          f'{"peak MB":>8} {"ffmpeg MB":>9}')
+    for case, summary in results['cases'].items():
+        baseline_summary = baseline_cases.get(case)
+        fps = f'{summary["fps"]:.0f}' if 'fps' in summary else ''
+        print(f'{case:<{width}} {summary["wall_s"]:>7.2f}s {format_change(summary, baseline_summary, "wall_s"):>8} '
+              f'{fps:>8} {summary["realtime_factor"]:>8.1f}x {summary["cpu_s"]:>6.2f}s '
+              f'{summary["children_cpu_s"]:>9.2f}s {summary["peak_rss_mb"]:>8.0f} '
+              f'{summary["children_peak_rss_mb"]:>9.0f}')
+
+
+def load_results(input_file):
+    with open(input_file, 'r') as f:
+        return json.load(f)
+
+
+def save_results(results, output_file):
+    Path(output_file).parent.mkdir(parents=True, exist_ok=True)
+    with open(output_file, 'w') as f:
+        json.dump(results, f, indent=4)
+    print(f'Saved benchmark results to {output_file}')
@@ -0,0 +1,23 @@
+import argparse
+
+from video_cutter.interval_file import export_json, import_json, is_interval_file
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert intensive movements or diarization turns between JSON and "
+                                                 "the binary interval format: interval files are exported to JSON, "
+                                                 "and JSON files are converted to interval files.")
+    parser.add_argument('input_file', type=str, help='Path to a JSON file or an interval file.')
+    parser.add_argument('output_file', type=str, help='Path to the converted file.')
+
+    args = parser.parse_args()
+
+    if is_interval_file(args.input_file):
+        count = export_json(args.input_file, args.output_file)
+    else:
+        count = import_json(args.input_file, args.output_file)
+    print(f"Converted {count} intervals from {args.input_file} to {args.output_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,16 @@
+import functools
 import time
 
+from .tracing import span
+
 
 def record_performance(func):
+    @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        start_time = time.time()
-        result = func(*args, **kwargs)
-        end_time = time.time()
+        start_time = time.perf_counter()
+        with span(func.__name__):
+            result = func(*args, **kwargs)
+        end_time = time.perf_counter()
         duration = end_time - start_time
         print(f"{func.__name__} took {duration:.2f} seconds to complete.")
         return result
@@ -0,0 +1,222 @@
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import psutil
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Files written with this suffix are Chrome trace event files (chrome://tracing, https://ui.perfetto.dev), any other
+# file gets the nested span report
+CHROME_TRACE_SUFFIX = '.trace.json'
+# ru_maxrss is in kilobytes on Linux, and in bytes on macOS
+MAXRSS_SCALE = 1 if sys.platform == 'darwin' else 1024
+
+_enabled = False
+_lock = threading.Lock()
+_local = threading.local()
+_main_stack = []
+_root_spans = []
+_origin_s = time.perf_counter()
+_process = psutil.Process()
+
+
+def enable_tracing():
+    """
+    Start recording spans. Until then, span() and the other functions of this module do nothing.
+    """
+    global _enabled
+    _enabled = True
+
+
+def is_tracing():
+    return _enabled
+
+
+def _get_stack():
+    if threading.current_thread() is threading.main_thread():
+        return _main_stack
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+
+def _current_span():
+    """
+    Return the innermost open span of this thread. Threads without one of their own (e.g. render pool workers) report
+    to the innermost open span of the main thread.
+    """
+    stack = _get_stack()
+    if stack:
+        return stack[-1]
+    return _main_stack[-1] if _main_stack else None
+
+
+def _get_children_cpu_s():
+    """
+    Return the CPU time of the child processes waited for so far, or None where it isn't tracked (Windows).
+    """
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _get_rss_mb():
+    return _process.memory_info().rss / 1024 / 1024
+
+
+def get_peak_rss_mb():
+    """
+    Return the peak RSS of the whole process so far, in megabytes.
+    """
+    if resource is None:
+        return _process.memory_info().peak_wset / 1024 / 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * MAXRSS_SCALE / 1024 / 1024
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Record the wall time, the CPU time (of this process, and of the child processes it waited for, such as ffmpeg),
+    and the RSS at the end of a block of code, nested under the span that is open when it starts. The peak RSS is a
+    high-water mark of the whole process, so it is reported once per run by write_trace() instead.
+
+    Yields the span record, or None when tracing is disabled.
+    """
+    if not _enabled:
+        yield None
+        return
+
+    record = {
+        "name": name,
+        "attributes": attributes,
+        "thread": threading.current_thread().name,
+        "start_s": time.perf_counter() - _origin_s,
+        "counters": {},
+        "children": [],
+    }
+    parent = _current_span()
+    with _lock:
+        (parent["children"] if parent is not None else _root_spans).append(record)
+
+    stack = _get_stack()
+    stack.append(record)
+    start_s = time.perf_counter()
+    start_cpu_s = time.process_time()
+    start_children_cpu_s = _get_children_cpu_s()
+    try:
+        yield record
+    finally:
+        record["wall_s"] = time.perf_counter() - start_s
+        record["cpu_s"] = time.process_time() - start_cpu_s
+        if start_children_cpu_s is not None:
+            record["children_cpu_s"] = _get_children_cpu_s() - start_children_cpu_s
+        record["rss_mb"] = _get_rss_mb()
+        stack.pop()
+
+
+def traced(name=None):
+    """
+    Decorator recording every call of the function as a span.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name or func.__qualname__):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def count(name, value=1):
+    """
+    Add value to a counter of the innermost open span, e.g. frames analyzed or clips rendered.
+    """
+    record = _current_span() if _enabled else None
+    if record is not None:
+        with _lock:
+            record["counters"][name] = record["counters"].get(name, 0) + value
+
+
+def add_stage(name, wall_s, calls):
+    """
+    Add a child span to the innermost open span for time accumulated over many short calls (e.g. per frame), which
+    would cost too much to record one by one.
+    """
+    record = _current_span() if _enabled else None
+    if record is not None:
+        with _lock:
+            record["children"].append({
+                "name": name,
+                "attributes": {"aggregated": True},
+                "thread": threading.current_thread().name,
+                "start_s": None,
+                "wall_s": wall_s,
+                "counters": {"calls": calls},
+                "children": [],
+            })
+
+
+def to_chrome_trace(spans):
+    """
+    Convert spans to Chrome trace events. Aggregated stages are laid out back to back from the start of their parent.
+    """
+    pid = os.getpid()
+    thread_ids = {}
+    events = []
+
+    def add_events(record, parent_start_s):
+        start_s = record["start_s"] if record["start_s"] is not None else parent_start_s
+        args = {key: record[key] for key in ("cpu_s", "children_cpu_s", "rss_mb") if key in record}
+        args.update(record["counters"])
+        args.update(record["attributes"])
+        events.append({
+            "name": record["name"],
+            "ph": "X",
+            "ts": round(start_s * 1e6),
+            "dur": round(record.get("wall_s", 0) * 1e6),
+            "pid": pid,
+            "tid": thread_ids.setdefault(record["thread"], len(thread_ids)),
+            "args": args,
+        })
+        stage_start_s = start_s
+        for child in record["children"]:
+            add_events(child, stage_start_s)
+            if child["start_s"] is None:
+                stage_start_s += child["wall_s"]
+
+    for record in spans:
+        add_events(record, 0)
+
+    return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"peak_rss_mb": get_peak_rss_mb()}}
+
+
+def write_trace(output_file):
+    """
+    Write every span recorded so far to output_file: Chrome trace events if it ends with CHROME_TRACE_SUFFIX, and the
+    nested span report otherwise.
+    """
+    if not _enabled:
+        return
+
+    with _lock:
+        spans = list(_root_spans)
+    Path(output_file).parent.mkdir(parents=True, exist_ok=True)
+    if str(output_file).endswith(CHROME_TRACE_SUFFIX):
+        data = to_chrome_trace(spans)
+    else:
+        data = {"argv": sys.argv, "pid": os.getpid(), "peak_rss_mb": get_peak_rss_mb(), "spans": spans}
+    with open(output_file, 'w') as f:
+        json.dump(data, f, indent=4, default=str)
+    print(f"Performance trace saved to {output_file}")
@@ -1,10 +1,51 @@
+import json
+import os
+
 import functions_framework
 from cloudevents.http.event import CloudEvent
 
-import vision_test
+from vision_test.job_queue import FileJobQueue
+from vision_test.job_worker import replace_dead_workers, submit_video, wait_for_job
+
+# Local directory of the job queue: the only writable one on Cloud Functions is /tmp
+QUEUE_DIR = os.environ.get('VISION_JOB_QUEUE_DIR', '/tmp/vision-jobs')
+# Directory where the storage buckets are mounted (e.g. with Cloud Storage FUSE), as <root>/<bucket>/<object name>
+INPUT_ROOT = os.environ.get('VISION_INPUT_ROOT', '/gcs')
+# Analysis parameters of every job, as a JSON object of command line options, e.g. {"mvmt": 800, "generateclips": true}
+JOB_PARAMS = json.loads(os.environ.get('VISION_JOB_PARAMS', '{}'))
+# How long an event waits for its job, in seconds. Keep it below the timeout of the function.
+JOB_TIMEOUT_S = float(os.environ.get('VISION_JOB_TIMEOUT_S', '530'))
+
+# Worker processes of this instance, started by the first event and shared by the following ones
+_workers = []
+
+
+def ensure_workers():
+    # Called on every event and while waiting: a worker killed mid-job is replaced, and its job queued again, even
+    # while the other workers are busy
+    replace_dead_workers(_workers, QUEUE_DIR)
 
 
 @functions_framework.cloud_event
 def vision_trigger_from_storage(cloud_event: CloudEvent) -> None:
     print(f"Received event with ID: {cloud_event['id']} and data {cloud_event.data}")
-    vision_test.get_movements()
+    bucket = cloud_event.data['bucket']
+    object_name = cloud_event.data['name']
+
+    queue = FileJobQueue(QUEUE_DIR)
+    job, created = submit_video(queue, f"{bucket}/{object_name}", cloud_event.data.get('generation'),
+                                os.path.join(INPUT_ROOT, bucket, object_name), JOB_PARAMS)
+    if not created:
+        print(f"Ignoring duplicate event: job {job['id']} for {job['object_name']} is already {job['status']}.")
+        return
+
+    # Workers analyze concurrent uploads side by side. Wait for this one, so that the instance keeps its CPU until the
+    # analysis is done.
+    ensure_workers()
+    try:
+        job = wait_for_job(queue, job['id'], timeout_s=JOB_TIMEOUT_S, on_poll=ensure_workers)
+    except TimeoutError as e:
+        # The job stays in the queue: the workers of this instance, or the next event's, finish it
+        print(f"Stopped waiting: {e}")
+        return
+    print(f"Job {job['id']} for {job['object_name']} is {job['status']}: {job['result'] or job['error']}")
@@ -0,0 +1,67 @@
+import argparse
+import sys
+from datetime import datetime
+
+from benchmarks.cases import CASES
+from benchmarks.fixtures import DEFAULT_FIXTURES_DIR, VIDEO_PROFILES
+from benchmarks.harness import (DEFAULT_BASELINE, DEFAULT_MEMORY_TOLERANCE, DEFAULT_REPEAT, DEFAULT_TOLERANCE,
+                                compare_to_baseline, load_results, print_report, run_benchmarks, save_results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the motion analysis, the clip generators and the WAV splitter "
+                                                 "on synthetic videos and audio, and compare them to a baseline.")
+    parser.add_argument('--cases', type=str, nargs='+', choices=list(CASES), default=list(CASES),
+                        help='Benchmark cases to run. Defaults to all of them.')
+    parser.add_argument('--profiles', type=str, nargs='+', choices=list(VIDEO_PROFILES), default=['360p30', '720p30'],
+                        help='Resolution and fps of the videos the video cases run on.')
+    parser.add_argument('--video_duration', type=int, default=20, help='Length of the videos, in seconds.')
+    parser.add_argument('--audio_duration', type=int, default=30 * 60, help='Length of the WAV file, in seconds.')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT,
+                        help='Number of runs of each case. The median wall time is reported.')
+    parser.add_argument('--fixtures_dir', type=str, default=str(DEFAULT_FIXTURES_DIR),
+                        help='Directory where the generated fixtures are kept between runs.')
+    parser.add_argument('--output', type=str, default=None,
+                        help='Path to the JSON file the results are written to. Defaults to '
+                             'output/benchmarks/results-<timestamp>.json.')
+    parser.add_argument('--baseline', type=str, default=str(DEFAULT_BASELINE),
+                        help='Path to the baseline JSON file the results are compared to, when it exists.')
+    parser.add_argument('--save_baseline', action='store_true', default=False,
+                        help='If true, will write the results to --baseline instead of comparing them to it.')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='Relative slowdown above which a case is a regression, e.g. 0.2 for 20%%.')
+    parser.add_argument('--memory_tolerance', type=float, default=DEFAULT_MEMORY_TOLERANCE,
+                        help='Relative peak memory growth above which a case is a regression.')
+    parser.add_argument('--verbose', action='store_true', default=False,
+                        help='If true, will show the output of the benchmarked code and of ffmpeg.')
+
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.cases, args.profiles, args.video_duration, args.audio_duration, args.fixtures_dir,
+                             args.repeat, quiet=not args.verbose)
+    save_results(results, args.output or f'output/benchmarks/results-{int(datetime.now().timestamp())}.json')
+
+    if args.save_baseline:
+        print_report(results)
+        save_results(results, args.baseline)
+        return
+
+    try:
+        baseline = load_results(args.baseline)
+    except FileNotFoundError:
+        print_report(results)
+        print(f'No baseline at {args.baseline}. Record one with --save_baseline.')
+        return
+
+    print_report(results, baseline)
+    regressions = compare_to_baseline(results, baseline, args.tolerance, args.memory_tolerance)
+    for regression in regressions:
+        print(f'Regression: {regression["case"]} {regression["metric"]} went from {regression["baseline"]:.2f} to '
+              f'{regression["current"]:.2f} ({regression["change"] * 100:+.0f}%)')
+    if regressions:
+        sys.exit(1)
+    print('No regression.')
+
+
+if __name__ == "__main__":
+    main()
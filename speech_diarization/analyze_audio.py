@@ -1,4 +1,5 @@
 import json
+from functools import lru_cache
 from os import getenv, path as ospath
 from pathlib import Path
 
@@ -8,30 +9,57 @@ from pyannote.audio import Pipeline
 from pyannote.audio.pipelines.utils.hook import ProgressHook
 
 from decorators.all_decorators import record_performance
+from video_cutter.interval_file import FORMAT_INTERVALS, FORMAT_JSON, KIND_TURNS, get_output_path, write_intervals
+from .batch_diarization import save_segment_result
+from .streaming import DEFAULT_OVERLAP_S, DEFAULT_WINDOW_S, diarize_stream, diarize_with_embeddings
 
 load_dotenv()
 script_dir = ospath.dirname(ospath.realpath(__file__))
 parent_dir = ospath.join(script_dir, ospath.pardir)
 model_path = ospath.normpath(ospath.join(parent_dir, "models"))
 
+NUM_SPEAKERS = 4
+PIPELINE_NAME = "pyannote/speaker-diarization-3.1"
+DEVICE_AUTO = "auto"
+
+
+def get_device(device=None):
+    """
+    Return the torch device to run the pipeline on: the given one, or with None or "auto", the GPU when there is one,
+    else the CPU.
+    """
+    if device and device != DEVICE_AUTO:
+        return torch.device(device)
+    return torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
-@record_performance
-def analyze_audio(input_file="", output_file=""):
-    # print(torch.cuda.is_available())
-    # return
 
+@lru_cache(maxsize=None)
+def _load_pipeline(device):
+    print(f"Loading {PIPELINE_NAME} on {device}...")
     pipeline = Pipeline.from_pretrained(
-        "pyannote/speaker-diarization-3.1",
+        PIPELINE_NAME,
         # "models/speaker-diarization-3.1",
         use_auth_token=getenv("TOKEN_HUGGING_FACE")
     )
+    pipeline.to(device)
+    return pipeline
+
+
+def load_pipeline(device=None):
+    """
+    Return the diarization pipeline on the given device (see get_device()). The model is only loaded once per device
+    and process, and reused by every later call.
+    """
+    return _load_pipeline(get_device(device))
 
-    # send pipeline to GPU (when available)
-    pipeline.to(torch.device("cuda"))
+
+@record_performance
+def analyze_audio(input_file="", output_file="", device=None, output_format=FORMAT_JSON):
+    pipeline = load_pipeline(device)
 
     # apply pretrained pipeline
     with ProgressHook() as hook:
-        diarization = pipeline(input_file, num_speakers=4, hook=hook)
+        diarization = pipeline(input_file, num_speakers=NUM_SPEAKERS, hook=hook)
 
     results = []
     for turn, _, speaker in diarization.itertracks(yield_label=True):
@@ -43,8 +71,41 @@ def analyze_audio(input_file="", output_file=""):
         results.append(result)
         print(f"start={result['start']}s stop={result['stop']}s {result['speaker']}")
 
-    output_file = Path(output_file).with_suffix('.json')
-    with open(output_file, 'w') as f:
-        json.dump(results, f, indent=4)
+    output_file = get_output_path(output_file, output_format)
+    if output_format == FORMAT_INTERVALS:
+        write_intervals(results, output_file, KIND_TURNS)
+    else:
+        with open(output_file, 'w') as f:
+            json.dump(results, f, indent=4)
+
+    print(f"Results saved to {output_file}")
 
-    print(f"Results saved to {output_file}.json")
+
+@record_performance
+def analyze_audio_streaming(input_file="", output_file="", window_s=DEFAULT_WINDOW_S, overlap_s=DEFAULT_OVERLAP_S,
+                            device=None, output_format=FORMAT_JSON):
+    """
+    Same as analyze_audio(), but the audio is diarized in overlapping windows, so that memory use doesn't grow with
+    the length of the recording. Turns are written to the JSON (or interval) file as each window is done.
+    """
+    pipeline = load_pipeline(device)
+
+    output_file = get_output_path(output_file, output_format)
+    # Not every speaker talks in every window
+    diarize_stream(pipeline, input_file, output_file, window_s, overlap_s, max_speakers=NUM_SPEAKERS)
+
+    print(f"Results saved to {output_file}")
+
+
+@record_performance
+def analyze_audio_segment(input_file="", output_file="", device=None):
+    """
+    Diarize one segment of a longer recording, and keep the speaker embeddings next to the turns, so that speakers can
+    be matched across segments (see batch_diarization.merge_segment_results()).
+    """
+    pipeline = load_pipeline(device)
+    turns, labels, embeddings = diarize_with_embeddings(pipeline, str(input_file), max_speakers=NUM_SPEAKERS)
+
+    output_file = Path(output_file).with_suffix('.json')
+    save_segment_result(output_file, turns, labels, embeddings)
+    print(f"Found {len(turns)} turns of {len(labels)} speakers in {input_file}")
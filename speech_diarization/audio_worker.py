@@ -0,0 +1,207 @@
+import multiprocessing
+import os
+import queue
+import tempfile
+import time
+from pathlib import Path
+
+import torch
+
+from decorators.tracing import traced
+from .analyze_audio import analyze_audio, analyze_audio_segment, analyze_audio_streaming, get_device, load_pipeline
+from wav_splitter.extract_audio import SAMPLE_RATE, SEGMENT_DURATION, extract_audio_segments, read_audio
+from .batch_diarization import get_segment_files, get_segment_offsets, merge_segment_results
+from .streaming import to_pipeline_input
+from video_cutter.interval_file import FORMAT_JSON, get_output_path
+
+# How often the parent checks that its workers are still alive while waiting for results, in seconds
+POLL_INTERVAL_S = 5
+# Torch threads given to each worker when running on the CPU
+THREADS_PER_WORKER = 4
+# Fresh interpreters: CUDA can't be used from a forked process
+START_METHOD = 'spawn'
+
+MODE_FULL = 'full'
+MODE_STREAMING = 'streaming'
+MODE_SEGMENT = 'segment'
+# Looked up by name in the worker, so that modes can be given as plain strings (e.g. from the command line)
+ANALYZERS = {
+    MODE_FULL: analyze_audio,
+    MODE_STREAMING: analyze_audio_streaming,
+    MODE_SEGMENT: analyze_audio_segment,
+}
+
+
+def get_num_workers(device=None, cpu_count=None):
+    """
+    Return how many diarization workers fit on the machine: a single one shares the GPU best, and on the CPU, each
+    worker gets THREADS_PER_WORKER cores.
+    """
+    if get_device(device).type == 'cuda':
+        return 1
+    cpu_count = cpu_count or os.cpu_count() or 1
+    return max(1, cpu_count // THREADS_PER_WORKER)
+
+
+def diarize_worker(jobs, results, device=None, mode=MODE_FULL, num_threads=None, analyze_kwargs=None):
+    """
+    Body of a long-lived diarization process: load the pipeline once, then diarize files from the jobs queue until it
+    yields None.
+
+    Args:
+        jobs (multiprocessing.Queue): (index, input_file, output_file) tuples, followed by None.
+        results (multiprocessing.Queue): Receives one result dict per job.
+        device (str): Device the pipeline runs on. Defaults to the GPU when there is one.
+        mode (str): One of ANALYZERS: "full" (analyze_audio()), "streaming" (analyze_audio_streaming()), or
+            "segment" (analyze_audio_segment()).
+        num_threads (int): Number of threads torch uses in this worker.
+        analyze_kwargs (dict): Extra arguments of the analyze function.
+    """
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    analyze = ANALYZERS[mode]
+    load_pipeline(device)
+
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+
+        index, input_file, output_file = job
+        start_time = time.perf_counter()
+        try:
+            analyze(input_file, output_file, device=device, **(analyze_kwargs or {}))
+            error = None
+        except Exception as e:
+            error = str(e)
+            print(f"Failed to diarize {input_file}: {error}")
+
+        results.put({
+            "index": index,
+            "input": str(input_file),
+            "output": str(get_output_path(output_file, (analyze_kwargs or {}).get('output_format', FORMAT_JSON))),
+            "ok": error is None,
+            "error": error,
+            "duration_s": time.perf_counter() - start_time,
+        })
+
+
+@traced()
+def diarize_files(jobs, num_workers=None, device=None, mode=MODE_FULL, **analyze_kwargs):
+    """
+    Diarize several files with warm worker processes, each loading the model once and then working through a shared
+    queue of files.
+
+    Args:
+        jobs (list): (input_file, output_file) tuples. output_file gets a .json suffix (or .intervals, with
+            output_format="intervals"), like in analyze_audio().
+        num_workers (int): Number of worker processes. Each one holds its own copy of the model. Defaults to
+            get_num_workers().
+        mode (str): How each file is diarized (see diarize_worker()).
+        analyze_kwargs: Passed to the analyze function of the mode, e.g. window_s and overlap_s for "streaming".
+
+    Returns:
+        list: One result dict ("input", "output", "ok", "error", "duration_s") per job, in the same order as jobs.
+    """
+    context = multiprocessing.get_context(START_METHOD)
+    job_queue = context.Queue()
+    result_queue = context.Queue()
+    num_workers = max(1, min(num_workers or get_num_workers(device), len(jobs)))
+    # Split the cores between the workers, instead of letting every one of them use them all
+    num_threads = None if get_device(device).type == 'cuda' else max(1, (os.cpu_count() or 1) // num_workers)
+
+    workers = [context.Process(target=diarize_worker,
+                               args=(job_queue, result_queue, device, mode, num_threads, analyze_kwargs))
+               for _ in range(num_workers)]
+    for worker in workers:
+        worker.start()
+    for index, (input_file, output_file) in enumerate(jobs):
+        job_queue.put((index, input_file, output_file))
+    for _ in workers:
+        job_queue.put(None)
+
+    results = [None] * len(jobs)
+    remaining = len(jobs)
+    while remaining:
+        try:
+            result = result_queue.get(timeout=POLL_INTERVAL_S)
+        except queue.Empty:
+            if any(worker.is_alive() for worker in workers):
+                continue
+            # Every worker is gone (e.g. killed for running out of memory): the remaining jobs will never be done
+            break
+        results[result.pop("index")] = result
+        remaining -= 1
+
+    for worker in workers:
+        worker.join()
+
+    for index, (input_file, output_file) in enumerate(jobs):
+        if results[index] is None:
+            results[index] = {
+                "input": str(input_file),
+                "output": str(get_output_path(output_file, analyze_kwargs.get('output_format', FORMAT_JSON))),
+                "ok": False,
+                "error": "The diarization worker exited before finishing this file",
+                "duration_s": 0,
+            }
+
+    print(f"Diarized {sum(result['ok'] for result in results)}/{len(results)} files with {num_workers} worker(s).")
+    return results
+
+
+@traced()
+def analyze_audio_dir(input_dir, output_file, num_workers=None, device=None):
+    """
+    Diarize the segment_N.wav files written by split_wav in parallel, and merge them into a single diarization JSON
+    file for the whole recording.
+
+    The result of each segment is kept in a <output_file>_segments directory next to the merged file.
+
+    Args:
+        input_dir (str): Directory containing the segments.
+        output_file (str): Path to the merged JSON file. Gets a .json suffix.
+        num_workers (int): Number of segments diarized at once. Defaults to get_num_workers().
+        device (str): Device the pipeline runs on. Defaults to the GPU when there is one.
+    """
+    segment_files = get_segment_files(input_dir)
+    if not segment_files:
+        raise ValueError(f"{input_dir} does not contain any segment_N.wav file.")
+    offsets = get_segment_offsets(segment_files)
+
+    output_file = Path(output_file).with_suffix('.json')
+    segments_dir = output_file.parent / f"{output_file.stem}_segments"
+    segments_dir.mkdir(parents=True, exist_ok=True)
+
+    results = diarize_files([(segment_file, segments_dir / segment_file.stem) for segment_file in segment_files],
+                            num_workers, device, MODE_SEGMENT)
+    failed = [result['input'] for result in results if not result['ok']]
+    if failed:
+        raise RuntimeError(f"Could not diarize {len(failed)} segment(s), the merged result would have gaps: "
+                           f"{', '.join(failed)}")
+
+    return merge_segment_results([result['output'] for result in results], offsets, output_file)
+
+
+@traced()
+def analyze_video_audio(input_video, output_file, in_memory=False, num_workers=None, device=None,
+                        segment_duration=SEGMENT_DURATION):
+    """
+    Diarize the audio track of a video, decoding it only once, straight into the 16 kHz mono format of the pipeline.
+
+    Args:
+        input_video (str): Path to the video.
+        output_file (str): Path to the JSON file. Gets a .json suffix.
+        in_memory (bool): If true, the whole track is diarized at once from memory. Otherwise, it is streamed into
+            temporary segment_duration-long WAV segments, diarized in parallel and merged (see analyze_audio_dir()).
+        num_workers (int): Number of segments diarized at once. Defaults to get_num_workers().
+        device (str): Device the pipeline runs on. Defaults to the GPU when there is one.
+    """
+    if in_memory:
+        analyze_audio(to_pipeline_input(read_audio(input_video), SAMPLE_RATE), output_file, device)
+        return
+
+    output_file = Path(output_file).with_suffix('.json')
+    with tempfile.TemporaryDirectory(dir=output_file.parent) as segments_dir:
+        extract_audio_segments(input_video, segments_dir, segment_duration)
+        return analyze_audio_dir(segments_dir, output_file, num_workers, device)
@@ -0,0 +1,103 @@
+import json
+import re
+from pathlib import Path
+
+import numpy as np
+
+from wav_splitter.split_wav import get_wav_duration
+from wav_splitter.wav_file import get_duration, read_wav_header
+from .streaming import DEFAULT_MIN_SIMILARITY, SpeakerTracker, get_speaker_durations
+
+# Name of the segments written by wav_splitter.split_wav_in_parallel()
+SEGMENT_PATTERN = re.compile(r'^segment_(\d+)\.wav$', re.IGNORECASE)
+SPEAKERS_SUFFIX = '.speakers.json'
+# Turns of the same speaker at most this far apart on either side of a segment boundary are one turn, cut in two
+MAX_BOUNDARY_GAP_S = 0.5
+
+
+def get_segment_files(input_dir):
+    """
+    Return the segment_N.wav files of a directory, in the order of N.
+    """
+    segments = []
+    for path in Path(input_dir).iterdir():
+        match = SEGMENT_PATTERN.match(path.name)
+        if match:
+            segments.append((int(match.group(1)), path))
+    return [path for _, path in sorted(segments)]
+
+
+def get_segment_offsets(segment_files):
+    """
+    Return the start time of every segment in the original recording, in seconds, from the length of the segments
+    before it. Lengths come from the WAV headers, and from ffprobe for formats they can't be read from.
+    """
+    offsets = []
+    offset_s = 0.0
+    for segment_file in segment_files:
+        offsets.append(offset_s)
+        header = read_wav_header(segment_file)
+        offset_s += get_duration(header) if header else get_wav_duration(segment_file)
+    return offsets
+
+
+def get_speakers_path(output_file):
+    return Path(output_file).with_suffix(SPEAKERS_SUFFIX)
+
+
+def save_segment_result(output_file, turns, labels, embeddings):
+    """
+    Write the turns of a segment as diarization JSON, and its speaker embeddings to a sidecar file next to it.
+    """
+    with open(output_file, 'w') as f:
+        json.dump([{"start": start, "stop": end, "speaker": speaker} for start, end, speaker in turns], f, indent=4)
+    with open(get_speakers_path(output_file), 'w') as f:
+        json.dump({"labels": list(labels), "embeddings": np.asarray(embeddings).tolist()}, f)
+
+
+def load_segment_result(output_file):
+    with open(output_file, 'r') as f:
+        turns = [(entry['start'], entry['stop'], entry['speaker']) for entry in json.load(f)]
+    with open(get_speakers_path(output_file), 'r') as f:
+        speakers = json.load(f)
+    return turns, speakers['labels'], np.asarray(speakers['embeddings'], dtype=np.float32)
+
+
+def merge_segment_results(result_files, offsets, output_file, min_similarity=DEFAULT_MIN_SIMILARITY):
+    """
+    Merge the diarization of consecutive segments into the diarization of the whole recording.
+
+    Segment times are shifted by the segment's offset, and the speakers of every segment are matched to the speakers
+    of the previous ones by their embeddings. A turn cut in two by a segment boundary is joined back.
+
+    Args:
+        result_files (list): Results of analyze_audio_segment(), in segment order.
+        offsets (list): Start time of each segment, in seconds.
+        output_file (str): Path to the merged {"start", "stop", "speaker"} JSON file.
+
+    Returns:
+        list: The merged turns.
+    """
+    tracker = SpeakerTracker(min_similarity)
+    results = []
+    for result_file, offset_s in zip(result_files, offsets):
+        turns, labels, embeddings = load_segment_result(result_file)
+        speakers = tracker.match(labels, embeddings, get_speaker_durations(turns, labels))
+
+        for i, (start, end, speaker) in enumerate(turns):
+            speaker = f"speaker_{speakers[speaker]}"
+            start += offset_s
+            end += offset_s
+            previous = results[-1] if results else None
+            if (i == 0 and previous and previous['speaker'] == speaker
+                    and start - previous['stop'] <= MAX_BOUNDARY_GAP_S):
+                previous['stop'] = round(end, 1)
+                continue
+            results.append({"start": round(start, 1), "stop": round(end, 1), "speaker": speaker})
+
+    with open(output_file, 'w') as f:
+        json.dump(results, f, indent=4)
+
+    print(f"Merged {len(result_files)} segments into {output_file}: {len(results)} turns of {tracker.num_speakers} "
+          f"speakers.")
+    return results
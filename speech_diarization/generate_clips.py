@@ -1,10 +1,14 @@
-import json
 import os
+from functools import partial
 from pathlib import Path
 
-import ffmpeg
-
 from decorators.all_decorators import record_performance
+from decorators.tracing import count, span
+from video_cutter.cut_clip import CUT_ENCODE
+from video_cutter.extract_segments import CUT_MODE_METHODS, extract_segment_sets, extract_segments
+from video_cutter.keyframe_index import load_keyframe_index
+from video_cutter.render_pool import DEFAULT_ENCODER_THREADS, describe_error, render_jobs
+from .merge_turns import DEFAULT_MAX_GAP_S, DEFAULT_MIN_TURN_S, consolidate_turns, iter_turns
 
 ANALYZE_DURATION = '10M'
 PROBE_SIZE = '50M'
@@ -17,31 +21,49 @@ def convert_seconds(seconds):
     return hours, minutes, remaining_seconds
 
 
-def parse_data(json_file_path):
-    with open(json_file_path, 'r') as file:
-        data = json.load(file)
+def parse_data(json_file_path, max_gap_s=DEFAULT_MAX_GAP_S, min_turn_s=DEFAULT_MIN_TURN_S):
+    """
+    Return {speaker: clips} from a diarization JSON file, where each speaker's turns are consolidated into clips (see
+    consolidate_turns()), so that a full-length episode yields a manageable number of cuts.
+    """
+    num_turns = 0
 
-    speaker_data = {}
+    def count_turns(turns):
+        nonlocal num_turns
+        for turn in turns:
+            num_turns += 1
+            yield turn
 
-    for entry in data:
-        speaker = entry['speaker']
-        start = entry['start']
-        stop = entry['stop']
-        duration = stop - start
+    speaker_data = {}
+    with span('consolidate'):
+        for speaker, clip in consolidate_turns(count_turns(iter_turns(json_file_path)), max_gap_s, min_turn_s):
+            speaker_data.setdefault(speaker, []).append(clip)
+
+        num_clips = sum(len(clips) for clips in speaker_data.values())
+        count('turns', num_turns)
+        count('clips', num_clips)
+    print(f"Consolidated {num_turns} turns into {num_clips} clips (merging gaps up to {max_gap_s}s, dropping clips "
+          f"under {min_turn_s}s).")
+    return speaker_data
 
-        if duration <= 0.3:
-            continue
-        if start > 600:
-            break
 
-        if speaker not in speaker_data:
-            speaker_data[speaker] = []
-        speaker_data[speaker].append({"from": start, "to": stop})
+def print_speaker_summary(speaker, clips):
+    total_entries = len(clips)
+    total_duration_s = sum([clip['to'] - clip['from'] for clip in clips])
+    hours, minutes, seconds = convert_seconds(total_duration_s)
+    print(
+        f"Generating clips for speaker {speaker} (total entries: {total_entries}, total duration: {hours}h {minutes}m {seconds}s)")
 
-    return speaker_data
 
+def generate_clips(input_video, speaker_data, output_dir, cut_mode=CUT_ENCODE, max_workers=None,
+                   encoder_threads=DEFAULT_ENCODER_THREADS, single_decode=False):
+    """
+    Write one video per speaker, made of all of the speaker's turns.
 
-def generate_clips(input_video, speaker_data, output_dir):
+    Each speaker's video is a single ffmpeg job that cuts every turn of the speaker (see extract_segments()), and the
+    speakers are rendered concurrently. With single_decode, all of them are written by one ffmpeg process instead,
+    which decodes the source once and splits the frames between the speakers.
+    """
     if os.path.isfile(input_video):
         print(f"Input is a file: {input_video}")
     elif input_video.is_dir():
@@ -50,53 +72,37 @@ def generate_clips(input_video, speaker_data, output_dir):
         print(f"Input is neither a file nor a directory: {input_video}")
 
     for speaker, clips in speaker_data.items():
-        total_entries = len(clips)
-        total_duration_s = sum([clip['to'] - clip['from'] for clip in clips])
-        hours, minutes, seconds = convert_seconds(total_duration_s)
-        print(
-            f"Generating clips for speaker {speaker} (total entries: {total_entries}, total duration: {hours}h {minutes}m {seconds}s)")
-
-        temp_files = []
-        for i, clip in enumerate(clips):
-            start = clip['from']
-            stop = clip['to']
-            duration = stop - start
-            temp_file_path = Path(output_dir) / f"temp_{i}.mp4"
-            ffmpeg.input(input_video, ss=start, t=duration, analyzeduration=ANALYZE_DURATION,
-                         probesize=PROBE_SIZE).output(str(temp_file_path)).run()
-            temp_files.append(temp_file_path)
-        print(f"Going to generate {len(temp_files)}x temp files")
-
-        concat_file_path = Path(output_dir) / "concat_list.txt"
-        with open(concat_file_path, 'w') as f:
-            for temp_file_path in temp_files:
-                f.write(f"file '{os.path.abspath(temp_file_path)}'\n")
-            print(f"Created temporary file: {str(concat_file_path)}")
-
-        try:
-            output_video_path = Path(output_dir) / f"{speaker}.mp4"
-            (ffmpeg.input(
-                str(concat_file_path),
-                format='concat',
-                safe=0)
-             .output(str(output_video_path), c='copy').run())
-        except Exception as e:
-            print(f"An error occurred while generating the output video for speaker {speaker}: {str(e)}")
-
-        finally:
-            # Clean up the temporary files
-            os.remove(concat_file_path)
-            for temp_file_path in temp_files:
-                os.remove(temp_file_path)
-            print(f"Removed temporary file: {str(concat_file_path)}")
-
-            if 'output_video_path' in locals():
-                print(f"✨ Done! Created: {str(output_video_path)}")
-            else:
-                print(f"Process finished for speaker {speaker}")
+        print_speaker_summary(speaker, clips)
+    output_paths = {speaker: Path(output_dir) / f"{speaker}.mp4" for speaker in speaker_data}
+
+    if single_decode:
+        if cut_mode != CUT_ENCODE:
+            raise ValueError(f'A single decode only works with the "{CUT_ENCODE}" cut mode.')
+        extract_segment_sets(input_video, {output_paths[speaker]: clips for speaker, clips in speaker_data.items()},
+                             threads=encoder_threads)
+        for output_video_path in output_paths.values():
+            print(f"✨ Done! Created: {str(output_video_path)}")
+        return
+
+    # The keyframe index is shared by every speaker's clips
+    keyframes = load_keyframe_index(input_video) if cut_mode != CUT_ENCODE else None
+    method = CUT_MODE_METHODS[cut_mode]
+
+    # Every job writes its own output, and any intermediate file to its own temporary directory
+    jobs = [(speaker, partial(extract_segments, input_video, clips, output_paths[speaker], method, keyframes,
+                              quiet=True, threads=encoder_threads))
+            for speaker, clips in speaker_data.items() if clips]
+    for result in render_jobs(jobs, max_workers, encoder_threads):
+        if result['ok']:
+            print(f"✨ Done! Created: {str(output_paths[result['id']])}")
+        else:
+            print(f"An error occurred while generating the output video for speaker {result['id']}: "
+                  f"{describe_error(result['error'])}")
 
 
 @record_performance
-def process_audio_clips(input_video, input_json, output_dir):
-    parsed_input_json = parse_data(input_json)
-    generate_clips(input_video, parsed_input_json, output_dir)
+def process_audio_clips(input_video, input_json, output_dir, cut_mode=CUT_ENCODE, max_workers=None,
+                        encoder_threads=DEFAULT_ENCODER_THREADS, single_decode=False, max_gap_s=DEFAULT_MAX_GAP_S,
+                        min_turn_s=DEFAULT_MIN_TURN_S):
+    parsed_input_json = parse_data(input_json, max_gap_s, min_turn_s)
+    generate_clips(input_video, parsed_input_json, output_dir, cut_mode, max_workers, encoder_threads, single_decode)
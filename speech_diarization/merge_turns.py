@@ -0,0 +1,74 @@
+import json
+
+from video_cutter.interval_file import IntervalFile, is_interval_file
+
+DEFAULT_MAX_GAP_S = 1.0
+DEFAULT_MIN_TURN_S = 0.5
+READ_SIZE = 1 << 16
+# What separates the entries of a JSON array
+SEPARATORS = ' \t\r\n[],'
+
+
+def iter_turns(json_file_path):
+    """
+    Yield the {"start", "stop", "speaker"} turns of a diarization JSON file one by one, decoding the file in chunks
+    instead of loading all of it at once. Interval files (see video_cutter.interval_file) are memory-mapped instead.
+    """
+    if is_interval_file(json_file_path):
+        yield from IntervalFile(json_file_path)
+        return
+
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    eof = False
+    with open(json_file_path, 'r') as file:
+        while True:
+            while position < len(buffer) and buffer[position] in SEPARATORS:
+                position += 1
+            if position < len(buffer):
+                try:
+                    turn, position = decoder.raw_decode(buffer, position)
+                    yield turn
+                    continue
+                except json.JSONDecodeError:
+                    # The entry is cut by the end of the chunk, unless there is nothing left to read
+                    if eof:
+                        raise
+            elif eof:
+                return
+
+            chunk = file.read(READ_SIZE)
+            eof = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+
+
+def consolidate_turns(turns, max_gap_s=DEFAULT_MAX_GAP_S, min_turn_s=DEFAULT_MIN_TURN_S):
+    """
+    Merge each speaker's consecutive turns that are at most max_gap_s apart, and drop what is still shorter than
+    min_turn_s once merged (crosstalk, backchannels).
+
+    Only the turn each speaker is currently building is held in memory, so turns can be streamed in from a file of
+    any length.
+
+    Args:
+        turns (Iterable[dict]): {"start", "stop", "speaker"} turns, sorted by start.
+
+    Yields:
+        tuple: (speaker, {"from", "to"}) clips. Each speaker's clips come in order.
+    """
+    pending = {}
+    for turn in turns:
+        speaker = turn['speaker']
+        clip = pending.get(speaker)
+        if clip is not None and turn['start'] - clip['to'] <= max_gap_s:
+            clip['to'] = max(clip['to'], turn['stop'])
+            continue
+        if clip is not None and clip['to'] - clip['from'] >= min_turn_s:
+            yield speaker, clip
+        pending[speaker] = {"from": turn['start'], "to": turn['stop']}
+
+    for speaker, clip in pending.items():
+        if clip['to'] - clip['from'] >= min_turn_s:
+            yield speaker, clip
@@ -0,0 +1,270 @@
+import json
+import textwrap
+import wave
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from decorators.tracing import count, span
+from video_cutter.interval_file import INTERVALS_SUFFIX, KIND_TURNS, IntervalWriter
+
+DEFAULT_WINDOW_S = 10 * 60  # Same length as the segments written by split_wav
+DEFAULT_OVERLAP_S = 30
+# pyannote/speaker-diarization-3.1 clusters embeddings closer than a cosine distance of ~0.70: use the same bar to
+# decide whether a speaker of a window is a speaker already heard in a previous one
+DEFAULT_MIN_SIMILARITY = 0.3
+
+# Scale of the integer PCM sample widths the wave module can read
+PCM_FORMATS = {
+    1: (np.uint8, 128, 128.0),
+    2: (np.int16, 0, 32768.0),
+    4: (np.int32, 0, 2147483648.0),
+}
+
+
+def get_window_starts(total_s, window_s, overlap_s):
+    """
+    Return the start time, in seconds, of every window needed to cover total_s seconds of audio.
+    """
+    if overlap_s >= window_s:
+        raise ValueError(f'The overlap ({overlap_s}s) must be shorter than the window ({window_s}s).')
+    step_s = window_s - overlap_s
+    starts = [0.0]
+    while starts[-1] + window_s < total_s:
+        starts.append(starts[-1] + step_s)
+    return starts
+
+
+def read_wav_windows(input_file, window_s=DEFAULT_WINDOW_S, overlap_s=DEFAULT_OVERLAP_S):
+    """
+    Yield (start_s, samples, sample_rate) for every overlapping window of a PCM WAV file, where samples is a mono
+    float32 array in [-1, 1]. Only one window is held in memory at a time.
+    """
+    with wave.open(str(input_file), 'rb') as wav:
+        num_channels = wav.getnchannels()
+        sample_rate = wav.getframerate()
+        total_frames = wav.getnframes()
+        if wav.getsampwidth() not in PCM_FORMATS:
+            raise ValueError(f'Unsupported sample width in {input_file}: {wav.getsampwidth() * 8} bits. Convert it to '
+                             f'16-bit PCM first.')
+        dtype, zero, scale = PCM_FORMATS[wav.getsampwidth()]
+
+        for start_s in get_window_starts(total_frames / sample_rate, window_s, overlap_s):
+            start_frame = round(start_s * sample_rate)
+            wav.setpos(start_frame)
+            data = np.frombuffer(wav.readframes(round(window_s * sample_rate)), dtype=dtype)
+            samples = (data.astype(np.float32) - zero) / scale
+            if num_channels > 1:
+                samples = samples.reshape(-1, num_channels).mean(axis=1)
+            yield start_frame / sample_rate, samples, sample_rate
+
+
+def get_owned_region(window_start_s, window_s, overlap_s, is_first, is_last):
+    """
+    Return the [start, end) part of a window whose turns it reports. Neighbouring windows split their overlap in half,
+    so that every turn is reported exactly once, by the window that saw the most context around it.
+    """
+    start_s = 0 if is_first else window_start_s + overlap_s / 2
+    end_s = float('inf') if is_last else window_start_s + window_s - overlap_s / 2
+    return start_s, end_s
+
+
+class SpeakerTracker:
+    """
+    Give the speakers of every window a global identity, by comparing their embeddings to the centroid of every
+    speaker heard so far.
+    """
+
+    def __init__(self, min_similarity=DEFAULT_MIN_SIMILARITY):
+        self.min_similarity = min_similarity
+        self.centroids = []
+        self.weights = []
+        self.num_speakers = 0
+
+    def new_speaker(self):
+        label = f"SPEAKER_{self.num_speakers:02d}"
+        self.num_speakers += 1
+        return label
+
+    def match(self, local_labels, embeddings, durations):
+        """
+        Return {local label: global label} for the speakers of one window.
+
+        Args:
+            local_labels (list): Speaker labels of the window, as returned by the pipeline.
+            embeddings (np.ndarray): One embedding per local label, in the same order.
+            durations (list): Speech duration of each local label in the window, used to weigh centroid updates.
+        """
+        mapping = {}
+        usable = []
+        for i, label in enumerate(local_labels):
+            embedding = embeddings[i]
+            norm = np.linalg.norm(embedding)
+            if not np.isfinite(norm) or norm == 0:
+                # Speakers with too little speech have no embedding: they can't be recognised later on either
+                mapping[label] = self.new_speaker()
+                self.centroids.append(None)
+                self.weights.append(0)
+            else:
+                usable.append((i, embedding / norm))
+
+        # Greedily pair the most similar (local, global) speakers first. Two speakers of the same window are never
+        # merged, since the pipeline already told them apart.
+        candidates = []
+        for i, embedding in usable:
+            for j, centroid in enumerate(self.centroids):
+                if centroid is not None:
+                    similarity = float(embedding @ centroid / np.linalg.norm(centroid))
+                    if similarity >= self.min_similarity:
+                        candidates.append((similarity, i, j))
+
+        matched = {}
+        taken = set()
+        for similarity, i, j in sorted(candidates, reverse=True):
+            if i not in matched and j not in taken:
+                matched[i] = j
+                taken.add(j)
+
+        for i, embedding in usable:
+            if i in matched:
+                j = matched[i]
+                mapping[local_labels[i]] = f"SPEAKER_{j:02d}"
+            else:
+                j = len(self.centroids)
+                mapping[local_labels[i]] = self.new_speaker()
+                self.centroids.append(np.zeros_like(embedding))
+                self.weights.append(0)
+            # Running centroid, weighed by how much each window heard of the speaker
+            weight = max(durations[i], 1e-3)
+            self.centroids[j] = self.centroids[j] + weight * embedding
+            self.weights[j] += weight
+
+        return mapping
+
+
+class JsonArrayWriter:
+    """
+    Write a JSON array one entry at a time, laid out like json.dump(entries, f, indent=4), so that results reach the
+    disk as they are produced.
+    """
+
+    def __init__(self, output_file):
+        self.output_file = output_file
+        self.file = None
+        self.count = 0
+
+    def __enter__(self):
+        self.file = open(self.output_file, 'w')
+        self.file.write('[')
+        return self
+
+    def write(self, entry):
+        self.file.write(',\n' if self.count else '\n')
+        self.file.write(textwrap.indent(json.dumps(entry, indent=4), '    '))
+        self.count += 1
+
+    def flush(self):
+        self.file.flush()
+
+    def __exit__(self, *exc_info):
+        self.file.write('\n]' if self.count else ']')
+        self.file.close()
+
+
+def to_pipeline_input(samples, sample_rate):
+    """
+    Wrap a mono float32 array into the in-memory audio input pyannote pipelines accept.
+    """
+    return {"waveform": torch.from_numpy(samples).unsqueeze(0), "sample_rate": sample_rate}
+
+
+def diarize_with_embeddings(pipeline, audio, **pipeline_kwargs):
+    """
+    Diarize audio (a file path, or a {"waveform", "sample_rate"} dict) and keep the speaker embeddings.
+
+    Returns:
+        tuple: (turns, labels, embeddings), where turns are (start, end, label) tuples, and embeddings[i] is the
+            embedding of labels[i].
+    """
+    diarization, embeddings = pipeline(audio, return_embeddings=True, **pipeline_kwargs)
+    if embeddings is None:
+        raise ValueError('The diarization pipeline returned no speaker embeddings, which are needed to match speakers '
+                         'across windows or segments.')
+
+    turns = [(turn.start, turn.end, speaker) for turn, _, speaker in diarization.itertracks(yield_label=True)]
+    return turns, diarization.labels(), np.asarray(embeddings)
+
+
+def get_speaker_durations(turns, labels):
+    """
+    Return the total speech duration of each label, in the same order as labels.
+    """
+    return [sum(end - start for start, end, speaker in turns if speaker == label) for label in labels]
+
+
+def diarize_window(pipeline, samples, sample_rate, **pipeline_kwargs):
+    """
+    Diarize one window of audio, given as a mono float32 array. Turn times are relative to the window.
+    """
+    return diarize_with_embeddings(pipeline, to_pipeline_input(samples, sample_rate), **pipeline_kwargs)
+
+
+def diarize_stream(pipeline, input_file, output_file, window_s=DEFAULT_WINDOW_S, overlap_s=DEFAULT_OVERLAP_S,
+                   min_similarity=DEFAULT_MIN_SIMILARITY, **pipeline_kwargs):
+    """
+    Diarize a WAV file in overlapping windows, so that memory use depends on the window length instead of the length
+    of the recording. Speakers are matched across windows by their embeddings.
+
+    Args:
+        pipeline: A pyannote speaker diarization pipeline (or a stand-in, see stub_pipeline.StubPipeline), called with
+            return_embeddings=True.
+        input_file (str): Path to a PCM WAV file.
+        output_file (str): Path to the JSON file the {"start", "stop", "speaker"} turns are written to, as soon as
+            each window is diarized. Written as an interval file instead when its suffix is .intervals.
+        window_s (float): Length of each window, in seconds.
+        overlap_s (float): Overlap between consecutive windows, in seconds.
+        min_similarity (float): Cosine similarity above which a speaker is considered already heard.
+        pipeline_kwargs: Passed to every pipeline call, e.g. max_speakers.
+
+    Returns:
+        int: Number of turns written.
+    """
+    tracker = SpeakerTracker(min_similarity)
+
+    with wave.open(str(input_file), 'rb') as wav:
+        total_s = wav.getnframes() / wav.getframerate()
+    num_windows = len(get_window_starts(total_s, window_s, overlap_s))
+
+    writer = (IntervalWriter(output_file, KIND_TURNS) if Path(output_file).suffix == INTERVALS_SUFFIX
+              else JsonArrayWriter(output_file))
+    with writer:
+        windows = read_wav_windows(input_file, window_s, overlap_s)
+        for i, (window_start_s, samples, sample_rate) in enumerate(windows):
+            print(f"Diarizing window {i + 1}/{num_windows} ({window_start_s:.0f}s - "
+                  f"{window_start_s + len(samples) / sample_rate:.0f}s)...")
+            with span('diarize_window', start_s=window_start_s):
+                turns, labels, embeddings = diarize_window(pipeline, samples, sample_rate, **pipeline_kwargs)
+            count('windows')
+            count('audio_s', len(samples) / sample_rate)
+
+            speakers = tracker.match(labels, embeddings, get_speaker_durations(turns, labels))
+
+            region_start_s, region_end_s = get_owned_region(window_start_s, window_s, overlap_s, i == 0,
+                                                            i == num_windows - 1)
+            for start, end, speaker in turns:
+                start += window_start_s
+                end += window_start_s
+                if not region_start_s <= (start + end) / 2 < region_end_s:
+                    continue
+                result = {
+                    "start": round(start, 1),
+                    "stop": round(end, 1),
+                    "speaker": f"speaker_{speakers[speaker]}"
+                }
+                writer.write(result)
+                print(f"start={result['start']}s stop={result['stop']}s {result['speaker']}")
+            writer.flush()
+
+        print(f"Found {tracker.num_speakers} speakers in {num_windows} windows.")
+        return writer.count
@@ -0,0 +1,91 @@
+import wave
+from collections import namedtuple
+
+import numpy as np
+
+from .streaming import read_wav_windows
+
+StubSegment = namedtuple('StubSegment', ['start', 'end'])
+
+
+class StubAnnotation:
+    """
+    The subset of pyannote.core.Annotation used on diarization results.
+    """
+
+    def __init__(self, tracks):
+        # (StubSegment, track, label) tuples, sorted by start time
+        self.tracks = tracks
+
+    def itertracks(self, yield_label=False):
+        for segment, track, label in self.tracks:
+            yield (segment, track, label) if yield_label else (segment, track)
+
+    def labels(self):
+        return sorted({label for _, _, label in self.tracks})
+
+
+class StubPipeline:
+    """
+    A CPU-only stand-in for the pyannote diarization pipeline, for tests and benchmarks: every distinct dominant tone
+    in the audio is a speaker. Pairs with multi-tone "speaker" WAV fixtures, given as a {"waveform", "sample_rate"}
+    dict or as the path of a PCM WAV file.
+
+    Args:
+        frame_s (float): Length of the frames the audio is classified in, in seconds.
+        band_hz (float): Width of the frequency bands tones are grouped by.
+        min_rms (float): RMS below which a frame is silent.
+        embedding_size (int): Length of the speaker embeddings. Each band gets a one-hot embedding.
+    """
+
+    def __init__(self, frame_s=0.1, band_hz=50, min_rms=0.01, embedding_size=256):
+        self.frame_s = frame_s
+        self.band_hz = band_hz
+        self.min_rms = min_rms
+        self.embedding_size = embedding_size
+
+    def to(self, device):
+        return self
+
+    def __call__(self, file, return_embeddings=False, **kwargs):
+        if isinstance(file, dict):
+            samples = np.asarray(file["waveform"], dtype=np.float32).mean(axis=0)
+            sample_rate = file["sample_rate"]
+        else:
+            with wave.open(str(file), 'rb') as wav:
+                duration_s = wav.getnframes() / wav.getframerate()
+            # A single window holding the whole file
+            _, samples, sample_rate = next(read_wav_windows(file, window_s=duration_s + 1, overlap_s=0))
+        frame_length = max(int(self.frame_s * sample_rate), 1)
+        num_frames = len(samples) // frame_length
+        frames = samples[:num_frames * frame_length].reshape(num_frames, frame_length)
+
+        # A Hann window keeps frames that only catch the edge of a tone from being labelled with a neighbouring band:
+        # the edge is faded out, and the frame is then too quiet to be labelled at all
+        frames = frames * np.hanning(frame_length)
+        peak_hz = np.abs(np.fft.rfft(frames, axis=1)).argmax(axis=1) * sample_rate / frame_length
+        bands = np.rint(peak_hz / self.band_hz).astype(int)
+        bands[np.sqrt((frames ** 2).mean(axis=1)) < self.min_rms] = -1
+
+        # Labels are given in order of first appearance, like pyannote does
+        labels = {}
+        tracks = []
+        run_start = 0
+        for i in range(1, num_frames + 1):
+            if i < num_frames and bands[i] == bands[run_start]:
+                continue
+            band = bands[run_start]
+            if band >= 0:
+                label = labels.setdefault(band, f"SPEAKER_{len(labels):02d}")
+                tracks.append((StubSegment(run_start * self.frame_s, i * self.frame_s), '_', label))
+            run_start = i
+
+        annotation = StubAnnotation(tracks)
+        if not return_embeddings:
+            return annotation
+
+        bands_by_label = {label: band for band, label in labels.items()}
+        embeddings = np.zeros((len(labels), self.embedding_size), dtype=np.float32)
+        for i, label in enumerate(annotation.labels()):
+            embeddings[i, min(bands_by_label[label], self.embedding_size - 1)] = 1
+        return annotation, embeddings
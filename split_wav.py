@@ -11,7 +11,8 @@ def main():
     parser.add_argument('input_file', type=str, help='Path to the input WAV file.')
     parser.add_argument('output_dir', type=str, help='Path to the output directory.')
     parser.add_argument('--num-cores', type=int, default=psutil.cpu_count() // 2,
-                        help='Number of CPU cores to use for splitting. Defaults to half of the machine\'s cores.')
+                        help='Number of CPU cores to use for splitting with ffmpeg, for WAV files that can\'t be split '
+                             'natively. Defaults to half of the machine\'s cores.')
 
     args = parser.parse_args()
 
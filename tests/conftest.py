@@ -0,0 +1,64 @@
+import subprocess
+
+import cv2 as cv
+import numpy as np
+import pytest
+
+FPS = 30
+FRAME_SIZE = (160, 96)
+NUM_FRAMES = 360
+# Frame ranges where a white block crosses the frame, once each
+BURSTS = [(50, 80), (140, 175), (200, 215), (290, 330)]
+
+
+def write_motion_video(path, num_frames=NUM_FRAMES, bursts=BURSTS, fps=FPS):
+    """
+    Write a small video of a static textured background, crossed by a white block during each burst. Motion JPEG
+    decodes identically on every machine, and seeks to any frame.
+    """
+    width, height = FRAME_SIZE
+    writer = cv.VideoWriter(str(path), cv.VideoWriter_fourcc(*'MJPG'), fps, FRAME_SIZE)
+    background = (np.random.default_rng(0).integers(0, 255, (height, width, 3)) // 4 + 64).astype(np.uint8)
+    for i in range(num_frames):
+        frame = background.copy()
+        for start, end in bursts:
+            if start <= i < end:
+                x = int((i - start) / (end - start) * (width - 30))
+                cv.rectangle(frame, (x, 20), (x + 30, 70), (255, 255, 255), -1)
+        writer.write(frame)
+    writer.release()
+    return str(path)
+
+
+class UnknownLengthCapture:
+    """
+    A capture whose container doesn't report its frame count, like some live recordings.
+    """
+
+    def __init__(self, input_video):
+        self.capture = cv.VideoCapture(input_video)
+
+    def get(self, prop):
+        return 0 if prop == cv.CAP_PROP_FRAME_COUNT else self.capture.get(prop)
+
+    def __getattr__(self, name):
+        return getattr(self.capture, name)
+
+
+@pytest.fixture(scope='session')
+def motion_video(tmp_path_factory):
+    return write_motion_video(tmp_path_factory.mktemp('videos') / 'motion.avi')
+
+
+@pytest.fixture(scope='session')
+def source_video(tmp_path_factory):
+    """
+    A 25 second H.264 video at 30 fps, with a keyframe every second and an AAC audio track, like the recordings the
+    clips are cut from.
+    """
+    path = tmp_path_factory.mktemp('videos') / 'source.mp4'
+    subprocess.run(['ffmpeg', '-v', 'error', '-y', '-f', 'lavfi', '-i', f'testsrc2=size=160x96:rate={FPS}:d=25',
+                    '-f', 'lavfi', '-i', 'sine=frequency=440:sample_rate=48000:d=25',
+                    '-c:v', 'libx264', '-g', str(FPS), '-sc_threshold', '0', '-c:a', 'aac', str(path)],
+                   check=True)
+    return str(path)
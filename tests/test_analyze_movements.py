@@ -0,0 +1,73 @@
+import cv2 as cv
+import numpy as np
+import pytest
+
+from vision_test.analyze_movements import (compute_motion_scores, create_back_sub, get_analysis_size, get_frame_time_ms,
+                                           read_frame, scale_white_pixel_threshold)
+from .conftest import FPS, NUM_FRAMES, UnknownLengthCapture
+
+
+@pytest.mark.parametrize('source_size, analysis_width, expected', [
+    ((1920, 1080), None, None),
+    ((1920, 1080), 0, None),
+    ((1920, 1080), 1920, None),  # Never upscaled
+    ((1920, 1080), 3840, None),
+    ((1920, 1080), 480, (480, 270)),
+    ((1920, 1080), 1000, (1000, 562)),  # 562.5, rounded to an even height
+    ((1080, 1920), 270, (270, 480)),  # Portrait
+    ((1920, 100), 10, (10, 2)),  # Never less than 2 pixels high
+])
+def test_get_analysis_size(source_size, analysis_width, expected):
+    assert get_analysis_size(source_size, analysis_width) == expected
+
+
+@pytest.mark.parametrize('analysis_size, expected', [
+    (None, 1600),
+    ((1920, 1080), 1600),
+    ((480, 270), 100),  # 16 times fewer pixels
+    ((960, 540), 400),
+])
+def test_scale_white_pixel_threshold(analysis_size, expected):
+    assert scale_white_pixel_threshold(1600, (1920, 1080), analysis_size) == expected
+
+
+def read_all_frames(input_video):
+    capture = cv.VideoCapture(input_video)
+    frames = []
+    while True:
+        ret, frame = capture.read()
+        if not ret:
+            break
+        frames.append(frame)
+    capture.release()
+    return frames
+
+
+@pytest.mark.parametrize('frame_step', [1, 3, 7])
+def test_read_frame_with_frame_step(motion_video, frame_step):
+    all_frames = read_all_frames(motion_video)
+    assert len(all_frames) == NUM_FRAMES
+
+    capture = cv.VideoCapture(motion_video)
+    positions = []
+    while True:
+        ret, frame = read_frame(capture, frame_step)
+        if frame is None:
+            assert not ret
+            break
+        position = int(capture.get(cv.CAP_PROP_POS_FRAMES))
+        positions.append(position)
+        # The frame_step-th frame of each step, at its own position and time
+        np.testing.assert_array_equal(frame, all_frames[position - 1])
+        assert get_frame_time_ms(capture) == round((position - 1) * 1000 / FPS)
+    capture.release()
+
+    # The frames left over at the end, fewer than frame_step, are skipped
+    assert positions == list(range(frame_step, NUM_FRAMES + 1, frame_step))
+
+
+def test_progress_without_frame_count(motion_video):
+    # Containers that don't report their frame count used to make the progress print divide by zero
+    scores = compute_motion_scores(UnknownLengthCapture(motion_video), create_back_sub(40, 16, False), frame_step=3)
+    assert scores['total_frames'] == 0
+    assert len(scores['frames']) == NUM_FRAMES // 3
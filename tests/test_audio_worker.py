@@ -0,0 +1,130 @@
+import json
+import os
+import time
+
+import pytest
+
+# The workers import the real pipeline module, whatever pipeline they end up running
+pytest.importorskip('dotenv')
+pytest.importorskip('pyannote.audio')
+
+import torch  # noqa: E402
+
+from benchmarks.fixtures import make_speaker_wav  # noqa: E402
+from speech_diarization import analyze_audio, audio_worker  # noqa: E402
+from speech_diarization.audio_worker import MODE_SEGMENT, MODE_STREAMING, diarize_files  # noqa: E402
+from speech_diarization.stub_pipeline import StubPipeline  # noqa: E402
+
+NUM_SPEAKERS = 3
+
+
+class StubPretrainedPipeline:
+    """
+    Stands in for pyannote's Pipeline class, counting how many times the model is loaded.
+    """
+    loads = []
+
+    @classmethod
+    def from_pretrained(cls, name, **kwargs):
+        cls.loads.append(name)
+        return StubPipeline()
+
+
+class DyingPipeline(StubPipeline):
+    """
+    A pipeline whose process gets killed, like when it runs out of memory, on files named "oom".
+    """
+
+    def __call__(self, file, **kwargs):
+        if 'oom' in str(file):
+            # Killed while working on it, once the queue has sent the results of the previous files
+            time.sleep(0.5)
+            os._exit(137)
+        return super().__call__(file, **kwargs)
+
+
+@pytest.fixture
+def pipeline_cache():
+    analyze_audio._load_pipeline.cache_clear()
+    StubPretrainedPipeline.loads = []
+    yield
+    analyze_audio._load_pipeline.cache_clear()
+
+
+@pytest.fixture
+def stub_workers(monkeypatch):
+    """
+    Run the workers with the stub pipeline: forked workers inherit it, where spawned ones would import the real one.
+    """
+    monkeypatch.setattr(audio_worker, 'START_METHOD', 'fork')
+    monkeypatch.setattr(audio_worker, 'POLL_INTERVAL_S', 0.2)
+    monkeypatch.setattr(analyze_audio, '_load_pipeline', lambda device: StubPipeline())
+
+
+@pytest.fixture
+def speaker_files(tmp_path):
+    return [(make_speaker_wav(tmp_path / f'speakers_{i}.wav', 20, NUM_SPEAKERS, seed=i), tmp_path / f'speakers_{i}.wav')
+            for i in range(3)]
+
+
+@pytest.mark.parametrize('device, cuda, expected', [
+    (None, False, 'cpu'),
+    (None, True, 'cuda'),
+    ('auto', False, 'cpu'),
+    ('auto', True, 'cuda'),
+    ('cpu', True, 'cpu'),
+    ('cuda:1', False, 'cuda:1'),
+])
+def test_get_device(monkeypatch, device, cuda, expected):
+    monkeypatch.setattr(torch.cuda, 'is_available', lambda: cuda)
+    assert analyze_audio.get_device(device) == torch.device(expected)
+
+
+def test_pipeline_is_loaded_once_per_device(monkeypatch, pipeline_cache):
+    monkeypatch.setattr(analyze_audio, 'Pipeline', StubPretrainedPipeline)
+    monkeypatch.setattr(torch.cuda, 'is_available', lambda: False)
+
+    pipeline = analyze_audio.load_pipeline()
+    # "auto" and the device it picks are the same device
+    assert analyze_audio.load_pipeline('auto') is pipeline
+    assert analyze_audio.load_pipeline('cpu') is pipeline
+    assert StubPretrainedPipeline.loads == [analyze_audio.PIPELINE_NAME]
+
+    assert analyze_audio.load_pipeline('meta') is not pipeline
+    assert len(StubPretrainedPipeline.loads) == 2
+
+
+@pytest.mark.parametrize('mode', [MODE_SEGMENT, MODE_STREAMING])
+def test_diarize_files(tmp_path, stub_workers, speaker_files, mode):
+    jobs = [(input_file, tmp_path / f'{input_file.stem}_turns') for _, input_file in speaker_files]
+    results = diarize_files(jobs, num_workers=2, device='cpu', mode=mode)
+
+    assert [result['input'] for result in results] == [str(input_file) for input_file, _ in jobs]
+    assert all(result['ok'] and result['error'] is None for result in results)
+    for (expected_turns, _), result in zip(speaker_files, results):
+        with open(result['output'], 'r') as f:
+            assert len(json.load(f)) == len(expected_turns)
+
+
+def test_diarize_files_reports_failed_files(tmp_path, stub_workers, speaker_files):
+    jobs = [(speaker_files[0][1], tmp_path / 'first'), (tmp_path / 'missing.wav', tmp_path / 'missing'),
+            (speaker_files[1][1], tmp_path / 'second')]
+    results = diarize_files(jobs, num_workers=1, device='cpu', mode=MODE_SEGMENT)
+
+    assert [result['ok'] for result in results] == [True, False, True]
+    assert 'missing.wav' in results[1]['error']
+
+
+def test_diarize_files_with_dead_workers(tmp_path, monkeypatch, stub_workers, speaker_files):
+    monkeypatch.setattr(analyze_audio, '_load_pipeline', lambda device: DyingPipeline())
+    oom_file = tmp_path / 'oom.wav'
+    oom_file.write_bytes(speaker_files[2][1].read_bytes())
+    jobs = [(speaker_files[0][1], tmp_path / 'first'), (oom_file, tmp_path / 'oom'),
+            (speaker_files[1][1], tmp_path / 'second')]
+
+    # The only worker dies on the second file: returns instead of waiting for the rest forever
+    results = diarize_files(jobs, num_workers=1, device='cpu', mode=MODE_SEGMENT)
+
+    assert [result['ok'] for result in results] == [True, False, False]
+    assert all('exited' in result['error'] for result in results[1:])
+    assert results[2]['output'] == str(tmp_path / 'second.json')
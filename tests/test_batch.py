@@ -0,0 +1,119 @@
+import os
+import shutil
+from pathlib import Path
+
+import pytest
+
+from vision_test import batch
+from vision_test.batch import (STATUS_CACHED, STATUS_DONE, STATUS_FAILED, STATUS_SKIPPED, find_batch_result,
+                               find_videos, plan_videos, run_batch)
+from vision_test.score_cache import HASH_INDEX_FILE, hash_video
+
+analyze_in_worker = batch.run_analysis
+
+
+@pytest.fixture
+def video_dir(tmp_path, motion_video):
+    video_dir = tmp_path / 'videos'
+    video_dir.mkdir()
+    for name in ('a.avi', 'b.avi'):
+        shutil.copy(motion_video, video_dir / name)
+    return video_dir
+
+
+def plan_batch(tmp_path, video_dir, force=False):
+    return plan_videos(find_videos(video_dir), tmp_path / 'batch', {'cache_dir': str(tmp_path / 'cache')},
+                       cpu_budget=1, force=force)
+
+
+def test_planning_does_not_hash_videos(tmp_path, video_dir):
+    plans = plan_batch(tmp_path, video_dir)
+
+    assert [(plan['find_result'], plan['result_key'], plan['result']) for plan in plans] == [(True, None, None)] * 2
+    assert not (tmp_path / 'cache' / HASH_INDEX_FILE).exists()
+
+
+def test_planning_uses_known_hashes(tmp_path, video_dir):
+    hash_video(video_dir / 'a.avi', tmp_path / 'cache')
+    plans = plan_batch(tmp_path, video_dir)
+
+    assert [plan['find_result'] for plan in plans] == [False, True]
+    assert plans[0]['result_key'] == find_batch_result(plans[0]['input'], plans[0]['params'])[0]
+
+
+def test_analyzed_videos_are_skipped(tmp_path, video_dir):
+    summaries = run_batch(plan_batch(tmp_path, video_dir), cpu_budget=1)
+    assert [summary['status'] for summary in summaries] == [STATUS_DONE, STATUS_CACHED]
+    movements = [summary['movements'] for summary in summaries]
+
+    # Hashed during the first batch: skipped without starting any task
+    plans = plan_batch(tmp_path, video_dir)
+    assert all(plan['result'] is not None for plan in plans)
+    summaries = run_batch(plans, cpu_budget=1)
+    assert [summary['status'] for summary in summaries] == [STATUS_SKIPPED] * 2
+    assert [summary['movements'] for summary in summaries] == movements
+
+    # Without the hash index, the analysis tasks hash the videos and find that they can skip them
+    (tmp_path / 'cache' / HASH_INDEX_FILE).unlink()
+    plans = plan_batch(tmp_path, video_dir)
+    summaries = run_batch(plans, cpu_budget=1)
+    assert [summary['status'] for summary in summaries] == [STATUS_SKIPPED] * 2
+    assert [summary['movements'] for summary in summaries] == movements
+    assert all(plan['result_key'] is not None for plan in plans)
+
+
+def test_forced_videos_are_analyzed_again(tmp_path, video_dir):
+    run_batch(plan_batch(tmp_path, video_dir), cpu_budget=1)
+    (tmp_path / 'cache' / HASH_INDEX_FILE).unlink()
+
+    summaries = run_batch(plan_batch(tmp_path, video_dir, force=True), cpu_budget=1)
+    assert STATUS_SKIPPED not in [summary['status'] for summary in summaries]
+
+
+def crash_on_first_run(input_video, *args):
+    """
+    Kill the worker process, like the kernel does when it runs out of memory, the first time a video is analyzed.
+    """
+    marker = Path(f'{input_video}.crashed')
+    if not marker.exists():
+        marker.touch()
+        os._exit(137)
+    return analyze_in_worker(input_video, *args)
+
+
+def crash_on_a(input_video, *args):
+    if Path(input_video).name == 'a.avi':
+        os._exit(137)
+    return analyze_in_worker(input_video, *args)
+
+
+@pytest.fixture
+def crashing_workers(monkeypatch):
+    """
+    Fork the workers, so that they run the crashing analysis the test puts in place of the real one.
+    """
+    monkeypatch.setattr(batch, 'START_METHOD', 'fork')
+
+    def use(run_analysis):
+        monkeypatch.setattr(batch, 'run_analysis', run_analysis)
+    return use
+
+
+@pytest.mark.parametrize('cpu_budget', [1, 2])
+def test_tasks_of_a_dead_worker_are_resubmitted(tmp_path, video_dir, crashing_workers, cpu_budget):
+    crashing_workers(crash_on_first_run)
+    plans = plan_videos(find_videos(video_dir), tmp_path / 'batch', {'cache_dir': str(tmp_path / 'cache')},
+                        cpu_budget=cpu_budget)
+    summaries = run_batch(plans, cpu_budget=cpu_budget)
+
+    assert all((video_dir / f'{name}.crashed').exists() for name in ('a.avi', 'b.avi'))
+    assert all(summary['status'] in (STATUS_DONE, STATUS_CACHED) for summary in summaries)
+    assert all(summary['movements'] for summary in summaries)
+
+
+def test_video_that_always_kills_its_worker_fails(tmp_path, video_dir, crashing_workers):
+    crashing_workers(crash_on_a)
+    summaries = run_batch(plan_batch(tmp_path, video_dir), cpu_budget=1)
+
+    assert [summary['status'] for summary in summaries] == [STATUS_FAILED, STATUS_DONE]
+    assert 'BrokenProcessPool' in summaries[0]['error']
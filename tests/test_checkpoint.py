@@ -0,0 +1,99 @@
+import json
+
+import cv2 as cv
+import numpy as np
+import pytest
+
+from vision_test.analyze_movements import compute_motion_scores, create_back_sub
+from vision_test.checkpoint import MotionCheckpoint
+from vision_test.score_cache import SCORE_DTYPE
+from .conftest import FRAME_SIZE
+
+HISTORY = 40
+VAR_THRESHOLD = 16
+
+
+def save_checkpoint(cache_dir, frames, position):
+    checkpoint = MotionCheckpoint(cache_dir, 'key')
+    times_ms = [round((frame - 1) * 1000 / 30) for frame in frames]
+    checkpoint.save(frames, times_ms, [frame * 10 for frame in frames], position)
+    return checkpoint
+
+
+def test_no_checkpoint_starts_from_the_beginning(tmp_path):
+    frames, times_ms, white_pixels, resume_position, start_position = \
+        MotionCheckpoint(tmp_path, 'key').get_resume_point(warmup_frames=100)
+
+    assert (len(frames), len(times_ms), len(white_pixels)) == (0, 0, 0)
+    assert (resume_position, start_position) == (0, 0)
+
+
+@pytest.mark.parametrize('frame_step, warmup_frames, expected_start', [
+    (1, 100, 200),
+    (3, 20, 240),
+    # The warm-up window is clamped to the start of the video
+    (3, 200, 0),
+    (1, 0, 300),
+])
+def test_resume_point_is_aligned_on_frame_step(tmp_path, frame_step, warmup_frames, expected_start):
+    frames = list(range(frame_step, 301, frame_step))
+    save_checkpoint(tmp_path, frames, 300)
+
+    loaded_frames, times_ms, white_pixels, resume_position, start_position = \
+        MotionCheckpoint(tmp_path, 'key').get_resume_point(warmup_frames, frame_step)
+
+    assert list(loaded_frames) == frames
+    assert list(white_pixels) == [frame * 10 for frame in frames]
+    assert times_ms[-1] == 9967
+    assert resume_position == 300
+    assert start_position == expected_start
+    assert start_position % frame_step == 0
+
+
+def test_scores_after_the_last_checkpoint_are_dropped(tmp_path):
+    checkpoint = save_checkpoint(tmp_path, [1, 2, 3], 3)
+    # Scores appended by an interrupted save
+    with open(checkpoint.scores_path, 'ab') as f:
+        f.write(np.zeros(2, dtype=SCORE_DTYPE).tobytes())
+
+    frames, _, _, resume_position, _ = MotionCheckpoint(tmp_path, 'key').get_resume_point(0)
+    assert list(frames) == [1, 2, 3]
+    assert resume_position == 3
+    assert checkpoint.scores_path.stat().st_size == 3 * SCORE_DTYPE.itemsize
+
+
+def test_checkpoint_of_another_version_is_removed(tmp_path):
+    checkpoint = save_checkpoint(tmp_path, [1, 2, 3], 3)
+    with open(checkpoint.meta_path, 'r') as f:
+        meta = json.load(f)
+    meta['version'] = 0
+    with open(checkpoint.meta_path, 'w') as f:
+        json.dump(meta, f)
+
+    assert MotionCheckpoint(tmp_path, 'key').get_resume_point(0)[3] == 0
+    assert not checkpoint.scores_path.exists() and not checkpoint.meta_path.exists()
+
+
+@pytest.mark.parametrize('frame_step', [1, 3])
+def test_resumed_analysis_matches_an_uninterrupted_one(tmp_path, motion_video, frame_step):
+    capture = cv.VideoCapture(motion_video)
+    full = compute_motion_scores(capture, create_back_sub(HISTORY, VAR_THRESHOLD, False), frame_step=frame_step)
+    capture.release()
+
+    # Interrupted after frame 200: the warm-up window starts at frame 80, once the first burst is over. A window that
+    # starts during a burst seeds the new model with the moving block, which is remembered for about 3 more histories.
+    interrupted = full['frames'] <= 200
+    checkpoint = MotionCheckpoint(tmp_path, 'key')
+    checkpoint.save(full['frames'][interrupted].tolist(), full['times_ms'][interrupted].tolist(),
+                    full['white_pixels'][interrupted].tolist(), int(full['frames'][interrupted][-1]))
+
+    capture = cv.VideoCapture(motion_video)
+    resumed = compute_motion_scores(capture, create_back_sub(HISTORY, VAR_THRESHOLD, False), frame_step=frame_step,
+                                    checkpoint=MotionCheckpoint(tmp_path, 'key'), warmup_frames=3 * HISTORY)
+    capture.release()
+
+    np.testing.assert_array_equal(resumed['frames'], full['frames'])
+    np.testing.assert_array_equal(resumed['times_ms'], full['times_ms'])
+    # Same tolerance as the parallel analysis: the model is rebuilt from the warm-up window
+    width, height = FRAME_SIZE
+    assert np.abs(resumed['white_pixels'] - full['white_pixels']).max() <= 0.001 * width * height
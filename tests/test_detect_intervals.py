@@ -0,0 +1,111 @@
+import numpy as np
+import pytest
+
+from video_cutter.interval_file import to_seconds
+from vision_test.detect_intervals import detect_intervals, estimate_frame_times_ms
+
+
+def detect_intervals_loop(white_pixels, fps, *, white_pixel_threshold, movement_gap_ms, padding_ms, times_ms):
+    """
+    Reference: the per-frame loop detect_intervals() replaced, which records movements frame by frame, then pads and
+    merges them, in milliseconds.
+    """
+    frame_ms = round(1000 / fps)
+    intensive_movements = []
+    for white_pixel_count, current_time in zip(white_pixels, times_ms):
+        if white_pixel_count > white_pixel_threshold:
+            if not intensive_movements or current_time > intensive_movements[-1]["to"] + movement_gap_ms:
+                intensive_movements.append({"from": current_time, "to": current_time})
+            else:
+                intensive_movements[-1]["to"] = current_time
+
+    # Post-processing
+    for movement in intensive_movements:
+        movement["to"] += frame_ms + padding_ms
+    i = 0
+    while i < len(intensive_movements) - 1:
+        if intensive_movements[i]["to"] >= intensive_movements[i + 1]["from"]:
+            intensive_movements[i]["to"] = max(intensive_movements[i]["to"], intensive_movements[i + 1]["to"])
+            del intensive_movements[i + 1]
+        else:
+            i += 1
+
+    return [{"from": to_seconds(movement["from"]), "to": to_seconds(movement["to"])}
+            for movement in intensive_movements]
+
+
+def detect_both(white_pixels, fps, times_ms, **params):
+    expected = detect_intervals_loop(white_pixels, fps, times_ms=times_ms, **params)
+    actual = detect_intervals(np.asarray(white_pixels), fps, times_ms=np.asarray(times_ms), **params)
+    return expected, actual
+
+
+def test_empty_input():
+    expected, actual = detect_both([], 30, [], white_pixel_threshold=10, movement_gap_ms=4000, padding_ms=2000)
+    assert actual == expected == []
+
+
+def test_no_intensive_frame():
+    white_pixels = [0] * 100
+    assert detect_intervals(white_pixels, 30, white_pixel_threshold=10, movement_gap_ms=4000, padding_ms=2000) == []
+
+
+def test_all_frames_above_threshold():
+    white_pixels = [100] * 300
+    times_ms = estimate_frame_times_ms(np.arange(1, 301), 30)
+    expected, actual = detect_both(white_pixels, 30, times_ms, white_pixel_threshold=10, movement_gap_ms=4000,
+                                   padding_ms=2000)
+    # The last frame starts at 9967ms, and is shown for 33ms
+    assert actual == expected == [{"from": 0, "to": 12}]
+
+
+@pytest.mark.parametrize('gap_ms, expected_count', [(4000, 1), (4001, 2)])
+def test_gap_exactly_at_movement_gap_ms(gap_ms, expected_count):
+    times_ms = [0, 1000, 1000 + gap_ms, 2000 + gap_ms]
+    expected, actual = detect_both([100] * 4, 25, times_ms, white_pixel_threshold=10, movement_gap_ms=4000,
+                                   padding_ms=0)
+    assert actual == expected
+    assert len(actual) == expected_count
+
+
+def test_gap_exactly_at_padding_merges():
+    # Without the padding, a 3s gap splits the movement. A padded end that reaches the next start merges them.
+    times_ms = [0, 3040]
+    expected, actual = detect_both([100, 100], 25, times_ms, white_pixel_threshold=10, movement_gap_ms=1000,
+                                   padding_ms=3000)
+    assert actual == expected == [{"from": 0, "to": 6.08}]
+
+    times_ms = [0, 3041]
+    expected, actual = detect_both([100, 100], 25, times_ms, white_pixel_threshold=10, movement_gap_ms=1000,
+                                   padding_ms=3000)
+    assert actual == expected
+    assert len(actual) == 2
+
+
+def test_randomized_equivalence_with_the_loop():
+    rng = np.random.default_rng(0)
+    for _ in range(2000):
+        num_frames = int(rng.integers(0, 400))
+        fps = float(rng.choice([23.976, 25, 29.97, 30, 50, 60]))
+        frame_step = int(rng.integers(1, 5))
+        frames = np.arange(1, num_frames * frame_step + 1, frame_step)
+        times_ms = estimate_frame_times_ms(frames, fps)
+        if rng.random() < 0.5:
+            # Variable frame rate: jitter the presentation times, keeping them increasing
+            times_ms = np.cumsum(rng.integers(1, 120, num_frames)).astype(np.int32)
+        # Bursts of motion over a quiet background
+        white_pixels = np.where(rng.random(num_frames) < rng.random() * 0.3, rng.integers(0, 5000, num_frames),
+                                rng.integers(0, 200, num_frames))
+        params = dict(white_pixel_threshold=int(rng.integers(0, 3000)), movement_gap_ms=int(rng.integers(0, 5000)),
+                      padding_ms=int(rng.integers(0, 4000)))
+
+        expected, actual = detect_both(white_pixels.tolist(), fps, times_ms.tolist(), **params)
+        assert actual == expected, params
+
+
+def test_default_times_follow_the_frame_rate():
+    white_pixels = np.zeros(90, dtype=np.int32)
+    white_pixels[30] = 100
+    # Frame 31 is shown at 1000ms
+    assert detect_intervals(white_pixels, 30, white_pixel_threshold=10, movement_gap_ms=4000,
+                            padding_ms=500) == [{"from": 1, "to": 1.533}]
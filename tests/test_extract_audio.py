@@ -0,0 +1,53 @@
+import subprocess
+import wave
+
+import numpy as np
+import pytest
+
+from wav_splitter.extract_audio import SAMPLE_RATE, extract_audio_segments, read_audio
+from wav_splitter.split_wav import split_wav_in_parallel
+
+# source_video lasts 25s: two whole segments and a half one
+SEGMENT_DURATION = 10
+
+
+@pytest.fixture(scope='module')
+def source_wav(source_video, tmp_path_factory):
+    """
+    The audio track of source_video as a full-length WAV file, the way it was prepared for split_wav.
+    """
+    path = tmp_path_factory.mktemp('audio') / 'source.wav'
+    subprocess.run(['ffmpeg', '-v', 'error', '-y', '-i', source_video, '-vn', '-ac', '1', '-ar', str(SAMPLE_RATE),
+                    '-c:a', 'pcm_s16le', str(path)], check=True)
+    return str(path)
+
+
+def read_wav_samples(path):
+    with wave.open(str(path), 'rb') as wav:
+        assert (wav.getnchannels(), wav.getsampwidth(), wav.getframerate()) == (1, 2, SAMPLE_RATE)
+        return np.frombuffer(wav.readframes(wav.getnframes()), dtype='<i2')
+
+
+def test_read_audio(source_video, source_wav):
+    samples = read_audio(source_video)
+
+    assert samples.dtype == np.float32
+    assert len(samples) == pytest.approx(25 * SAMPLE_RATE, abs=SAMPLE_RATE * 0.05)
+    np.testing.assert_array_equal(samples, read_wav_samples(source_wav) / np.float32(32768))
+
+
+def test_extract_audio_segments_match_split_wav(tmp_path, source_video, source_wav):
+    (tmp_path / 'extracted').mkdir()
+    (tmp_path / 'split').mkdir()
+    segment_paths = extract_audio_segments(source_video, tmp_path / 'extracted', SEGMENT_DURATION)
+    split_wav_in_parallel(source_wav, tmp_path / 'split', SEGMENT_DURATION, 1)
+
+    assert [path.rsplit('/', 1)[-1] for path in segment_paths] == ['segment_1.wav', 'segment_2.wav', 'segment_3.wav']
+    assert sorted(path.name for path in (tmp_path / 'split').iterdir()) == ['segment_1.wav', 'segment_2.wav',
+                                                                           'segment_3.wav']
+    segments = [read_wav_samples(path) for path in segment_paths]
+    # Every segment but the last holds exactly segment_duration seconds
+    assert [len(samples) for samples in segments[:-1]] == [SEGMENT_DURATION * SAMPLE_RATE] * 2
+    for i, samples in enumerate(segments):
+        np.testing.assert_array_equal(samples, read_wav_samples(tmp_path / 'split' / f'segment_{i + 1}.wav'))
+    np.testing.assert_array_equal(np.concatenate(segments), read_wav_samples(source_wav))
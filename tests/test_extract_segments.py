@@ -0,0 +1,107 @@
+import ffmpeg
+import pytest
+
+from speech_diarization.generate_clips import generate_clips
+from video_cutter import extract_segments as extract_module
+from video_cutter.extract_segments import (METHOD_SELECT, METHOD_TRIM, TRIM_CONCAT_MAX_SEGMENTS, choose_method,
+                                           extract_segment_sets, extract_segments)
+from .conftest import FPS
+
+SEGMENTS = [{'from': 12.5, 'to': 20}, {'from': 31, 'to': 47.25}]
+# One AAC frame, the most the audio of an output may be padded by
+MAX_AUDIO_DIFF_S = 1024 / 48000
+# Short segments, cut away from the frame boundaries, like the rallies of a match
+MANY_SEGMENTS = [{'from': 0.4 + i * 0.55, 'to': 0.9 + i * 0.55} for i in range(TRIM_CONCAT_MAX_SEGMENTS + 4)]
+SEGMENTS_SHORT = [{'from': 2.1, 'to': 4}, {'from': 9.25, 'to': 12.75}]
+
+
+@pytest.fixture
+def ffmpeg_runs(monkeypatch):
+    """
+    Record the arguments of every ffmpeg run instead of running it.
+    """
+    runs = []
+    monkeypatch.setattr(extract_module, 'probe_source', lambda input_video: (f'{FPS}/1', True))
+    monkeypatch.setattr(ffmpeg.nodes.OutputStream, 'run', lambda stream, **kwargs: runs.append(ffmpeg.get_args(stream)))
+    return runs
+
+
+def get_input_options(args):
+    return args[:args.index('-i')]
+
+
+def probe_output(output_video):
+    """
+    Return the video stream and the audio stream of a rendered video.
+    """
+    streams = ffmpeg.probe(str(output_video))['streams']
+    return (next(stream for stream in streams if stream['codec_type'] == 'video'),
+            next(stream for stream in streams if stream['codec_type'] == 'audio'))
+
+
+def assert_segments_rendered(output_video, segments):
+    """
+    Check that output_video lasts as long as the segments, with its audio in sync with its video, at the source's
+    frame rate.
+    """
+    video, audio = probe_output(output_video)
+    duration_s = sum(segment['to'] - segment['from'] for segment in segments)
+    assert video['r_frame_rate'] == f'{FPS}/1'
+    assert int(video['nb_frames']) == round(duration_s * FPS)
+    assert float(audio['duration']) == pytest.approx(duration_s, abs=MAX_AUDIO_DIFF_S)
+
+
+def test_choose_method():
+    assert choose_method(SEGMENTS) == METHOD_TRIM
+    assert choose_method([SEGMENTS[0]] * (TRIM_CONCAT_MAX_SEGMENTS + 1)) == METHOD_SELECT
+    assert choose_method(SEGMENTS, METHOD_SELECT) == METHOD_SELECT
+
+
+@pytest.mark.parametrize('method', [METHOD_TRIM, METHOD_SELECT])
+def test_extract_segments_decodes_segments_only(ffmpeg_runs, method):
+    extract_segments('input.mp4', SEGMENTS, 'output.mp4', method=method)
+
+    # Seek to the first segment, and stop reading after the last one
+    options = get_input_options(ffmpeg_runs[0])
+    assert options[options.index('-ss') + 1] == '12.5'
+    assert options[options.index('-t') + 1] == '34.75'
+
+
+@pytest.mark.parametrize('method', [METHOD_TRIM, METHOD_SELECT])
+def test_extract_segments_renders_segments(tmp_path, source_video, method):
+    extract_segments(source_video, MANY_SEGMENTS, tmp_path / 'output.mp4', method=method, quiet=True)
+    assert_segments_rendered(tmp_path / 'output.mp4', MANY_SEGMENTS)
+
+
+def test_extract_segment_sets_decodes_segments_only(ffmpeg_runs):
+    extract_segment_sets('input.mp4', {'a.mp4': SEGMENTS[:1], 'b.mp4': SEGMENTS[1:], 'c.mp4': []})
+
+    options = get_input_options(ffmpeg_runs[0])
+    assert options[options.index('-ss') + 1] == '12.5'
+    assert options[options.index('-t') + 1] == '34.75'
+
+
+def test_extract_segment_sets_renders_each_set(tmp_path, source_video):
+    # Interleaved like the turns of two speakers
+    segment_sets = {tmp_path / 'a.mp4': MANY_SEGMENTS[::2], tmp_path / 'b.mp4': MANY_SEGMENTS[1::2]}
+    extract_segment_sets(source_video, segment_sets, quiet=True)
+
+    for output_video, segments in segment_sets.items():
+        assert_segments_rendered(output_video, segments)
+
+
+@pytest.mark.parametrize('single_decode', [False, True])
+def test_generate_clips_renders_each_speaker(tmp_path, source_video, single_decode):
+    # One speaker with enough turns for the select method, and one with few enough for trim/concat
+    speaker_data = {'speaker_SPEAKER_00': MANY_SEGMENTS, 'speaker_SPEAKER_01': SEGMENTS_SHORT}
+    generate_clips(source_video, speaker_data, tmp_path, max_workers=2, single_decode=single_decode)
+
+    for speaker, segments in speaker_data.items():
+        assert_segments_rendered(tmp_path / f'{speaker}.mp4', segments)
+
+
+def test_extract_no_segments():
+    with pytest.raises(ValueError):
+        extract_segments('input.mp4', [], 'output.mp4')
+    with pytest.raises(ValueError):
+        extract_segment_sets('input.mp4', {'a.mp4': []})
@@ -0,0 +1,126 @@
+import io
+import queue
+import subprocess
+from array import array
+
+import cv2 as cv
+import numpy as np
+import pytest
+
+from vision_test.analyze_movements import compute_motion_scores, create_back_sub
+from vision_test.checkpoint import MotionCheckpoint
+from vision_test.ffmpeg_decode import compute_motion_scores_ffmpeg, get_resume_time, read_frame_times
+from .conftest import FRAME_SIZE
+
+HISTORY = 40
+VAR_THRESHOLD = 16
+# Same tolerance as the parallel analysis, for decoders that round differently
+MAX_WHITE_PIXELS_DIFF = 0.001 * FRAME_SIZE[0] * FRAME_SIZE[1]
+
+
+@pytest.fixture(scope='module')
+def vfr_video(tmp_path_factory):
+    """
+    A video at 30 fps for 2 seconds, then 10 fps for 2 seconds, then 30 fps again, with the same nominal frame rate
+    throughout, like footage from a phone that lowers its frame rate in low light.
+    """
+    path = tmp_path_factory.mktemp('videos') / 'vfr.mkv'
+    sources = [f'testsrc2=size={FRAME_SIZE[0]}x{FRAME_SIZE[1]}:rate={rate}:d=2' for rate in (30, 10, 30)]
+    subprocess.run(['ffmpeg', '-v', 'error', '-y',
+                    *[arg for source in sources for arg in ('-f', 'lavfi', '-i', source)],
+                    '-filter_complex', '[0][1][2]concat=n=3:v=1', '-fps_mode', 'vfr', '-c:v', 'mjpeg', str(path)],
+                   check=True)
+    return str(path)
+
+
+def compute_scores(input_video, frame_step, **kwargs):
+    capture = cv.VideoCapture(input_video)
+    scores = compute_motion_scores(capture, create_back_sub(HISTORY, VAR_THRESHOLD, False), frame_step=frame_step,
+                                   **kwargs)
+    capture.release()
+    return scores
+
+
+def assert_same_scores(scores, expected):
+    np.testing.assert_array_equal(scores['frames'], expected['frames'])
+    np.testing.assert_array_equal(scores['times_ms'], expected['times_ms'])
+    assert np.abs(scores['white_pixels'] - expected['white_pixels']).max() <= MAX_WHITE_PIXELS_DIFF
+
+
+def test_read_frame_times():
+    stderr = io.BytesIO(
+        b"Input #0, matroska,webm, from 'vfr.mkv':\n"
+        b"[Parsed_showinfo_2 @ 0x55d0] config in time_base: 1/1000, frame_rate: 30/1\n"
+        b"[Parsed_showinfo_2 @ 0x55d0] n:   0 pts:      0 pts_time:0       duration:     33 fmt:yuv420p\n"
+        b"[Parsed_showinfo_2 @ 0x55d0]   side data - spherical: unknown\n"
+        b"[Parsed_showinfo_2 @ 0x55d0] n:   1 pts:   2100 pts_time:2.1     duration:    100 fmt:yuv420p\n"
+        b"[mjpeg @ 0x55d1] error dc\n")
+    frame_times = queue.Queue()
+    log_lines = []
+    read_frame_times(stderr, frame_times, log_lines)
+
+    assert [frame_times.get() for _ in range(3)] == [0, 2.1, None]
+    assert log_lines == [b"Input #0, matroska,webm, from 'vfr.mkv':\n", b"[mjpeg @ 0x55d1] error dc\n"]
+
+
+@pytest.mark.parametrize('frame_step', [1, 3])
+def test_ffmpeg_scores_match_opencv(motion_video, frame_step):
+    scores = compute_motion_scores_ffmpeg(motion_video, create_back_sub(HISTORY, VAR_THRESHOLD, False),
+                                          frame_step=frame_step)
+    assert_same_scores(scores, compute_scores(motion_video, frame_step))
+
+
+@pytest.mark.parametrize('frame_step', [1, 3])
+def test_ffmpeg_times_variable_frame_rate(vfr_video, frame_step):
+    scores = compute_motion_scores_ffmpeg(vfr_video, create_back_sub(HISTORY, VAR_THRESHOLD, False),
+                                          frame_step=frame_step)
+
+    expected = compute_scores(vfr_video, frame_step)
+    np.testing.assert_array_equal(scores['frames'], expected['frames'])
+    np.testing.assert_array_equal(scores['times_ms'], expected['times_ms'])
+    # 140 frames over 6 seconds, which the nominal 30 fps would squeeze into 4.6 seconds
+    assert scores['times_ms'][-1] >= 5900
+
+
+@pytest.mark.parametrize('frame_step', [1, 3])
+def test_resumed_ffmpeg_analysis_matches_an_uninterrupted_one(tmp_path, motion_video, frame_step):
+    full = compute_scores(motion_video, frame_step)
+
+    # Interrupted after frame 200, like in test_checkpoint.py
+    interrupted = full['frames'] <= 200
+    MotionCheckpoint(tmp_path, 'key').save(full['frames'][interrupted].tolist(), full['times_ms'][interrupted].tolist(),
+                                           full['white_pixels'][interrupted].tolist(),
+                                           int(full['frames'][interrupted][-1]))
+
+    resumed = compute_motion_scores_ffmpeg(motion_video, create_back_sub(HISTORY, VAR_THRESHOLD, False),
+                                           frame_step=frame_step, checkpoint=MotionCheckpoint(tmp_path, 'key'),
+                                           warmup_frames=3 * HISTORY)
+    assert_same_scores(resumed, full)
+
+
+@pytest.mark.parametrize('frame_step', [1, 3])
+def test_resumed_ffmpeg_analysis_variable_frame_rate(tmp_path, vfr_video, frame_step):
+    full = compute_scores(vfr_video, frame_step)
+
+    # Interrupted in the last 30 fps part, with a warm-up window starting in the 10 fps part for frame_step 3, and in
+    # the last part for frame_step 1: the frame rate can't tell where either of them is
+    interrupted = full['frames'] <= 100
+    MotionCheckpoint(tmp_path, 'key').save(full['frames'][interrupted].tolist(), full['times_ms'][interrupted].tolist(),
+                                           full['white_pixels'][interrupted].tolist(),
+                                           int(full['frames'][interrupted][-1]))
+
+    resumed = compute_motion_scores_ffmpeg(vfr_video, create_back_sub(HISTORY, VAR_THRESHOLD, False),
+                                           frame_step=frame_step, checkpoint=MotionCheckpoint(tmp_path, 'key'),
+                                           warmup_frames=10)
+    np.testing.assert_array_equal(resumed['frames'], full['frames'])
+    np.testing.assert_array_equal(resumed['times_ms'], full['times_ms'])
+    assert len(resumed['white_pixels']) == len(full['white_pixels'])
+
+
+def test_get_resume_time():
+    frames = array('i', [3, 6, 9, 12])
+    times_ms = array('i', [67, 167, 367, 400])
+    assert get_resume_time(frames, times_ms, 0) is None
+    assert get_resume_time(frames, times_ms, 9) == 0.367
+    with pytest.raises(ValueError):
+        get_resume_time(frames, times_ms, 7)
@@ -0,0 +1,89 @@
+import threading
+
+import cv2 as cv
+import numpy as np
+import pytest
+
+from vision_test.analyze_movements import compute_motion_scores, create_back_sub
+from vision_test.frame_pipeline import compute_motion_scores_pipelined
+from .conftest import FRAME_SIZE
+
+HISTORY = 40
+VAR_THRESHOLD = 16
+
+
+class FailingCapture:
+    """
+    A capture that fails to decode after a number of frames, like a truncated file.
+    """
+
+    def __init__(self, input_video, fail_after):
+        self.capture = cv.VideoCapture(input_video)
+        self.fail_after = fail_after
+        self.reads = 0
+
+    def read(self, image=None):
+        self.reads += 1
+        if self.reads > self.fail_after:
+            raise cv.error('Decoding failed')
+        return self.capture.read(image)
+
+    def __getattr__(self, name):
+        return getattr(self.capture, name)
+
+
+class FailingBackSub:
+    """
+    A background subtractor that fails on the first frame.
+    """
+
+    def apply(self, frame):
+        raise MemoryError('Out of memory')
+
+
+def compute_scores(input_video, compute, **kwargs):
+    capture = cv.VideoCapture(input_video)
+    scores = compute(capture, create_back_sub(HISTORY, VAR_THRESHOLD, False), **kwargs)
+    capture.release()
+    return scores
+
+
+def assert_same_scores(scores, expected):
+    # Both decode with OpenCV, so the scores are identical
+    for name in ('frames', 'times_ms', 'white_pixels'):
+        np.testing.assert_array_equal(scores[name], expected[name], err_msg=name)
+    assert scores['analysis_size'] == expected['analysis_size']
+
+
+@pytest.mark.parametrize('frame_step', [1, 3])
+def test_pipelined_scores_match_serial(motion_video, frame_step):
+    scores = compute_scores(motion_video, compute_motion_scores_pipelined, frame_step=frame_step, queue_size=4)
+    assert_same_scores(scores, compute_scores(motion_video, compute_motion_scores, frame_step=frame_step))
+    assert scores['white_pixels'].max() > 0
+
+
+def test_pipelined_scores_match_serial_grayscale_downscaled(motion_video):
+    kwargs = {'analysis_width': FRAME_SIZE[0] // 2, 'grayscale': True, 'frame_step': 2}
+    scores = compute_scores(motion_video, compute_motion_scores_pipelined, **kwargs)
+    assert_same_scores(scores, compute_scores(motion_video, compute_motion_scores, **kwargs))
+    assert scores['analysis_size'] == (FRAME_SIZE[0] // 2, FRAME_SIZE[1] // 2)
+
+
+def test_decoder_exception_reaches_the_caller(motion_video):
+    threads = threading.active_count()
+    capture = FailingCapture(motion_video, fail_after=20)
+    with pytest.raises(cv.error, match='Decoding failed'):
+        compute_motion_scores_pipelined(capture, create_back_sub(HISTORY, VAR_THRESHOLD, False), queue_size=4)
+    capture.release()
+    # The decoder thread was joined
+    assert threading.active_count() == threads
+
+
+def test_analysis_exception_stops_the_decoder(motion_video):
+    threads = threading.active_count()
+    capture = cv.VideoCapture(motion_video)
+    with pytest.raises(MemoryError):
+        compute_motion_scores_pipelined(capture, FailingBackSub(), queue_size=4)
+    # The decoder was waiting for a buffer, and was stopped before the exception was raised
+    assert threading.active_count() == threads
+    capture.release()
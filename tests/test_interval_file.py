@@ -0,0 +1,91 @@
+import json
+
+import pytest
+
+from video_cutter import interval_file
+from video_cutter.interval_file import (INTERVALS_SUFFIX, KIND_MOVEMENTS, KIND_TURNS, IntervalFile, IntervalWriter,
+                                        export_json, get_output_path, import_json, is_interval_file, load_intervals,
+                                        write_intervals)
+
+MOVEMENTS = [{"from": 0, "to": 2.5}, {"from": 3.001, "to": 7}, {"from": 86400, "to": 86400.04}]
+TURNS = [
+    {"start": 0.0, "stop": 1.2, "speaker": "speaker_SPEAKER_01"},
+    {"start": 1.5, "stop": 4.0, "speaker": "speaker_SPEAKER_00"},
+    {"start": 4.2, "stop": 9.9, "speaker": "speaker_SPEAKER_01"},
+]
+
+
+@pytest.mark.parametrize('entries, kind', [(MOVEMENTS, KIND_MOVEMENTS), (TURNS, KIND_TURNS), ([], KIND_TURNS)])
+def test_write_read_round_trip(tmp_path, entries, kind):
+    path = tmp_path / 'results.intervals'
+    assert write_intervals(entries, path, kind) == len(entries)
+
+    assert is_interval_file(path)
+    intervals = IntervalFile(path)
+    assert intervals.kind == kind
+    assert len(intervals) == len(entries)
+    assert list(intervals) == entries
+
+
+def test_round_trip_across_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(interval_file, 'CHUNK_SIZE', 4)
+    turns = [{"start": i, "stop": i + 0.5, "speaker": f"speaker_{i % 3}"} for i in range(10)]
+    write_intervals(turns, tmp_path / 'turns.intervals', KIND_TURNS)
+    assert list(IntervalFile(tmp_path / 'turns.intervals')) == turns
+
+
+def test_movement_times_keep_their_type(tmp_path):
+    write_intervals(MOVEMENTS, tmp_path / 'movements.intervals')
+    # Whole seconds are read back as ints, like in the JSON written by detect_intervals()
+    assert [type(movement['from']) for movement in IntervalFile(tmp_path / 'movements.intervals')] == [int, float, int]
+
+
+def test_unfinished_file_is_not_read(tmp_path):
+    path = tmp_path / 'movements.intervals'
+    with pytest.raises(RuntimeError):
+        with IntervalWriter(path) as writer:
+            writer.write(MOVEMENTS[0])
+            writer.flush()
+            raise RuntimeError
+
+    with pytest.raises(ValueError, match='incomplete'):
+        IntervalFile(path)
+
+
+@pytest.mark.parametrize('seconds', [-1, 25 * 24 * 3600])
+def test_out_of_range_times(tmp_path, seconds):
+    with pytest.raises(ValueError, match='out of the range'):
+        write_intervals([{"from": 0, "to": seconds}], tmp_path / 'movements.intervals')
+
+
+def test_not_an_interval_file(tmp_path):
+    (tmp_path / 'movements.json').write_text(json.dumps(MOVEMENTS))
+    assert not is_interval_file(tmp_path / 'movements.json')
+    assert not is_interval_file(tmp_path / 'missing.intervals')
+    with pytest.raises(ValueError, match='not an interval file'):
+        IntervalFile(tmp_path / 'movements.json')
+
+
+@pytest.mark.parametrize('entries', [MOVEMENTS, TURNS, []])
+def test_json_import_export_round_trip(tmp_path, entries):
+    with open(tmp_path / 'input.json', 'w') as f:
+        json.dump(entries, f, indent=4)
+
+    assert import_json(tmp_path / 'input.json', tmp_path / 'results.intervals') == len(entries)
+    assert export_json(tmp_path / 'results.intervals', tmp_path / 'output.json') == len(entries)
+
+    # Laid out like the JSON files written by the rest of the pipeline
+    assert (tmp_path / 'output.json').read_text() == (tmp_path / 'input.json').read_text()
+
+
+def test_load_intervals(tmp_path):
+    with open(tmp_path / 'turns.json', 'w') as f:
+        json.dump(TURNS, f)
+    write_intervals(TURNS, tmp_path / 'turns.intervals', KIND_TURNS)
+
+    assert load_intervals(tmp_path / 'turns.json') == load_intervals(tmp_path / 'turns.intervals') == TURNS
+
+
+def test_get_output_path():
+    assert get_output_path('output/movements').suffix == '.json'
+    assert get_output_path('output/movements', 'intervals').suffix == INTERVALS_SUFFIX
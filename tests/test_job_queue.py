@@ -0,0 +1,146 @@
+import os
+import subprocess
+
+import pytest
+
+from vision_test.job_queue import (STATUS_DONE, STATUS_FAILED, STATUS_QUEUED, STATUS_RUNNING, FileJobQueue,
+                                  is_process_alive)
+from vision_test.job_worker import replace_dead_workers, wait_for_job
+
+
+def get_dead_pid():
+    process = subprocess.Popen(['true'])
+    process.wait()
+    return process.pid
+
+
+def test_duplicate_events_map_to_the_same_job(tmp_path):
+    queue = FileJobQueue(tmp_path)
+    job, created = queue.submit('bucket/match.mp4', '1', 'match.mp4')
+    duplicate, duplicate_created = queue.submit('bucket/match.mp4', '1', 'match.mp4')
+
+    assert created and not duplicate_created
+    assert duplicate['id'] == job['id']
+    assert len(queue.list_jobs()) == 1
+
+
+def test_duplicate_of_a_finished_job_is_not_queued_again(tmp_path):
+    queue = FileJobQueue(tmp_path)
+    job, _ = queue.submit('bucket/match.mp4', '1', 'match.mp4')
+    queue.finish(queue.claim()['id'], result={"movements": 3})
+
+    duplicate, created = queue.submit('bucket/match.mp4', '1', 'match.mp4')
+    assert not created
+    assert duplicate['status'] == STATUS_DONE
+    assert queue.claim() is None
+
+
+def test_new_generation_makes_a_new_job(tmp_path):
+    queue = FileJobQueue(tmp_path)
+    job, _ = queue.submit('bucket/match.mp4', '1', 'match.mp4')
+    overwritten, created = queue.submit('bucket/match.mp4', '2', 'match.mp4')
+
+    assert created
+    assert overwritten['id'] != job['id']
+    assert [job['generation'] for job in queue.list_jobs(STATUS_QUEUED)] == ['1', '2']
+
+
+def test_failed_job_is_retried_until_max_attempts(tmp_path):
+    queue = FileJobQueue(tmp_path, max_attempts=3)
+    job, _ = queue.submit('bucket/match.mp4', '1', 'match.mp4')
+
+    for attempt in range(1, 4):
+        claimed = queue.claim()
+        assert claimed['id'] == job['id']
+        assert claimed['attempts'] == attempt
+        queue.finish(job['id'], error='IOError: unreadable')
+
+    job = queue.get_job(job['id'])
+    assert job['status'] == STATUS_FAILED
+    assert job['error'] == 'IOError: unreadable'
+    assert queue.claim() is None
+
+
+def test_recover_requeues_the_job_of_a_dead_worker(tmp_path):
+    queue = FileJobQueue(tmp_path)
+    job, _ = queue.submit('bucket/match.mp4', '1', 'match.mp4')
+    job = queue.claim()
+    job['worker']['pid'] = get_dead_pid()
+    queue.save_job(job)
+
+    assert queue.recover() == 1
+    job = queue.get_job(job['id'])
+    assert job['status'] == STATUS_QUEUED
+    assert 'exited before finishing' in job['error']
+    assert queue.claim()['attempts'] == 2
+
+
+def test_recover_leaves_the_jobs_of_live_workers_running(tmp_path):
+    queue = FileJobQueue(tmp_path)
+    queue.submit('bucket/match.mp4', '1', 'match.mp4')
+    job = queue.claim()
+
+    assert queue.recover() == 0
+    assert queue.get_job(job['id'])['status'] == STATUS_RUNNING
+
+
+def test_recover_fails_a_job_without_attempts_left(tmp_path):
+    queue = FileJobQueue(tmp_path, max_attempts=1)
+    queue.submit('bucket/match.mp4', '1', 'match.mp4')
+    job = queue.claim()
+    job['worker']['pid'] = get_dead_pid()
+    queue.save_job(job)
+
+    assert queue.recover() == 0
+    assert queue.get_job(job['id'])['status'] == STATUS_FAILED
+
+
+def test_wait_for_job_times_out(tmp_path):
+    queue = FileJobQueue(tmp_path)
+    job, _ = queue.submit('bucket/match.mp4', '1', 'match.mp4')
+    polls = []
+
+    with pytest.raises(TimeoutError):
+        wait_for_job(queue, job['id'], timeout_s=0.2, poll_interval_s=0.05, on_poll=lambda: polls.append(1))
+    assert polls
+
+
+def test_dead_worker_is_replaced_and_its_job_finished(tmp_path):
+    queue = FileJobQueue(tmp_path, max_attempts=2)
+    job, _ = queue.submit('bucket/missing.mp4', '1', str(tmp_path / 'missing.mp4'))
+    # A worker that was killed mid-job
+    job = queue.claim()
+    job['worker']['pid'] = get_dead_pid()
+    queue.save_job(job)
+
+    workers = []
+    try:
+        replace_dead_workers(workers, tmp_path, num_workers=1)
+        assert len(workers) == 1
+        job = wait_for_job(queue, job['id'], timeout_s=60, poll_interval_s=0.1,
+                           on_poll=lambda: replace_dead_workers(workers, tmp_path, num_workers=1))
+    finally:
+        for worker in workers:
+            worker.terminate()
+            worker.join()
+
+    # The second attempt ran in the new worker, and failed on the missing video
+    assert job['status'] == STATUS_FAILED
+    assert job['attempts'] == 2
+    assert 'missing.mp4' in job['error']
+
+
+def test_claim_drops_tokens_without_a_record(tmp_path):
+    queue = FileJobQueue(tmp_path)
+    orphan, _ = queue.submit('bucket/deleted.mp4', '1', 'deleted.mp4')
+    job, _ = queue.submit('bucket/match.mp4', '1', 'match.mp4')
+    queue.get_record_path(orphan['id']).unlink()
+
+    assert queue.claim()['id'] == job['id']
+    assert queue.claim() is None
+    assert not (queue.queued_dir / orphan['id']).exists()
+
+
+def test_is_process_alive():
+    assert is_process_alive(os.getpid())
+    assert not is_process_alive(get_dead_pid())
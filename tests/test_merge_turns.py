@@ -0,0 +1,90 @@
+import json
+
+import pytest
+
+from speech_diarization import merge_turns
+from speech_diarization.merge_turns import consolidate_turns, iter_turns
+from video_cutter.interval_file import KIND_TURNS, write_intervals
+
+TURNS = [
+    {"start": 0.0, "stop": 2.5, "speaker": "speaker_SPEAKER_00"},
+    {"start": 2.7, "stop": 4.1, "speaker": "speaker_SPEAKER_01"},
+    {"start": 4.3, "stop": 9.0, "speaker": "speaker_SPEAKER_00"},
+    {"start": 12.0, "stop": 600.4, "speaker": "speaker_SPEAKER_01"},
+    {"start": 600.5, "stop": 1200, "speaker": "speaker_SPEAKER_00"},
+]
+
+
+def turn(start, stop, speaker='A'):
+    return {"start": start, "stop": stop, "speaker": speaker}
+
+
+@pytest.mark.parametrize('read_size', [1, 2, 3, 7, 16, 64, 1 << 16])
+@pytest.mark.parametrize('indent', [None, 4])
+def test_iter_turns_across_chunks(tmp_path, monkeypatch, read_size, indent):
+    # Small chunks cut entries, numbers and separators at every possible position
+    monkeypatch.setattr(merge_turns, 'READ_SIZE', read_size)
+    json_file = tmp_path / 'turns.json'
+    with open(json_file, 'w') as f:
+        json.dump(TURNS, f, indent=indent)
+
+    assert list(iter_turns(json_file)) == TURNS
+
+
+def test_iter_turns_empty(tmp_path):
+    json_file = tmp_path / 'turns.json'
+    json_file.write_text('[]')
+    assert list(iter_turns(json_file)) == []
+
+
+def test_iter_turns_truncated(tmp_path, monkeypatch):
+    monkeypatch.setattr(merge_turns, 'READ_SIZE', 8)
+    json_file = tmp_path / 'turns.json'
+    json_file.write_text(json.dumps(TURNS)[:-20])
+
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_turns(json_file))
+
+
+def test_iter_turns_interval_file(tmp_path):
+    intervals_file = tmp_path / 'turns.intervals'
+    write_intervals(TURNS, intervals_file, KIND_TURNS)
+    assert list(iter_turns(intervals_file)) == TURNS
+
+
+def test_consolidate_turns_merges_gaps():
+    turns = [turn(0, 2), turn(3, 5), turn(6.5, 8)]
+    assert list(consolidate_turns(turns, max_gap_s=1)) == [('A', {"from": 0, "to": 5}), ('A', {"from": 6.5, "to": 8})]
+    assert list(consolidate_turns(turns, max_gap_s=1.5)) == [('A', {"from": 0, "to": 8})]
+
+
+def test_consolidate_turns_per_speaker():
+    # B talking over A doesn't split A's turn
+    turns = [turn(0, 4), turn(1, 2, 'B'), turn(4.5, 6), turn(7, 9, 'B')]
+    assert list(consolidate_turns(turns, max_gap_s=1, min_turn_s=0)) == [
+        ('B', {"from": 1, "to": 2}),
+        ('A', {"from": 0, "to": 6}),
+        ('B', {"from": 7, "to": 9}),
+    ]
+
+
+def test_consolidate_turns_contained_turn():
+    # A turn within the clip being built doesn't shorten it
+    assert list(consolidate_turns([turn(0, 10), turn(2, 3)])) == [('A', {"from": 0, "to": 10})]
+
+
+def test_consolidate_turns_drops_short_clips():
+    turns = [turn(0, 0.2), turn(0.5, 0.7), turn(5, 5.3), turn(10, 10.5), turn(20, 20.1, 'B')]
+    # Short turns are kept once merged into a long enough clip
+    assert list(consolidate_turns(turns, max_gap_s=1, min_turn_s=0.5)) == [
+        ('A', {"from": 0, "to": 0.7}),
+        ('A', {"from": 10, "to": 10.5}),
+    ]
+
+
+def test_consolidate_turns_streams():
+    turns = iter([turn(0, 1), turn(5, 6), turn(10, 11)])
+    clips = consolidate_turns(turns, max_gap_s=1)
+    assert next(clips) == ('A', {"from": 0, "to": 1})
+    # The first clip is yielded as soon as the second turn shows it is over
+    assert next(turns) == turn(10, 11)
@@ -0,0 +1,97 @@
+import cv2 as cv
+import numpy as np
+import pytest
+
+from vision_test import DEFAULT_MOG2_HISTORY, DEFAULT_WARMUP_HISTORIES, get_job_args, get_score_params
+from vision_test.analyze_movements import compute_motion_scores, create_back_sub
+from vision_test.detect_intervals import detect_intervals
+from vision_test.parallel_analyze import compute_motion_scores_parallel, split_frame_ranges
+from .conftest import FRAME_SIZE, NUM_FRAMES
+
+HISTORY = 40
+VAR_THRESHOLD = 16
+NUM_WORKERS = 3
+# White pixel counts may differ from a single pass by this share of the frame, once the models are warmed up for the
+# default number of histories. MOG2 models built from different numbers of frames keep slightly different weights.
+PIXEL_TOLERANCE = 0.001
+
+
+@pytest.mark.parametrize('frame_step', [1, 2, 3, 4])
+def test_ranges_cover_the_video(frame_step):
+    ranges = split_frame_ranges(1000, 4, 30, frame_step)
+
+    assert ranges[0][:2] == (0, 0)
+    assert ranges[-1][2] is None
+    for (_, _, end), (_, next_start, _) in zip(ranges, ranges[1:]):
+        assert end == next_start
+    for warmup_start, start, _ in ranges:
+        assert start % frame_step == 0
+        # The model is fed 30 analyzed frames before the range starts
+        assert warmup_start == max(start - 30 * frame_step, 0)
+
+
+def test_ranges_of_a_short_video():
+    assert split_frame_ranges(0, 4, 30) == [(0, 0, None)]
+    # No range starts after the end of the video
+    assert split_frame_ranges(3, 8, 30) == [(0, 0, 1), (0, 1, 2), (0, 2, 3)]
+
+
+def get_scores(video, frame_step, warmup_frames):
+    capture = cv.VideoCapture(video)
+    serial = compute_motion_scores(capture, create_back_sub(HISTORY, VAR_THRESHOLD, False), frame_step=frame_step)
+    capture.release()
+    parallel = compute_motion_scores_parallel(video, num_workers=NUM_WORKERS, warmup_frames=warmup_frames,
+                                              history=HISTORY, var_threshold=VAR_THRESHOLD, detect_shadows=False,
+                                              frame_step=frame_step)
+    return serial, parallel
+
+
+def get_range_starts(frame_step):
+    return [start for _, start, _ in split_frame_ranges(NUM_FRAMES, NUM_WORKERS, 0, frame_step)]
+
+
+@pytest.mark.parametrize('frame_step', [1, 2, 3])
+def test_parallel_matches_serial(motion_video, frame_step):
+    serial, parallel = get_scores(motion_video, frame_step, HISTORY * DEFAULT_WARMUP_HISTORIES)
+
+    # The same frames are analyzed, at the same times
+    np.testing.assert_array_equal(parallel['frames'], serial['frames'])
+    np.testing.assert_array_equal(parallel['times_ms'], serial['times_ms'])
+
+    # The first range is a single pass
+    first_range = serial['frames'] <= get_range_starts(frame_step)[1]
+    np.testing.assert_array_equal(parallel['white_pixels'][first_range], serial['white_pixels'][first_range])
+
+    width, height = FRAME_SIZE
+    difference = np.abs(parallel['white_pixels'] - serial['white_pixels'])
+    assert difference.max() <= PIXEL_TOLERANCE * width * height
+
+    params = dict(white_pixel_threshold=300, movement_gap_ms=300, padding_ms=0)
+    assert (detect_intervals(parallel['white_pixels'], 30, times_ms=parallel['times_ms'], **params)
+            == detect_intervals(serial['white_pixels'], 30, times_ms=serial['times_ms'], **params))
+
+
+@pytest.mark.parametrize('frame_step', [1, 3])
+def test_short_warmup_only_differs_after_range_starts(motion_video, frame_step):
+    # With a single history of warm-up, the serial model still remembers the bursts that preceded the warm-up
+    # window: differences are large, but limited to the frames that follow the start of a range by less than the
+    # default warm-up.
+    serial, parallel = get_scores(motion_video, frame_step, HISTORY)
+
+    differs = parallel['white_pixels'] != serial['white_pixels']
+    settling = np.zeros(len(serial['frames']), dtype=bool)
+    for start in get_range_starts(frame_step)[1:]:
+        settling |= ((serial['frames'] > start)
+                     & (serial['frames'] <= start + HISTORY * DEFAULT_WARMUP_HISTORIES * frame_step))
+    assert differs.any()
+    assert not (differs & ~settling).any()
+
+
+def test_parallel_scores_are_cached_apart_from_serial_scores():
+    serial = get_score_params(get_job_args('match.mp4'))
+    parallel = get_score_params(get_job_args('match.mp4', workers=4))
+
+    assert parallel != serial
+    assert parallel['warmup'] == DEFAULT_MOG2_HISTORY * DEFAULT_WARMUP_HISTORIES
+    assert get_score_params(get_job_args('match.mp4', workers=4, warmup=100)) != parallel
+    assert get_score_params(get_job_args('match.mp4', workers=8)) != parallel
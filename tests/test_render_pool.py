@@ -0,0 +1,95 @@
+import threading
+import time
+
+import ffmpeg
+import pytest
+
+from video_cutter.render_pool import ERROR_TAIL_LINES, describe_error, get_pool_size, render_jobs
+
+
+class StubRender:
+    """
+    A render job that fails a number of times before succeeding, and records how many jobs run at once.
+    """
+    running = 0
+    max_running = 0
+    lock = threading.Lock()
+
+    def __init__(self, duration_s=0.0, failures=0, error=None):
+        self.duration_s = duration_s
+        self.failures = failures
+        self.error = error or RuntimeError('ffmpeg exited with 1')
+        self.calls = 0
+
+    def __call__(self):
+        cls = type(self)
+        with cls.lock:
+            cls.running += 1
+            cls.max_running = max(cls.max_running, cls.running)
+        try:
+            time.sleep(self.duration_s)
+            self.calls += 1
+            if self.calls <= self.failures:
+                raise self.error
+        finally:
+            with cls.lock:
+                cls.running -= 1
+
+
+@pytest.fixture(autouse=True)
+def reset_stub_render():
+    StubRender.running = StubRender.max_running = 0
+
+
+@pytest.mark.parametrize('encoder_threads, cpu_count, expected', [
+    (2, 8, 4),
+    (3, 8, 2),
+    (16, 8, 1),  # Always at least one worker
+    (0, 8, 8),
+])
+def test_get_pool_size(encoder_threads, cpu_count, expected):
+    assert get_pool_size(encoder_threads, cpu_count) == expected
+
+
+def test_results_in_job_order():
+    # The first jobs take the longest, so they finish last
+    jobs = [(f'clip_{i}', StubRender(duration_s=0.05 * (5 - i))) for i in range(6)]
+    results = render_jobs(jobs, max_workers=6)
+
+    assert [result['id'] for result in results] == [job_id for job_id, _ in jobs]
+    assert all(result['ok'] and result['error'] is None and result['attempts'] == 1 for result in results)
+    assert results[0]['duration_s'] > results[4]['duration_s']
+
+
+@pytest.mark.parametrize('max_workers', [1, 3])
+def test_concurrent_jobs_are_bounded(max_workers):
+    render_jobs([(i, StubRender(duration_s=0.02)) for i in range(10)], max_workers=max_workers)
+    assert StubRender.max_running == max_workers
+
+
+def test_failed_job_is_retried():
+    render = StubRender(failures=1)
+    [result] = render_jobs([('flaky', render)], max_workers=1, retries=1)
+
+    assert result['ok']
+    assert result['error'] is None
+    assert result['attempts'] == render.calls == 2
+
+
+def test_failures_are_reported(capsys):
+    error = ffmpeg.Error('ffmpeg', b'', b'\n'.join(f'line {i}'.encode() for i in range(10)))
+    failing = StubRender(failures=5, error=error)
+    jobs = [('ok_before', StubRender()), ('broken', failing), ('ok_after', StubRender())]
+    results = render_jobs(jobs, max_workers=2, retries=2)
+
+    # The failure doesn't stop the other jobs
+    assert [result['ok'] for result in results] == [True, False, True]
+    broken = results[1]
+    assert broken['error'] is error
+    assert broken['attempts'] == failing.calls == 3
+    assert 'broken: FAILED' in capsys.readouterr().out
+
+    description = describe_error(broken['error']).splitlines()
+    assert description[0] == str(error)
+    assert description[1:] == [f'line {i}' for i in range(10 - ERROR_TAIL_LINES, 10)]
+    assert describe_error(ValueError('No such file')) == 'No such file'
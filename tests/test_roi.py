@@ -0,0 +1,123 @@
+import json
+
+import cv2 as cv
+import numpy as np
+import pytest
+
+from vision_test.analyze_movements import compute_motion_scores, create_back_sub
+from vision_test.roi import (UNIT_PERCENT, UNIT_PIXELS, count_white_pixels, crop_to_roi, get_roi_geometry,
+                             parse_roi)
+from .conftest import FRAME_SIZE
+
+SOURCE_SIZE = (1920, 1080)
+
+
+def test_parse_rect():
+    assert parse_roi('960,540,480,270') == {
+        'polygon': [[960, 540], [1440, 540], [1440, 810], [960, 810]], 'unit': UNIT_PIXELS}
+    assert parse_roi('50%, 50%, 25%, 25%') == {
+        'polygon': [[50, 50], [75, 50], [75, 75], [50, 75]], 'unit': UNIT_PERCENT}
+
+
+def test_parse_polygon():
+    assert parse_roi('20%,35%,80%,35%,95%,95%,5%,95%') == {
+        'polygon': [[20, 35], [80, 35], [95, 95], [5, 95]], 'unit': UNIT_PERCENT}
+    assert parse_roi('0,0,100,0,50,80')['polygon'] == [[0, 0], [100, 0], [50, 80]]
+
+
+@pytest.mark.parametrize('data, expected', [
+    ({'rect': [0, 0, 50, 50], 'unit': '%'}, {'polygon': [[0, 0], [50, 0], [50, 50], [0, 50]], 'unit': UNIT_PERCENT}),
+    ({'polygon': [[0, 0], [100, 0], [50, 80]]}, {'polygon': [[0, 0], [100, 0], [50, 80]], 'unit': UNIT_PIXELS}),
+])
+def test_parse_json_file(tmp_path, data, expected):
+    with open(tmp_path / 'roi.json', 'w') as f:
+        json.dump(data, f)
+    assert parse_roi(str(tmp_path / 'roi.json')) == expected
+
+
+@pytest.mark.parametrize('value', [
+    '50%,50%,25,25',  # Mixed units
+    '0.5,0.5,0.6,0.6',  # Fractions, which would read as pixels
+    '0,0,1,1',
+    '10,10,20,20,30',  # Odd number of coordinates
+    '10,10,20,20,30,30,40,40,50',
+    '10,10,11,20,10,30',  # A 1 pixel wide polygon
+])
+def test_parse_invalid_roi(value):
+    with pytest.raises(ValueError):
+        parse_roi(value)
+
+
+def test_parse_json_file_with_unknown_unit(tmp_path):
+    with open(tmp_path / 'roi.json', 'w') as f:
+        json.dump({'rect': [0, 0, 0.5, 0.5], 'unit': 'fraction'}, f)
+    with pytest.raises(ValueError, match='unit'):
+        parse_roi(str(tmp_path / 'roi.json'))
+
+
+def test_rect_in_both_units_gives_the_same_geometry():
+    pixels = get_roi_geometry(parse_roi('960,540,480,270'), SOURCE_SIZE)
+    percent = get_roi_geometry(parse_roi('50%,50%,25%,25%'), SOURCE_SIZE)
+
+    for roi in (pixels, percent):
+        assert roi['crop'] == (960, 540, 1440, 810)
+        assert roi['size'] is None
+        # A rectangle fills its bounding box: nothing to mask
+        assert roi['mask'] is None
+
+
+def test_rect_extending_past_the_frame_is_clipped():
+    # Clipped to the frame, where it used to be read as a 1 pixel region because it ends past 100%
+    roi = get_roi_geometry(parse_roi('50%,50%,60%,60%'), SOURCE_SIZE)
+    assert roi['crop'] == (960, 540, 1920, 1080)
+
+
+def test_roi_outside_of_the_frame():
+    with pytest.raises(ValueError, match='outside'):
+        get_roi_geometry(parse_roi('2000,0,100,100'), SOURCE_SIZE)
+
+
+def test_polygon_mask_and_crop():
+    # A triangle, over the top half of its bounding box
+    roi = get_roi_geometry(parse_roi('100,100,300,100,200,200'), SOURCE_SIZE)
+    assert roi['crop'] == (100, 100, 300, 200)
+    assert roi['mask'].shape == (100, 200)
+    assert cv.countNonZero(roi['mask']) == pytest.approx(200 * 100 / 2, rel=0.05)
+
+    frame = np.zeros((SOURCE_SIZE[1], SOURCE_SIZE[0]), dtype=np.uint8)
+    frame[150:160, 190:210] = 255  # Inside of the triangle
+    frame[190:195, 105:110] = 255  # In its bounding box, but outside of it
+    frame[500:510, 500:510] = 255  # Outside of its bounding box
+    cropped = crop_to_roi(frame, roi)
+    assert cropped.shape == (100, 200)
+    assert count_white_pixels(cropped) == 10 * 20 + 5 * 5
+    assert count_white_pixels(cropped, roi) == 10 * 20
+
+
+def test_downscaled_analysis():
+    # The region keeps the scale of the full frames, so that white pixel thresholds mean the same thing
+    roi = get_roi_geometry(parse_roi('100,100,300,100,200,200'), SOURCE_SIZE, analysis_size=(480, 270))
+    assert roi['crop'] == (100, 100, 300, 200)
+    assert roi['size'] == (50, 25)
+    assert roi['mask'].shape == (25, 50)
+    assert cv.countNonZero(roi['mask']) == pytest.approx(50 * 25 / 2, rel=0.1)
+
+
+def compute_roi_scores(input_video, roi, analysis_width=None):
+    capture = cv.VideoCapture(input_video)
+    scores = compute_motion_scores(capture, create_back_sub(40, 16, False), analysis_width=analysis_width, roi=roi)
+    capture.release()
+    return scores
+
+
+@pytest.mark.parametrize('analysis_width', [None, FRAME_SIZE[0] // 2])
+def test_roi_restricts_the_analysis(motion_video, analysis_width):
+    # The block of motion_video crosses rows 20 to 70: a region well below them sees no movement once the background
+    # model has settled
+    below = compute_roi_scores(motion_video, parse_roi(f'0,80,{FRAME_SIZE[0]},{FRAME_SIZE[1] - 80}'), analysis_width)
+    across = compute_roi_scores(motion_video, parse_roi('0%,0%,100%,80%'), analysis_width)
+    full = compute_roi_scores(motion_video, None, analysis_width)
+
+    assert below['white_pixels'][100:].max() == 0
+    assert across['white_pixels'].max() > 0
+    assert across['white_pixels'].sum() <= full['white_pixels'].sum()
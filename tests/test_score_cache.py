@@ -0,0 +1,134 @@
+import json
+import multiprocessing
+import os
+
+import numpy as np
+
+from vision_test import score_cache
+from vision_test.analyze_movements import make_motion_scores
+from vision_test.score_cache import (HASH_INDEX_FILE, evict_cache_entries, get_cache_key, get_cache_paths,
+                                     get_indexed_hash, hash_video, load_motion_scores, save_motion_scores)
+
+PARAMS = {'algo': 'MOG2', 'history': 500, 'var_threshold': 1000, 'analysis_width': 640}
+
+
+def write_file(path, content):
+    with open(path, 'wb') as f:
+        f.write(content)
+    return str(path)
+
+
+def test_hash_video_is_remembered_until_the_video_changes(tmp_path):
+    video = write_file(tmp_path / 'video.mp4', b'frames')
+    assert get_indexed_hash(video, tmp_path / 'cache') is None
+
+    video_hash = hash_video(video, tmp_path / 'cache')
+    assert get_indexed_hash(video, tmp_path / 'cache') == video_hash
+
+    write_file(video, b'other frames')
+    assert get_indexed_hash(video, tmp_path / 'cache') is None
+    assert hash_video(video, tmp_path / 'cache') != video_hash
+
+
+def test_concurrent_hashes_keep_every_index_entry(tmp_path):
+    videos = [write_file(tmp_path / f'video_{i}.mp4', os.urandom(1024)) for i in range(16)]
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(4) as pool:
+        pool.starmap(hash_video, [(video, str(tmp_path / 'cache')) for video in videos])
+
+    with open(tmp_path / 'cache' / HASH_INDEX_FILE, 'r') as f:
+        hash_index = json.load(f)
+    assert sorted(hash_index) == sorted(os.path.realpath(video) for video in videos)
+
+
+def make_scores(num_frames=300, seed=0):
+    frames = np.arange(1, num_frames + 1)
+    white_pixels = np.random.default_rng(seed).integers(0, 5000, num_frames)
+    return make_motion_scores(30.0, num_frames, (1920, 1080), (640, 360), frames, white_pixels,
+                              np.round((frames - 1) * 1000 / 30))
+
+
+def test_motion_scores_round_trip(tmp_path):
+    scores = make_scores()
+    key = get_cache_key('videohash', PARAMS)
+    assert load_motion_scores(tmp_path, key) is None
+
+    save_motion_scores(tmp_path, key, scores, PARAMS)
+    loaded = load_motion_scores(tmp_path, key)
+
+    for name in ('fps', 'total_frames', 'source_size', 'analysis_size'):
+        assert loaded[name] == scores[name]
+    for name in ('frames', 'white_pixels', 'times_ms'):
+        np.testing.assert_array_equal(loaded[name], scores[name])
+
+
+def test_cache_key_depends_on_the_video_and_score_params():
+    key = get_cache_key('videohash', PARAMS)
+    assert get_cache_key('videohash', dict(PARAMS)) == key
+    assert get_cache_key('otherhash', PARAMS) != key
+    assert get_cache_key('videohash', {**PARAMS, 'history': 400}) != key
+    assert get_cache_key('videohash', {**PARAMS, 'grayscale': True}) != key
+
+
+def test_entries_of_another_cache_version_are_dropped(tmp_path, monkeypatch):
+    key = get_cache_key('videohash', PARAMS)
+    save_motion_scores(tmp_path, key, make_scores(), PARAMS)
+
+    monkeypatch.setattr(score_cache, 'CACHE_VERSION', score_cache.CACHE_VERSION + 1)
+    assert get_cache_key('videohash', PARAMS) != key
+    # Even when looked up by its old key
+    assert load_motion_scores(tmp_path, key) is None
+    assert not any(path.exists() for path in get_cache_paths(tmp_path, key))
+
+
+def test_unreadable_entries_are_dropped(tmp_path):
+    key = get_cache_key('videohash', PARAMS)
+    save_motion_scores(tmp_path, key, make_scores(), PARAMS)
+    get_cache_paths(tmp_path, key)[0].write_bytes(b'truncated')
+
+    assert load_motion_scores(tmp_path, key) is None
+    assert not any(path.exists() for path in get_cache_paths(tmp_path, key))
+
+
+def get_entry_size(cache_dir, key):
+    return sum(path.stat().st_size for path in get_cache_paths(cache_dir, key))
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    keys = [get_cache_key(f'video_{i}', PARAMS) for i in range(3)]
+    for i, key in enumerate(keys):
+        save_motion_scores(tmp_path, key, make_scores(seed=i), PARAMS)
+        # Saved a minute apart
+        for path in get_cache_paths(tmp_path, key):
+            os.utime(path, (1_000_000 + 60 * i, 1_000_000 + 60 * i))
+
+    # Using the oldest entry makes the second one the least recently used
+    load_motion_scores(tmp_path, keys[0])
+    evict_cache_entries(tmp_path, get_entry_size(tmp_path, keys[0]) + get_entry_size(tmp_path, keys[2]))
+
+    assert [load_motion_scores(tmp_path, key) is not None for key in keys] == [True, False, True]
+
+
+def test_saved_entry_is_never_evicted(tmp_path):
+    keys = [get_cache_key(f'video_{i}', PARAMS) for i in range(2)]
+    save_motion_scores(tmp_path, keys[0], make_scores(), PARAMS)
+    # A cache too small for any entry keeps the one just saved only
+    save_motion_scores(tmp_path, keys[1], make_scores(seed=1), PARAMS, limit_mb=0)
+
+    assert [load_motion_scores(tmp_path, key) is not None for key in keys] == [False, True]
+
+
+def save_test_scores(cache_dir, key):
+    save_motion_scores(cache_dir, key, make_scores(), PARAMS)
+
+
+def test_concurrent_saves_of_the_same_entry(tmp_path):
+    # Like two workers analyzing copies of the same video
+    key = get_cache_key('videohash', PARAMS)
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(4) as pool:
+        pool.starmap(save_test_scores, [(str(tmp_path), key)] * 16)
+
+    np.testing.assert_array_equal(load_motion_scores(tmp_path, key)['white_pixels'], make_scores()['white_pixels'])
+    # No temporary file left behind
+    assert sorted(tmp_path.iterdir()) == sorted(get_cache_paths(tmp_path, key))
@@ -0,0 +1,156 @@
+import subprocess
+
+import ffmpeg
+import pytest
+
+from video_cutter import cut_clip
+from video_cutter.cut_clip import get_encoder_args, render_smart_cut_part
+from video_cutter.extract_segments import METHOD_SMART, METHOD_TRIM, extract_segments
+from video_cutter.keyframe_index import build_keyframe_index, count_frames, plan_smart_cut, snap_segments, \
+    snap_to_keyframe
+from .conftest import FPS
+
+KEYFRAMES = [0.0, 2.0, 4.0, 6.0, 8.0]
+VIDEO_STREAM = {'codec_name': 'h264', 'pix_fmt': 'yuv420p', 'profile': 'Main', 'level': 31}
+# Off the keyframes (one per second in source_video), so that every segment has boundary parts to re-encode
+SMART_SEGMENTS = [{'from': 1.5, 'to': 6.5}, {'from': 10.2, 'to': 14.9}, {'from': 20, 'to': 23}]
+# Each of the 7 parts of SMART_SEGMENTS may start or end up to an AAC frame away from its video, as its audio is
+# stream-copied, which shifts the parts that follow it as well
+MAX_DURATION_DIFF_S = 7 * 1024 / 48000
+
+
+@pytest.mark.parametrize('time_s, expected', [(0, 0), (1.9, 0), (2.0, 2.0), (7.5, 6.0), (100, 8.0)])
+def test_snap_to_keyframe(time_s, expected):
+    assert snap_to_keyframe(time_s, KEYFRAMES) == expected
+
+
+def test_snap_to_keyframe_without_keyframe_before():
+    assert snap_to_keyframe(1.5, [2.0, 4.0]) == 1.5
+    assert snap_to_keyframe(1.5, []) == 1.5
+
+
+def test_snap_segments():
+    segments = [{'from': 0.5, 'to': 1.5}, {'from': 2.5, 'to': 3}, {'from': 5, 'to': 5.5}]
+    assert snap_segments(segments, KEYFRAMES) == [
+        {'from': 0.0, 'to': 1.5},
+        {'from': 2.0, 'to': 3},
+        {'from': 4.0, 'to': 5.5},
+    ]
+
+
+def test_snap_segments_merges_overlaps():
+    # The second segment snaps back into the first one, while the third one still starts after it
+    segments = [{'from': 2.5, 'to': 4.5}, {'from': 5, 'to': 5.5}, {'from': 6.5, 'to': 7}]
+    assert snap_segments(segments, KEYFRAMES) == [{'from': 2.0, 'to': 5.5}, {'from': 6.0, 'to': 7}]
+    assert snap_segments([{'from': 2.5, 'to': 7}, {'from': 3, 'to': 4}], KEYFRAMES) == [{'from': 2.0, 'to': 7}]
+
+
+def test_plan_smart_cut():
+    assert plan_smart_cut(1.5, 6.5, KEYFRAMES) == [('encode', 1.5, 2.0), ('copy', 2.0, 6.0), ('encode', 6.0, 6.5)]
+
+
+def test_plan_smart_cut_on_keyframes():
+    assert plan_smart_cut(2.0, 6.0, KEYFRAMES) == [('copy', 2.0, 6.0)]
+    assert plan_smart_cut(2.0, 6.5, KEYFRAMES) == [('copy', 2.0, 6.0), ('encode', 6.0, 6.5)]
+
+
+@pytest.mark.parametrize('start, end', [(2.5, 3.5), (2.5, 5.5), (1.5, 2.0)])
+def test_plan_smart_cut_within_a_gop(start, end):
+    # Less than a whole GOP between two keyframes
+    assert plan_smart_cut(start, end, KEYFRAMES) == [('encode', start, end)]
+
+
+def test_plan_smart_cut_without_keyframes():
+    assert plan_smart_cut(1.5, 6.5, []) == [('encode', 1.5, 6.5)]
+
+
+@pytest.mark.parametrize('start, end', [(0.3, 9.7), (1.5, 6.5), (3, 3.5)])
+def test_plan_smart_cut_covers_the_segment(start, end):
+    parts = plan_smart_cut(start, end, KEYFRAMES)
+    assert parts[0][1] == start
+    assert parts[-1][2] == end
+    assert all(previous[2] == part[1] for previous, part in zip(parts, parts[1:]))
+
+
+def get_part_args(monkeypatch, mode):
+    runs = []
+    monkeypatch.setattr(cut_clip, 'count_frames', lambda input_video, start, end: round((end - start) * FPS))
+    monkeypatch.setattr(ffmpeg.nodes.OutputStream, 'run', lambda stream, **kwargs: runs.append(ffmpeg.get_args(stream)))
+    render_smart_cut_part('input.mp4', mode, 2.0, 6.0, 'part.ts', VIDEO_STREAM)
+    return runs[0]
+
+
+def test_render_boundary_part(monkeypatch):
+    args = get_part_args(monkeypatch, 'encode')
+
+    # The video is re-encoded like the source's, while the audio keeps the source's codec and parameters, from start on
+    assert args[args.index('-vcodec') + 1] == 'libx264'
+    assert args[args.index('-profile:v') + 1] == 'main'
+    assert args[args.index('-level') + 1] == '3.1'
+    assert args[args.index('-acodec') + 1] == 'copy'
+    assert args[args.index('-copypriorss') + 1] == '0'
+    assert args[args.index('-f') + 1] == 'mpegts'
+
+
+def test_render_copied_part(monkeypatch):
+    args = get_part_args(monkeypatch, 'copy')
+    assert args[args.index('-c') + 1] == 'copy'
+    assert args[args.index('-copypriorss') + 1] == '0'
+    # Up to the keyframe at the end, which starts the next part
+    assert args[args.index('-frames:v') + 1] == str(4 * FPS)
+    assert '-vcodec' not in args
+
+
+@pytest.mark.parametrize('video_stream, expected', [
+    ({'codec_name': 'h264', 'pix_fmt': 'yuv420p', 'profile': 'High', 'level': 40},
+     {'vcodec': 'libx264', 'pix_fmt': 'yuv420p', 'profile:v': 'high', 'level': '4.0'}),
+    ({'codec_name': 'h264', 'pix_fmt': 'yuv420p', 'profile': 'Constrained Baseline', 'level': 30},
+     {'vcodec': 'libx264', 'pix_fmt': 'yuv420p', 'profile:v': 'baseline', 'level': '3.0'}),
+    ({'codec_name': 'hevc', 'pix_fmt': 'yuv420p10le', 'profile': 'Main 10', 'level': 153},
+     {'vcodec': 'libx265', 'pix_fmt': 'yuv420p10le', 'profile:v': 'main10', 'x265-params': 'level-idc=5.1'}),
+    # Unknown profile and level
+    ({'codec_name': 'h264', 'pix_fmt': 'yuv420p', 'profile': 'Stereo High', 'level': -99},
+     {'vcodec': 'libx264', 'pix_fmt': 'yuv420p'}),
+])
+def test_get_encoder_args(video_stream, expected):
+    assert get_encoder_args(video_stream) == expected
+
+
+def test_count_frames(source_video):
+    # Closed GOPs of 30 frames, with B-frames decoded after the keyframe that follows them
+    assert count_frames(source_video, 2.0, 5.0) == 3 * FPS
+    assert count_frames(source_video, 2.5, 3.0) == FPS // 2
+
+
+@pytest.fixture(scope='module')
+def mpegts_readable(tmp_path_factory):
+    """
+    Skip the tests joining smart cut parts where ffmpeg can't read MPEG-TS back: some static builds crash on any
+    MPEG-TS input.
+    """
+    path = tmp_path_factory.mktemp('mpegts') / 'probe.ts'
+    subprocess.run(['ffmpeg', '-v', 'error', '-y', '-f', 'lavfi', '-i', 'testsrc2=d=0.1', '-f', 'mpegts', str(path)],
+                   check=True)
+    if subprocess.run(['ffprobe', '-v', 'error', str(path)], capture_output=True).returncode != 0:
+        pytest.skip('ffmpeg cannot read MPEG-TS on this machine')
+
+
+def probe_durations(output_video):
+    """
+    Return the frame count, and the video and audio durations of output_video.
+    """
+    streams = {stream['codec_type']: stream for stream in ffmpeg.probe(str(output_video))['streams']}
+    return int(streams['video']['nb_frames']), float(streams['video']['duration']), float(streams['audio']['duration'])
+
+
+def test_smart_cut_matches_an_encoded_cut(tmp_path, source_video, mpegts_readable):
+    keyframes = build_keyframe_index(source_video)
+    extract_segments(source_video, SMART_SEGMENTS, tmp_path / 'smart.mp4', METHOD_SMART, keyframes, quiet=True)
+    extract_segments(source_video, SMART_SEGMENTS, tmp_path / 'encoded.mp4', METHOD_TRIM, quiet=True)
+
+    # No frame is lost or repeated at the joins of the stream-copied parts
+    num_frames, video_s, audio_s = probe_durations(tmp_path / 'smart.mp4')
+    expected_num_frames, expected_video_s, expected_audio_s = probe_durations(tmp_path / 'encoded.mp4')
+    assert num_frames == expected_num_frames == round(sum(s['to'] - s['from'] for s in SMART_SEGMENTS) * FPS)
+    assert video_s == pytest.approx(expected_video_s, abs=MAX_DURATION_DIFF_S)
+    assert audio_s == pytest.approx(expected_audio_s, abs=MAX_DURATION_DIFF_S)
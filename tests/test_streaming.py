@@ -0,0 +1,141 @@
+import json
+import wave
+
+import numpy as np
+import pytest
+
+from benchmarks.fixtures import SAMPLE_RATE, make_speaker_samples, make_speaker_wav
+from speech_diarization.batch_diarization import get_segment_offsets, merge_segment_results, save_segment_result
+from speech_diarization.streaming import SpeakerTracker, diarize_stream, diarize_window
+from speech_diarization.stub_pipeline import StubPipeline
+
+DURATION_S = 90
+NUM_SPEAKERS = 3
+# The stub labels 0.1s frames, and both the fixture and the results round times to 0.1s
+TOLERANCE_S = 0.15
+
+
+def assert_same_turns(turns, expected_turns):
+    """
+    Check that turns match the true turns, up to the naming of the speakers, which must map one to one.
+    """
+    assert len(turns) == len(expected_turns)
+    speakers = {}
+    for turn, expected in zip(turns, expected_turns):
+        assert turn['start'] == pytest.approx(expected['start'], abs=TOLERANCE_S)
+        assert turn['stop'] == pytest.approx(expected['stop'], abs=TOLERANCE_S)
+        assert speakers.setdefault(expected['speaker'], turn['speaker']) == turn['speaker']
+    assert len(set(speakers.values())) == len(speakers) == NUM_SPEAKERS
+
+
+def one_hot(*indexes, size=8):
+    embeddings = np.zeros((len(indexes), size), dtype=np.float32)
+    for i, index in enumerate(indexes):
+        embeddings[i, index] = 1
+    return embeddings
+
+
+def test_diarize_stream_stitches_windows(tmp_path):
+    expected_turns = make_speaker_wav(tmp_path / 'speakers.wav', DURATION_S, NUM_SPEAKERS, seed=1)
+
+    # Turns last at most 6s, so an 8s overlap sees every turn whole in the window that reports it
+    num_turns = diarize_stream(StubPipeline(), tmp_path / 'speakers.wav', tmp_path / 'turns.json', window_s=30,
+                               overlap_s=8)
+
+    with open(tmp_path / 'turns.json', 'r') as f:
+        turns = json.load(f)
+    assert num_turns == len(turns)
+    assert_same_turns(turns, expected_turns)
+
+
+def test_diarize_stream_single_window(tmp_path):
+    expected_turns = make_speaker_wav(tmp_path / 'speakers.wav', 20, NUM_SPEAKERS, seed=2)
+
+    diarize_stream(StubPipeline(), tmp_path / 'speakers.wav', tmp_path / 'turns.json', window_s=30, overlap_s=8)
+
+    with open(tmp_path / 'turns.json', 'r') as f:
+        turns = json.load(f)
+    assert [turn['start'] for turn in turns] == pytest.approx([turn['start'] for turn in expected_turns],
+                                                              abs=TOLERANCE_S)
+
+
+def test_tracker_matches_speakers_across_windows():
+    tracker = SpeakerTracker()
+    assert tracker.match(['A', 'B'], one_hot(0, 1), [5, 5]) == {'A': 'SPEAKER_00', 'B': 'SPEAKER_01'}
+
+    # Local labels are given in order of appearance in each window, so they don't carry over
+    assert tracker.match(['A', 'B'], one_hot(1, 0), [5, 5]) == {'A': 'SPEAKER_01', 'B': 'SPEAKER_00'}
+    assert tracker.match(['A', 'B'], one_hot(2, 1), [5, 5]) == {'A': 'SPEAKER_02', 'B': 'SPEAKER_01'}
+    assert tracker.num_speakers == 3
+
+
+def test_tracker_matches_to_centroids():
+    tracker = SpeakerTracker(min_similarity=0.5)
+    tracker.match(['A'], np.array([[1, 0, 0]], dtype=np.float32), [9])
+    tracker.match(['A'], np.array([[0, 1, 0]], dtype=np.float32), [1])
+    # Close to the first speaker, but not to the second one
+    assert tracker.match(['A'], np.array([[1, 0.9, 0]], dtype=np.float32), [1]) == {'A': 'SPEAKER_00'}
+
+    # Hearing the first speaker once more, mostly with the second one's voice, drags its centroid towards it
+    tracker.match(['A'], np.array([[0.1, 1, 0]], dtype=np.float32), [1])
+    assert tracker.match(['A'], np.array([[0, 0, 1]], dtype=np.float32), [1]) == {'A': 'SPEAKER_02'}
+    assert tracker.num_speakers == 3
+
+
+def test_tracker_keeps_speakers_of_a_window_apart():
+    tracker = SpeakerTracker()
+    tracker.match(['A'], one_hot(0), [5])
+
+    # Both are closest to SPEAKER_00, which goes to the most similar one only
+    embeddings = one_hot(0, 0)
+    embeddings[0, 1] = 0.2
+    assert tracker.match(['A', 'B'], embeddings, [5, 5]) == {'A': 'SPEAKER_01', 'B': 'SPEAKER_00'}
+
+
+def test_tracker_gives_speakers_without_embedding_a_new_label():
+    tracker = SpeakerTracker()
+    embeddings = one_hot(0, 1)
+    embeddings[1] = np.nan
+    assert tracker.match(['A', 'B'], embeddings, [5, 0.1]) == {'A': 'SPEAKER_01', 'B': 'SPEAKER_00'}
+
+    # Never matched later on, since there's nothing to compare to
+    assert tracker.match(['A', 'B'], one_hot(1, 0), [5, 5]) == {'A': 'SPEAKER_02', 'B': 'SPEAKER_01'}
+
+
+def write_segments(output_dir, samples, segment_s):
+    """
+    Write samples as 16-bit segment_N.wav files of segment_s seconds, like split_wav_in_parallel() does.
+    """
+    segment_length = segment_s * SAMPLE_RATE
+    segment_files = []
+    for i, start in enumerate(range(0, len(samples), segment_length)):
+        segment_file = output_dir / f'segment_{i}.wav'
+        with wave.open(str(segment_file), 'wb') as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(SAMPLE_RATE)
+            wav.writeframes((samples[start:start + segment_length] * 32767).astype('<i2').tobytes())
+        segment_files.append(segment_file)
+    return segment_files
+
+
+def test_merge_segment_results(tmp_path):
+    samples, expected_turns = make_speaker_samples(DURATION_S, NUM_SPEAKERS, seed=3)
+    segment_files = write_segments(tmp_path, samples, 20)
+    offsets = get_segment_offsets(segment_files)
+    assert offsets == [0, 20, 40, 60, 80]
+
+    result_files = []
+    pipeline = StubPipeline()
+    for segment_file, offset_s in zip(segment_files, offsets):
+        segment = samples[round(offset_s * SAMPLE_RATE):round((offset_s + 20) * SAMPLE_RATE)]
+        result_file = segment_file.with_suffix('.json')
+        save_segment_result(result_file, *diarize_window(pipeline, segment, SAMPLE_RATE))
+        result_files.append(result_file)
+
+    turns = merge_segment_results(result_files, offsets, tmp_path / 'turns.json')
+
+    # Turns cut in two by a segment boundary are joined back
+    assert_same_turns(turns, expected_turns)
+    with open(tmp_path / 'turns.json', 'r') as f:
+        assert json.load(f) == turns
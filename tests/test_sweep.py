@@ -0,0 +1,67 @@
+import cv2 as cv
+import numpy as np
+import pytest
+
+from vision_test.analyze_movements import compute_motion_scores, create_back_sub
+from vision_test.sweep import compute_sweep_scores, expand_sweep, get_subtractor_key, parse_sweep
+from .conftest import UnknownLengthCapture
+
+BASE = {'algo': 'MOG2', 'history': 40, 'mvmt': 16, 'shadows': False, 'white_pixels': 100, 'movement_gap_ms': 4000,
+        'padding_ms': 2000}
+
+
+def create_config_back_sub(config):
+    return create_back_sub(config['history'], config['mvmt'], config['shadows'], config['algo'])
+
+
+def test_parse_sweep():
+    assert parse_sweep(['algo=mog2,KNN', 'history = 100, 500', 'shadows=yes,0']) == {
+        'algo': ['MOG2', 'KNN'], 'history': [100, 500], 'shadows': [True, False]}
+
+
+@pytest.mark.parametrize('option', ['threshold=1,2', 'mvmt=', 'mvmt', 'algo=GMG', 'history=100,a lot', 'shadows=maybe',
+                                    'white_pixels=1.5'])
+def test_parse_sweep_rejects_bad_options(option):
+    with pytest.raises(ValueError):
+        parse_sweep([option])
+
+
+def test_expand_sweep():
+    configs = expand_sweep(parse_sweep(['history=100,500', 'white_pixels=10,20,30']), BASE)
+
+    assert len(configs) == 6
+    assert [(config['history'], config['white_pixels']) for config in configs] == [
+        (100, 10), (100, 20), (100, 30), (500, 10), (500, 20), (500, 30)]
+    # Parameters that aren't swept keep their value
+    assert all(config['mvmt'] == BASE['mvmt'] and config['algo'] == BASE['algo'] for config in configs)
+    # Only the history changes the subtractor
+    assert len({get_subtractor_key(config) for config in configs}) == 2
+    assert expand_sweep({}, BASE) == [BASE]
+
+
+@pytest.mark.parametrize('frame_step, num_threads', [(1, 1), (1, 3), (3, 2)])
+def test_sweep_matches_separate_runs(motion_video, frame_step, num_threads):
+    # KNN samples its background model at random, so that two runs of it never match exactly
+    configs = expand_sweep(parse_sweep(['history=20,40', 'shadows=no,yes']), {**BASE, 'mvmt': 400})
+    configs = configs[:3]
+    assert len({get_subtractor_key(config) for config in configs}) == len(configs) == 3
+
+    capture = cv.VideoCapture(motion_video)
+    swept, subtract_s = compute_sweep_scores(capture, [create_config_back_sub(config) for config in configs],
+                                             frame_step=frame_step, num_threads=num_threads)
+    capture.release()
+    assert len(swept) == len(subtract_s) == len(configs)
+
+    for config, scores in zip(configs, swept):
+        capture = cv.VideoCapture(motion_video)
+        expected = compute_motion_scores(capture, create_config_back_sub(config), frame_step=frame_step)
+        capture.release()
+        for name in ('frames', 'times_ms', 'white_pixels'):
+            np.testing.assert_array_equal(scores[name], expected[name], err_msg=f'{name} of {config}')
+        assert scores['white_pixels'].max() > 0
+
+
+def test_sweep_without_frame_count(motion_video):
+    back_subs = [create_config_back_sub(BASE)]
+    swept, _ = compute_sweep_scores(UnknownLengthCapture(motion_video), back_subs)
+    assert len(swept[0]['frames']) > 0
@@ -0,0 +1,156 @@
+import json
+import threading
+
+import pytest
+
+from decorators import tracing
+from decorators.all_decorators import record_performance
+from decorators.tracing import add_stage, count, span, to_chrome_trace, traced, write_trace
+
+
+@pytest.fixture
+def spans(monkeypatch):
+    """
+    Enable tracing for a single test, and return the list its root spans are recorded into.
+    """
+    root_spans = []
+    monkeypatch.setattr(tracing, '_root_spans', root_spans)
+    monkeypatch.setattr(tracing, '_main_stack', [])
+    monkeypatch.setattr(tracing, '_enabled', False)
+    tracing.enable_tracing()
+    return root_spans
+
+
+def test_disabled_tracing_records_nothing(monkeypatch):
+    monkeypatch.setattr(tracing, '_root_spans', [])
+    monkeypatch.setattr(tracing, '_enabled', False)
+    with span('outer') as record:
+        count('frames')
+        add_stage('decode', 1.0, 10)
+    assert record is None
+    assert tracing._root_spans == []
+
+
+def test_spans_nest(spans):
+    with span('outer', video='a.mp4'):
+        with span('first'):
+            pass
+        with span('second'):
+            with span('inner'):
+                pass
+    with span('next'):
+        pass
+
+    assert [record['name'] for record in spans] == ['outer', 'next']
+    outer = spans[0]
+    assert outer['attributes'] == {'video': 'a.mp4'}
+    assert [child['name'] for child in outer['children']] == ['first', 'second']
+    assert [child['name'] for child in outer['children'][1]['children']] == ['inner']
+    for key in ('wall_s', 'cpu_s', 'rss_mb'):
+        assert outer[key] >= 0
+    assert outer['wall_s'] >= outer['children'][1]['wall_s'] >= outer['children'][1]['children'][0]['wall_s']
+
+
+def test_span_is_closed_on_error(spans):
+    with pytest.raises(ValueError):
+        with span('outer'):
+            raise ValueError
+    with span('next'):
+        pass
+
+    assert [record['name'] for record in spans] == ['outer', 'next']
+    assert 'wall_s' in spans[0]
+
+
+def test_counters_add_up(spans):
+    with span('outer'):
+        count('frames', 10)
+        with span('inner'):
+            count('frames', 5)
+        count('frames', 10)
+        count('clips')
+
+    assert spans[0]['counters'] == {'frames': 20, 'clips': 1}
+    assert spans[0]['children'][0]['counters'] == {'frames': 5}
+
+
+def test_worker_threads_report_to_the_main_thread_span(spans):
+    def work():
+        count('clips')
+        with span('render'):
+            count('frames', 2)
+
+    with span('render_jobs'):
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    record = spans[0]
+    assert record['counters'] == {'clips': 4}
+    assert [child['name'] for child in record['children']] == ['render'] * 4
+    assert all(child['counters'] == {'frames': 2} for child in record['children'])
+
+
+def test_stages_are_laid_out_back_to_back(spans):
+    with span('analyze'):
+        add_stage('decode', 2.0, 100)
+        add_stage('subtract', 1.5, 99)
+
+    stages = spans[0]['children']
+    assert [(stage['name'], stage['wall_s'], stage['counters']) for stage in stages] == [
+        ('decode', 2.0, {'calls': 100}), ('subtract', 1.5, {'calls': 99})]
+
+    events = to_chrome_trace(spans)['traceEvents']
+    assert [event['name'] for event in events] == ['analyze', 'decode', 'subtract']
+    assert events[2]['ts'] == events[1]['ts'] + events[1]['dur'] == events[0]['ts'] + 2_000_000
+
+
+def test_traced(spans):
+    @traced()
+    def analyze(value):
+        return value * 2
+
+    assert analyze(21) == 42
+    assert [record['name'] for record in spans] == [analyze.__qualname__]
+
+
+def test_record_performance(spans, capsys):
+    @record_performance
+    def process_video(value):
+        with span('decode'):
+            return value + 1
+
+    assert process_video(1) == 2
+    assert process_video.__name__ == 'process_video'
+    assert [record['name'] for record in spans] == ['process_video']
+    assert [child['name'] for child in spans[0]['children']] == ['decode']
+    assert 'process_video took' in capsys.readouterr().out
+
+
+@pytest.mark.parametrize('file_name', ['trace.json', 'trace.trace.json'])
+def test_write_trace(tmp_path, spans, file_name):
+    with span('outer'):
+        add_stage('decode', 1.0, 10)
+    write_trace(tmp_path / file_name)
+
+    with open(tmp_path / file_name, 'r') as f:
+        data = json.load(f)
+    if file_name.endswith(tracing.CHROME_TRACE_SUFFIX):
+        assert [event['name'] for event in data['traceEvents']] == ['outer', 'decode']
+        assert data['otherData']['peak_rss_mb'] > 0
+    else:
+        assert [record['name'] for record in data['spans']] == ['outer']
+        # Reported once per run, as it is a high-water mark of the whole process
+        assert data['peak_rss_mb'] > 0
+        assert 'peak_rss_mb' not in data['spans'][0]
+
+
+def test_spans_without_resource(spans, monkeypatch):
+    # Like on Windows, where the CPU time of child processes isn't tracked
+    monkeypatch.setattr(tracing, 'resource', None)
+    with span('outer'):
+        pass
+    assert 'children_cpu_s' not in spans[0]
+    assert spans[0]['rss_mb'] > 0
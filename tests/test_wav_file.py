@@ -0,0 +1,144 @@
+import struct
+import wave
+
+import numpy as np
+import pytest
+
+from wav_splitter.split_wav import split_wav_natively
+from wav_splitter.wav_file import (RF64_PLACEHOLDER_SIZE, build_pcm_fmt, get_duration, read_wav_header, slice_wav,
+                                   write_wav)
+
+SAMPLE_RATE = 8000
+NUM_CHANNELS = 2
+
+
+def make_samples(duration_s, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.integers(-32768, 32767, size=(round(duration_s * SAMPLE_RATE), NUM_CHANNELS), dtype='<i2').tobytes()
+
+
+def write_chunks(path, riff_id, chunks, riff_size=None):
+    """
+    Write a WAV file made of the given (id, data, size) chunks, where size is the size written in the chunk header,
+    which defaults to the length of data.
+    """
+    body = b''
+    for chunk_id, data, size in chunks:
+        body += struct.pack('<4sI', chunk_id, len(data) if size is None else size) + data + b'\0' * (len(data) % 2)
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<4sI4s', riff_id, 4 + len(body) if riff_size is None else riff_size, b'WAVE') + body)
+    return path
+
+
+def test_read_riff_header(tmp_path):
+    samples = make_samples(1.5)
+    with wave.open(str(tmp_path / 'audio.wav'), 'wb') as wav:
+        wav.setnchannels(NUM_CHANNELS)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE)
+        wav.writeframes(samples)
+
+    header = read_wav_header(tmp_path / 'audio.wav')
+    assert header['fmt'] == build_pcm_fmt(NUM_CHANNELS, SAMPLE_RATE)
+    assert header['audio_format'] == 1
+    assert header['num_channels'] == NUM_CHANNELS
+    assert header['sample_rate'] == SAMPLE_RATE
+    assert header['block_align'] == 4
+    assert header['data_offset'] == 44
+    assert header['data_size'] == len(samples)
+    assert get_duration(header) == 1.5
+
+
+def test_read_header_skips_odd_chunks(tmp_path):
+    samples = make_samples(0.5)
+    path = write_chunks(tmp_path / 'audio.wav', b'RIFF', [
+        (b'fmt ', build_pcm_fmt(NUM_CHANNELS, SAMPLE_RATE), None),
+        # Padded to an even size
+        (b'LIST', b'INFOabc', None),
+        (b'data', samples, None),
+    ])
+
+    header = read_wav_header(path)
+    assert header['data_offset'] == 12 + 8 + 16 + 8 + 8 + 8
+    assert header['data_size'] == len(samples)
+
+
+def test_read_rf64_header(tmp_path):
+    samples = make_samples(0.5)
+    # riff_size, data_size and sample count, followed by an empty table
+    ds64 = struct.pack('<QQQI', 4 + 8 + 28 + 8 + 16 + 8 + len(samples), len(samples), len(samples) // 4, 0)
+    path = write_chunks(tmp_path / 'audio.wav', b'RF64', [
+        (b'ds64', ds64, None),
+        (b'fmt ', build_pcm_fmt(NUM_CHANNELS, SAMPLE_RATE), None),
+        (b'data', samples, RF64_PLACEHOLDER_SIZE),
+    ], riff_size=RF64_PLACEHOLDER_SIZE)
+
+    header = read_wav_header(path)
+    assert header['data_offset'] == 12 + 8 + 28 + 8 + 16 + 8
+    assert header['data_size'] == len(samples)
+
+
+def test_read_streamed_header(tmp_path):
+    # Written to a pipe: the sizes were never filled in
+    samples = make_samples(0.5)
+    path = write_chunks(tmp_path / 'audio.wav', b'RIFF', [
+        (b'fmt ', build_pcm_fmt(NUM_CHANNELS, SAMPLE_RATE), None),
+        (b'data', samples, RF64_PLACEHOLDER_SIZE),
+    ], riff_size=RF64_PLACEHOLDER_SIZE)
+
+    assert read_wav_header(path)['data_size'] == len(samples)
+
+
+@pytest.mark.parametrize('chunks', [
+    # Compressed (MPEG layer 3) samples
+    [(b'fmt ', struct.pack('<HHIIHH', 0x0055, 2, 44100, 16000, 1, 0), None), (b'data', b'\0' * 64, None)],
+    # No fmt chunk before the samples
+    [(b'data', b'\0' * 64, None)],
+    # No data chunk
+    [(b'fmt ', build_pcm_fmt(NUM_CHANNELS, SAMPLE_RATE), None)],
+])
+def test_read_unsliceable_header(tmp_path, chunks):
+    assert read_wav_header(write_chunks(tmp_path / 'audio.wav', b'RIFF', chunks)) is None
+
+
+def test_read_non_wav_header(tmp_path):
+    (tmp_path / 'audio.mp3').write_bytes(b'ID3\x04' + b'\0' * 64)
+    assert read_wav_header(tmp_path / 'audio.mp3') is None
+
+
+def test_slice_wav(tmp_path):
+    samples = make_samples(2.3)
+    path = tmp_path / 'audio.wav'
+    write_wav(path, build_pcm_fmt(NUM_CHANNELS, SAMPLE_RATE), samples)
+    header = read_wav_header(path)
+
+    slices = [(i, bytes(data)) for i, data in slice_wav(path, header, 0.5)]
+    assert [i for i, _ in slices] == [0, 1, 2, 3, 4]
+    assert [len(data) for _, data in slices] == [4000 * 4] * 4 + [2400 * 4]
+    assert b''.join(data for _, data in slices) == samples
+
+
+def test_slice_wav_on_block_boundaries(tmp_path):
+    samples = make_samples(1)
+    path = tmp_path / 'audio.wav'
+    write_wav(path, build_pcm_fmt(NUM_CHANNELS, SAMPLE_RATE), samples)
+
+    # 0.33333s is not a whole number of samples: slices are rounded to one
+    for _, data in slice_wav(path, read_wav_header(path), 1 / 3):
+        assert len(data) % 4 == 0
+
+
+def test_split_wav_natively(tmp_path):
+    samples = make_samples(2.3)
+    write_wav(tmp_path / 'audio.wav', build_pcm_fmt(NUM_CHANNELS, SAMPLE_RATE), samples)
+    header = read_wav_header(tmp_path / 'audio.wav')
+
+    assert split_wav_natively(tmp_path / 'audio.wav', tmp_path, 1, header) == 3
+
+    segments = b''
+    for i in range(1, 4):
+        # Segments are readable on their own
+        with wave.open(str(tmp_path / f'segment_{i}.wav'), 'rb') as wav:
+            assert (wav.getnchannels(), wav.getsampwidth(), wav.getframerate()) == (NUM_CHANNELS, 2, SAMPLE_RATE)
+            segments += wav.readframes(wav.getnframes())
+    assert segments == samples
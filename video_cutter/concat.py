@@ -0,0 +1,36 @@
+import os
+
+import ffmpeg
+
+from decorators.tracing import count, span
+
+
+def build_concat_script(entries):
+    """
+    Return a concat demuxer script listing the given (path, inpoint, outpoint) entries. inpoint and outpoint can be
+    None to use the whole file.
+    """
+    lines = ['ffconcat version 1.0']
+    for path, inpoint, outpoint in entries:
+        # The script is read from a pipe, so relative paths would be resolved against "pipe:"
+        escaped_path = 'file:' + os.path.abspath(path).replace("'", "'\\''")
+        lines.append(f"file '{escaped_path}'")
+        if inpoint is not None:
+            lines.append(f"inpoint {inpoint}")
+        if outpoint is not None:
+            lines.append(f"outpoint {outpoint}")
+    return '\n'.join(lines) + '\n'
+
+
+def run_concat_script(entries, output_video, quiet=False):
+    """
+    Join the given (path, inpoint, outpoint) entries into output_video without re-encoding.
+
+    The concat script is fed through stdin, so that nothing is written next to the output.
+    """
+    with span('concat'):
+        count('entries', len(entries))
+        (ffmpeg
+         .input('pipe:', format='concat', safe=0, protocol_whitelist='file,pipe')
+         .output(str(output_video), c='copy')
+         .run(input=build_concat_script(entries).encode(), overwrite_output=True, quiet=quiet))
@@ -0,0 +1,162 @@
+import tempfile
+from pathlib import Path
+
+import ffmpeg
+
+from decorators.tracing import count, span
+from .concat import run_concat_script
+from .keyframe_index import count_frames, load_keyframe_index, plan_smart_cut, snap_to_keyframe
+
+ANALYZE_DURATION = '10M'  # Increase analyzeduration (10 million microseconds = 10 seconds)
+PROBE_SIZE = '50M'  # Increase probesize to 50 megabytes
+
+# Encoders able to produce a stream that can be concatenated with stream-copied parts of the source
+SMART_CUT_ENCODERS = {
+    'h264': 'libx264',
+    'hevc': 'libx265',
+    'mpeg4': 'mpeg4',
+}
+# Profiles reported by ffprobe, as named by the profile option of each encoder
+ENCODER_PROFILES = {
+    'libx264': {'Constrained Baseline': 'baseline', 'Baseline': 'baseline', 'Main': 'main', 'High': 'high',
+                'High 10': 'high10', 'High 4:2:2': 'high422', 'High 4:4:4 Predictive': 'high444'},
+    'libx265': {'Main': 'main', 'Main 10': 'main10', 'Main Still Picture': 'mainstillpicture'},
+}
+
+CUT_ENCODE = 'encode'
+CUT_SNAP = 'snap'
+CUT_SMART = 'smart'
+CUT_MODES = [CUT_ENCODE, CUT_SNAP, CUT_SMART]
+
+
+def get_video_stream(input_video):
+    probe = ffmpeg.probe(input_video, select_streams='v:0', analyzeduration=ANALYZE_DURATION, probesize=PROBE_SIZE)
+    return probe['streams'][0]
+
+
+def get_encoder_args(video_stream):
+    """
+    Return the ffmpeg output arguments re-encoding video like video_stream (an ffprobe stream dict): same codec,
+    profile, level and pixel format, so that players don't have to reconfigure their decoder at every join.
+    """
+    encoder = SMART_CUT_ENCODERS.get(video_stream['codec_name'], 'libx264')
+    args = {'vcodec': encoder, 'pix_fmt': video_stream.get('pix_fmt', 'yuv420p')}
+
+    profile = ENCODER_PROFILES.get(encoder, {}).get(video_stream.get('profile'))
+    if profile is not None:
+        args['profile:v'] = profile
+    level = video_stream.get('level', -99)
+    if level > 0:
+        # H.264 levels are reported as level_idc (level x 10), and H.265 levels as general_level_idc (level x 30)
+        if encoder == 'libx264':
+            args['level'] = f'{level / 10:.1f}'
+        elif encoder == 'libx265':
+            args['x265-params'] = f'level-idc={level / 30:.1f}'
+    return args
+
+
+def render_smart_cut_part(input_video, mode, start, end, part_path, video_stream, quiet=False):
+    """
+    Write one part of a smart cut as MPEG-TS, which carries codec parameters in-band so that re-encoded and
+    stream-copied parts can be concatenated.
+
+    A stream-copied part runs from keyframe to keyframe, but ffmpeg stops copying by decoding timestamp: with
+    B-frames, the keyframe at end and a frame or two after it are decoded before end, and would be copied. The next
+    part re-encodes those frames, so the copy is limited to the number of frames presented before end instead. This
+    relies on closed GOPs, where every frame presented before a keyframe is also decoded before it.
+
+    Only the video of the boundary parts is re-encoded: their audio is stream-copied like the rest, so that every part
+    has the source's audio codec and parameters. ffmpeg copies audio from the keyframe it seeks to, or from slightly
+    before the keyframe when the part starts on one, so the packets before start are dropped (copypriorss=0) to keep
+    the audio in sync and avoid repeating the end of the previous part.
+    """
+    source = ffmpeg.input(input_video, ss=start, t=end - start, analyzeduration=ANALYZE_DURATION,
+                          probesize=PROBE_SIZE)
+    if mode == 'copy':
+        output = source.output(str(part_path), c='copy', f='mpegts', copypriorss=0,
+                               **{'frames:v': count_frames(input_video, start, end)})
+    else:
+        output = source.output(str(part_path), f='mpegts', acodec='copy', copypriorss=0,
+                               **get_encoder_args(video_stream))
+    output.run(overwrite_output=True, quiet=quiet)
+
+
+def smart_cut(input_video, segments, output_video, keyframes=None, scratch_dir=None, quiet=False):
+    """
+    Write the given segments of input_video, back to back, into output_video. Only the partial GOPs at each cut are
+    re-encoded, everything in between is stream-copied.
+
+    Args:
+        input_video (str): Path to the source video.
+        segments (list): {"from", "to"} dicts in seconds, sorted and not overlapping.
+        output_video (str): Path to the output video.
+        keyframes (list): Keyframe times of input_video. Loaded from its keyframe index when not provided.
+        scratch_dir (str): Directory where the parts are written before being joined. Defaults to the system's
+            temporary directory.
+        quiet (bool): If true, ffmpeg output is captured instead of printed, and attached to ffmpeg.Error on failure.
+    """
+    if keyframes is None:
+        keyframes = load_keyframe_index(input_video)
+    video_stream = get_video_stream(input_video)
+    if video_stream['codec_name'] not in SMART_CUT_ENCODERS:
+        print(f"No matching encoder for {video_stream['codec_name']}: re-encoding whole segments instead.")
+        keyframes = []
+
+    encoded_s = 0
+    copied_s = 0
+    with tempfile.TemporaryDirectory(dir=scratch_dir) as parts_dir:
+        part_paths = []
+        for i, segment in enumerate(segments):
+            for j, (mode, start, end) in enumerate(plan_smart_cut(segment['from'], segment['to'], keyframes)):
+                part_path = Path(parts_dir) / f"part_{i}_{j}.ts"
+                with span(f'smart_cut_{mode}'):
+                    render_smart_cut_part(input_video, mode, start, end, part_path, video_stream, quiet)
+                part_paths.append(part_path)
+                if mode == 'copy':
+                    copied_s += end - start
+                else:
+                    encoded_s += end - start
+
+        run_concat_script([(part_path, None, None) for part_path in part_paths], output_video, quiet)
+
+    count('encoded_s', encoded_s)
+    count('copied_s', copied_s)
+    print(f"Smart cut {output_video}: {encoded_s:.1f}s re-encoded, {copied_s:.1f}s stream-copied.")
+
+
+def cut_clip(input_video, start, end, output_path, cut_mode=CUT_ENCODE, keyframes=None, quiet=False,
+             **output_kwargs):
+    """
+    Cut [start, end] (in seconds) out of input_video into output_path.
+
+    Args:
+        cut_mode (str): One of:
+            - "encode": re-encode the whole clip, with output_kwargs passed to the ffmpeg output.
+            - "snap": stream-copy from the keyframe preceding start. The clip may start slightly early.
+            - "smart": re-encode only the partial GOPs at each end, and stream-copy the rest.
+        keyframes (list): Keyframe times of input_video, for "snap" and "smart". Loaded from its keyframe index when not
+            provided.
+        quiet (bool): If true, ffmpeg output is captured instead of printed, and attached to ffmpeg.Error on failure.
+            Useful when several clips are cut concurrently.
+    """
+    if cut_mode == CUT_ENCODE:
+        (ffmpeg
+         .input(input_video, ss=start, t=end - start, analyzeduration=ANALYZE_DURATION, probesize=PROBE_SIZE)
+         .output(str(output_path), **output_kwargs)
+         .run(overwrite_output=True, quiet=quiet))
+        return
+
+    if keyframes is None:
+        keyframes = load_keyframe_index(input_video)
+
+    if cut_mode == CUT_SNAP:
+        start = snap_to_keyframe(start, keyframes)
+        (ffmpeg
+         .input(input_video, ss=start, t=end - start, analyzeduration=ANALYZE_DURATION, probesize=PROBE_SIZE)
+         .output(str(output_path), c='copy')
+         .run(overwrite_output=True, quiet=quiet))
+    elif cut_mode == CUT_SMART:
+        smart_cut(input_video, [{'from': start, 'to': end}], output_path, keyframes,
+                  scratch_dir=Path(output_path).parent, quiet=quiet)
+    else:
+        raise ValueError(f'Unknown cut mode: {cut_mode}')
@@ -0,0 +1,201 @@
+import ffmpeg
+
+from decorators.tracing import count, span
+from .concat import run_concat_script
+from .cut_clip import CUT_ENCODE, CUT_SMART, CUT_SNAP, smart_cut
+from .keyframe_index import load_keyframe_index, snap_segments
+
+ANALYZE_DURATION = '10M'  # Increase analyzeduration (10 million microseconds = 10 seconds)
+PROBE_SIZE = '50M'  # Increase probesize to 50 megabytes
+PIXEL_FORMAT = 'yuv420p'  # Pixel format for the output video
+
+# Above this many segments, a trim/concat filter graph spends more time pushing every frame through every branch than
+# a single select filter takes to evaluate its expression
+TRIM_CONCAT_MAX_SEGMENTS = 32
+
+METHOD_AUTO = 'auto'
+METHOD_TRIM = 'trim'
+METHOD_SELECT = 'select'
+METHOD_COPY = 'copy'
+METHOD_SMART = 'smart'
+METHODS = [METHOD_AUTO, METHOD_TRIM, METHOD_SELECT, METHOD_COPY, METHOD_SMART]
+
+# Extraction method matching each clip cut mode, for when the clips are extracted into a single video
+CUT_MODE_METHODS = {
+    CUT_ENCODE: METHOD_AUTO,
+    CUT_SNAP: METHOD_COPY,
+    CUT_SMART: METHOD_SMART,
+}
+
+
+def probe_source(input_video):
+    """
+    Return the frame rate of input_video's video stream, as a "num/den" string, and whether it has an audio stream.
+    """
+    probe = ffmpeg.probe(input_video, analyzeduration=ANALYZE_DURATION, probesize=PROBE_SIZE)
+    video_stream = next(stream for stream in probe['streams'] if stream['codec_type'] == 'video')
+    has_audio = any(stream['codec_type'] == 'audio' for stream in probe['streams'])
+    return video_stream['r_frame_rate'], has_audio
+
+
+def choose_method(segments, method=METHOD_AUTO):
+    """
+    Return the extraction method to use for the given segments. Stream copy and smart cut are never picked
+    automatically, since they rely on the keyframe layout of the source.
+    """
+    if method != METHOD_AUTO:
+        return method
+    return METHOD_TRIM if len(segments) <= TRIM_CONCAT_MAX_SEGMENTS else METHOD_SELECT
+
+
+def build_trim_concat(video, audio, segments, offset):
+    """
+    One trim (and atrim) branch per segment, joined by a concat filter. audio is None when there is no audio stream.
+    """
+    parts = []
+    for segment in segments:
+        start = segment['from'] - offset
+        end = segment['to'] - offset
+        parts.append(video.filter('trim', start=start, end=end).filter('setpts', 'PTS-STARTPTS'))
+        if audio is not None:
+            parts.append(audio.filter('atrim', start=start, end=end).filter('asetpts', 'PTS-STARTPTS'))
+
+    joined = ffmpeg.concat(*parts, v=1, a=0 if audio is None else 1).node
+    return [joined[0]] if audio is None else [joined[0], joined[1]]
+
+
+def build_select(video, audio, segments, offset):
+    """
+    A single select filter keeping every video frame that starts within any of the segments, and one atrim branch per
+    segment for the audio, joined by a concat filter. audio is None when there is no audio stream.
+
+    Segments are half-open, like trim's, so that a frame on the boundary of two segments is only kept once. Like trim,
+    the boundaries are compared to the timestamps in time base units, so that a frame starting exactly on a boundary
+    isn't lost to floating point rounding. The audio is trimmed to the sample rather than selected: aselect keeps or
+    drops whole audio frames (1024 samples for AAC), which makes the audio drift away from the video by up to a frame
+    per segment. Audio branches are cheap next to video ones, so they don't cost the select filter its advantage.
+    """
+    expression = '+'.join(f"gte(pts,round({segment['from'] - offset}/TB))*lt(pts,round({segment['to'] - offset}/TB))"
+                          for segment in segments)
+    streams = [video.filter('select', expression).filter('setpts', 'N/FRAME_RATE/TB')]
+    if audio is not None:
+        # ffmpeg-python only splits input streams implicitly, not the outputs of a split filter
+        audios = ffmpeg.filter_multi_output(audio, 'asplit', len(segments)) if len(segments) > 1 else [audio]
+        parts = [audios[i].filter('atrim', start=segment['from'] - offset, end=segment['to'] - offset)
+                 .filter('asetpts', 'PTS-STARTPTS') for i, segment in enumerate(segments)]
+        streams.append(ffmpeg.concat(*parts, v=0, a=1).node[0])
+    return streams
+
+
+def extract_segments(input_video, segments, output_video, method=METHOD_AUTO, keyframes=None, quiet=False,
+                     **output_kwargs):
+    """
+    Write the given segments of input_video, back to back, into output_video, with a single ffmpeg process.
+
+    The source is probed and decoded once, and no intermediate file is written.
+
+    Args:
+        input_video (str): Path to the source video.
+        segments (list): {"from", "to"} dicts in seconds, sorted and not overlapping.
+        output_video (str): Path to the output video.
+        method (str): One of:
+            - "trim": a trim/concat filter graph. Frame-accurate, best for a handful of segments.
+            - "select": a select filter for the video, and atrim/concat for the audio. Frame-accurate, scales to
+              hundreds of segments.
+            - "copy": the concat demuxer with inpoint/outpoint directives, and no re-encoding at all. Every cut snaps
+              to the closest preceding keyframe, according to the source's keyframe index.
+            - "smart": only the partial GOPs at each cut are re-encoded, the rest is stream-copied. Frame-accurate,
+              but writes (small) intermediate files for the re-encoded parts.
+            - "auto": "trim" or "select" depending on the number of segments.
+        keyframes (list): Keyframe times of input_video, for "copy" and "smart". Loaded from its keyframe index when
+            not provided.
+        quiet (bool): If true, ffmpeg output is captured instead of printed, and attached to ffmpeg.Error on failure.
+        output_kwargs: Passed to the ffmpeg output of "trim" and "select", e.g. threads.
+
+    Returns:
+        str: The method that was used.
+    """
+    method = choose_method(segments, method)
+    if not segments:
+        raise ValueError('No segments to extract.')
+
+    print(f"Extracting {len(segments)} segments of {input_video} into {output_video} ({method})...")
+    with span('extract', method=method, output=str(output_video)):
+        count('segments', len(segments))
+        if method in (METHOD_COPY, METHOD_SMART) and keyframes is None:
+            keyframes = load_keyframe_index(input_video)
+        if method == METHOD_COPY:
+            # Start every segment on a keyframe, so that audio and video both start at the inpoint
+            snapped = snap_segments(segments, keyframes)
+            run_concat_script([(input_video, segment['from'], segment['to']) for segment in snapped], output_video,
+                              quiet)
+            return method
+        if method == METHOD_SMART:
+            smart_cut(input_video, segments, output_video, keyframes, quiet=quiet)
+            return method
+
+        # Seek straight to the first segment, and stop after the last one, so that nothing outside of them is decoded
+        offset = segments[0]['from']
+        source = ffmpeg.input(input_video, ss=offset, t=segments[-1]['to'] - offset, analyzeduration=ANALYZE_DURATION,
+                              probesize=PROBE_SIZE)
+        frame_rate, has_audio = probe_source(input_video)
+        audio = source.audio if has_audio else None
+
+        if method == METHOD_TRIM:
+            streams = build_trim_concat(source.video, audio, segments, offset)
+        elif method == METHOD_SELECT:
+            streams = build_select(source.video, audio, segments, offset)
+        else:
+            raise ValueError(f'Unknown extraction method: {method}')
+
+        # Keep the source's frame rate: the timestamps set by the filters don't carry it, so the output would default
+        # to 25 fps, dropping frames to get there
+        ffmpeg.output(*streams, str(output_video), pix_fmt=PIXEL_FORMAT, r=frame_rate,
+                      **output_kwargs).run(overwrite_output=True, quiet=quiet)
+    return method
+
+
+def extract_segment_sets(input_video, segment_sets, quiet=False, **output_kwargs):
+    """
+    Write several sets of segments of input_video, each into its own output video, from a single decode of the source:
+    the decoded frames are split between one select branch per output (see build_select()).
+
+    Args:
+        input_video (str): Path to the source video.
+        segment_sets (dict): {output_video: segments}, where segments are {"from", "to"} dicts in seconds, sorted.
+            Empty sets are skipped.
+        quiet (bool): If true, ffmpeg output is captured instead of printed, and attached to ffmpeg.Error on failure.
+        output_kwargs: Passed to every ffmpeg output, e.g. threads.
+    """
+    segment_sets = {output_video: segments for output_video, segments in segment_sets.items() if segments}
+    if not segment_sets:
+        raise ValueError('No segments to extract.')
+
+    print(f"Extracting {sum(len(segments) for segments in segment_sets.values())} segments of {input_video} into "
+          f"{len(segment_sets)} videos, with a single decode...")
+
+    # Seek straight to the first segment of any set, and stop after the last one, so that nothing outside of them is
+    # decoded
+    offset = min(segments[0]['from'] for segments in segment_sets.values())
+    end = max(segments[-1]['to'] for segments in segment_sets.values())
+    source = ffmpeg.input(input_video, ss=offset, t=end - offset, analyzeduration=ANALYZE_DURATION,
+                          probesize=PROBE_SIZE)
+    frame_rate, has_audio = probe_source(input_video)
+
+    num_outputs = len(segment_sets)
+    if num_outputs > 1:
+        videos = ffmpeg.filter_multi_output(source.video, 'split', num_outputs)
+        audios = ffmpeg.filter_multi_output(source.audio, 'asplit', num_outputs) if has_audio else None
+    else:
+        videos = [source.video]
+        audios = [source.audio] if has_audio else None
+
+    outputs = []
+    for i, (output_video, segments) in enumerate(segment_sets.items()):
+        streams = build_select(videos[i], audios[i] if has_audio else None, segments, offset)
+        outputs.append(ffmpeg.output(*streams, str(output_video), pix_fmt=PIXEL_FORMAT, r=frame_rate,
+                                     **output_kwargs))
+
+    with span('extract', method=METHOD_SELECT, outputs=len(outputs)):
+        count('segments', sum(len(segments) for segments in segment_sets.values()))
+        ffmpeg.merge_outputs(*outputs).run(overwrite_output=True, quiet=quiet)
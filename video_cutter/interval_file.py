@@ -0,0 +1,206 @@
+import json
+from pathlib import Path
+
+import numpy as np
+
+MAGIC = b'INTV'
+VERSION = 1
+INTERVALS_SUFFIX = '.intervals'
+
+FORMAT_JSON = 'json'
+FORMAT_INTERVALS = 'intervals'
+FORMATS = [FORMAT_JSON, FORMAT_INTERVALS]
+
+# Intensive movements ({"from", "to"}), or diarization turns ({"start", "stop", "speaker"})
+KIND_MOVEMENTS = 'movements'
+KIND_TURNS = 'turns'
+KINDS = [KIND_MOVEMENTS, KIND_TURNS]
+
+# Fixed-size header. num_intervals is -1 until the writer is closed, so that a truncated file is never read as complete.
+HEADER_DTYPE = np.dtype([('magic', 'S4'), ('version', '<u2'), ('kind', '<u2'), ('num_intervals', '<i8'),
+                         ('labels_offset', '<i8'), ('reserved', '<i8')])
+# One row per interval: start and stop in milliseconds, and the index of its label (speaker) in the label table, or -1.
+# The label table is stored once, as JSON, after the last interval.
+INTERVAL_DTYPE = np.dtype([('start_ms', '<i4'), ('stop_ms', '<i4'), ('label', '<i4')])
+# Number of intervals buffered by the writer, and decoded at once by the reader
+CHUNK_SIZE = 4096
+# int32 milliseconds: a little over 24 days
+MAX_MS = np.iinfo(np.int32).max
+
+
+def to_ms(seconds):
+    ms = int(round(seconds * 1000))
+    if not 0 <= ms <= MAX_MS:
+        raise ValueError(f'{seconds}s is out of the range of interval files (0 to {MAX_MS // 1000}s).')
+    return ms
+
+
+def to_seconds(ms):
+    """
+    Return a time in seconds, as an int when it is whole, like the times of intensive movements.
+    """
+    return ms // 1000 if ms % 1000 == 0 else ms / 1000
+
+
+def is_interval_file(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+class IntervalWriter:
+    """
+    Write intervals to a binary interval file one at a time, as they are produced, with the same interface as
+    speech_diarization.streaming.JsonArrayWriter.
+
+    Args:
+        output_file (str): Path to the interval file.
+        kind (str): "movements", written from {"from", "to"} dicts, or "turns", written from {"start", "stop",
+            "speaker"} dicts.
+    """
+
+    def __init__(self, output_file, kind=KIND_MOVEMENTS):
+        if kind not in KINDS:
+            raise ValueError(f'Unknown kind of intervals: {kind}')
+        self.output_file = output_file
+        self.kind = kind
+        self.file = None
+        self.count = 0
+        self.labels = {}
+        self.buffer = []
+
+    def __enter__(self):
+        self.file = open(self.output_file, 'wb')
+        self.write_header(-1, 0)
+        return self
+
+    def write_header(self, num_intervals, labels_offset):
+        header = np.array([(MAGIC, VERSION, KINDS.index(self.kind), num_intervals, labels_offset, 0)],
+                          dtype=HEADER_DTYPE)
+        self.file.seek(0)
+        self.file.write(header.tobytes())
+
+    def write(self, entry):
+        if self.kind == KIND_TURNS:
+            label = self.labels.setdefault(entry['speaker'], len(self.labels))
+            self.buffer.append((to_ms(entry['start']), to_ms(entry['stop']), label))
+        else:
+            self.buffer.append((to_ms(entry['from']), to_ms(entry['to']), -1))
+        self.count += 1
+        if len(self.buffer) >= CHUNK_SIZE:
+            self.write_buffer()
+
+    def write_buffer(self):
+        if self.buffer:
+            self.file.write(np.array(self.buffer, dtype=INTERVAL_DTYPE).tobytes())
+            self.buffer = []
+
+    def flush(self):
+        self.write_buffer()
+        self.file.flush()
+
+    def __exit__(self, exc_type, *exc_info):
+        # On an error, the file is left incomplete, and can't be read
+        if exc_type is None:
+            self.write_buffer()
+            labels_offset = self.file.tell()
+            self.file.write(json.dumps(list(self.labels)).encode())
+            self.write_header(self.count, labels_offset)
+        self.file.close()
+
+
+class IntervalFile:
+    """
+    Read a binary interval file (see IntervalWriter) lazily: intervals are memory-mapped, and only decoded into dicts
+    a chunk at a time, while they are iterated.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)
+        if len(header) != 1 or header['magic'][0] != MAGIC:
+            raise ValueError(f'{path} is not an interval file.')
+        if header['version'][0] != VERSION:
+            raise ValueError(f'{path} has an unsupported interval file version: {header["version"][0]}')
+        num_intervals = int(header['num_intervals'][0])
+        if num_intervals < 0:
+            raise ValueError(f'{path} is incomplete: its writer was not closed.')
+        self.kind = KINDS[header['kind'][0]]
+
+        with open(path, 'rb') as f:
+            f.seek(int(header['labels_offset'][0]))
+            self.labels = json.loads(f.read())
+        self.intervals = (np.memmap(path, dtype=INTERVAL_DTYPE, mode='r', offset=HEADER_DTYPE.itemsize,
+                                    shape=(num_intervals,))
+                          if num_intervals else np.empty(0, dtype=INTERVAL_DTYPE))
+
+    def __len__(self):
+        return len(self.intervals)
+
+    def __iter__(self):
+        """
+        Yield the intervals as {"from", "to"} movements or {"start", "stop", "speaker"} turns, in seconds.
+        """
+        for chunk_start in range(0, len(self.intervals), CHUNK_SIZE):
+            chunk = self.intervals[chunk_start:chunk_start + CHUNK_SIZE]
+            rows = zip(chunk['start_ms'].tolist(), chunk['stop_ms'].tolist(), chunk['label'].tolist())
+            if self.kind == KIND_TURNS:
+                for start_ms, stop_ms, label in rows:
+                    yield {"start": start_ms / 1000, "stop": stop_ms / 1000, "speaker": self.labels[label]}
+            else:
+                for start_ms, stop_ms, _ in rows:
+                    yield {"from": to_seconds(start_ms), "to": to_seconds(stop_ms)}
+
+
+def write_intervals(entries, output_file, kind=KIND_MOVEMENTS):
+    with IntervalWriter(output_file, kind) as writer:
+        for entry in entries:
+            writer.write(entry)
+    return writer.count
+
+
+def load_intervals(path):
+    """
+    Return the entries of a JSON file or of an interval file, as a list.
+    """
+    if is_interval_file(path):
+        return list(IntervalFile(path))
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def get_kind(entry):
+    return KIND_TURNS if 'speaker' in entry else KIND_MOVEMENTS
+
+
+def export_json(input_file, output_file):
+    """
+    Export an interval file to a JSON file, laid out like json.dump(entries, f, indent=4), one entry at a time.
+    """
+    count = 0
+    with open(output_file, 'w') as f:
+        f.write('[')
+        for entry in IntervalFile(input_file):
+            f.write(',\n' if count else '\n')
+            f.write('    ' + json.dumps(entry, indent=4).replace('\n', '\n    '))
+            count += 1
+        f.write('\n]' if count else ']')
+    return count
+
+
+def import_json(input_file, output_file):
+    """
+    Convert a JSON file of movements or turns into an interval file.
+    """
+    with open(input_file, 'r') as f:
+        entries = json.load(f)
+    return write_intervals(entries, output_file, get_kind(entries[0]) if entries else KIND_MOVEMENTS)
+
+
+def get_output_path(output_file, output_format=FORMAT_JSON):
+    """
+    Return the path results in output_format are written to, given their path without a suffix.
+    """
+    return Path(output_file).with_suffix(INTERVALS_SUFFIX if output_format == FORMAT_INTERVALS else '.json')
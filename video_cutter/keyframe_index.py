@@ -0,0 +1,111 @@
+import bisect
+import json
+import os
+
+import ffmpeg
+
+KEYFRAME_INDEX_SUFFIX = '.keyframes.json'
+
+
+def get_keyframe_index_path(input_video):
+    return f'{input_video}{KEYFRAME_INDEX_SUFFIX}'
+
+
+def build_keyframe_index(input_video):
+    """
+    Return the sorted presentation times, in seconds, of every keyframe of the first video stream.
+
+    Only packet flags are read, so this costs one pass of I/O over the file, and no decoding.
+    """
+    probe = ffmpeg.probe(input_video, select_streams='v:0', show_entries='packet=pts_time,flags')
+    return sorted(float(packet['pts_time']) for packet in probe['packets']
+                  if packet['flags'].startswith('K') and packet.get('pts_time') not in (None, 'N/A'))
+
+
+def count_frames(input_video, start, end):
+    """
+    Return the number of frames of the first video stream presented within [start, end), from the timestamps of its
+    packets, without decoding them.
+    """
+    probe = ffmpeg.probe(input_video, select_streams='v:0', show_entries='packet=pts_time',
+                         read_intervals=f'{start}%{end}')
+    return sum(1 for packet in probe['packets']
+               if packet.get('pts_time') not in (None, 'N/A') and start <= float(packet['pts_time']) < end)
+
+
+def load_keyframe_index(input_video):
+    """
+    Return the keyframe times of input_video, from its sidecar index file when it is up to date.
+
+    The index is (re)built and stored next to the video when the sidecar is missing, or was built for an older
+    version of the file.
+    """
+    stat = os.stat(input_video)
+    index_path = get_keyframe_index_path(input_video)
+
+    if os.path.exists(index_path):
+        with open(index_path, 'r') as f:
+            index = json.load(f)
+        if index['size'] == stat.st_size and index['mtime_ns'] == stat.st_mtime_ns:
+            return index['keyframes']
+
+    print(f"Building keyframe index of {input_video}...")
+    keyframes = build_keyframe_index(input_video)
+    try:
+        with open(index_path, 'w') as f:
+            json.dump({'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'keyframes': keyframes}, f)
+        print(f"Created {index_path} ({len(keyframes):,} keyframes)")
+    except OSError as e:
+        print(f"Could not store the keyframe index next to {input_video}: {e}")
+
+    return keyframes
+
+
+def snap_to_keyframe(time_s, keyframes):
+    """
+    Return the last keyframe at or before time_s, or time_s itself if there is none.
+    """
+    i = bisect.bisect_right(keyframes, time_s)
+    return keyframes[i - 1] if i else time_s
+
+
+def snap_segments(segments, keyframes):
+    """
+    Move the start of every segment back to the keyframe preceding it, so that it can be stream-copied without losing
+    any of the segment. Segments that overlap as a result are merged.
+    """
+    snapped = []
+    for segment in segments:
+        start = snap_to_keyframe(segment['from'], keyframes)
+        if snapped and start <= snapped[-1]['to']:
+            snapped[-1]['to'] = max(snapped[-1]['to'], segment['to'])
+        else:
+            snapped.append({'from': start, 'to': segment['to']})
+
+    return snapped
+
+
+def plan_smart_cut(start, end, keyframes):
+    """
+    Split [start, end] into the parts that need re-encoding and the part that can be stream-copied.
+
+    Returns:
+        list: ("encode" | "copy", start, end) tuples. Only the partial GOPs at each boundary are re-encoded, and
+            everything from the first keyframe after start to the last keyframe before end is copied.
+    """
+    first_keyframe_index = bisect.bisect_left(keyframes, start)
+    last_keyframe_index = bisect.bisect_right(keyframes, end) - 1
+    if first_keyframe_index >= last_keyframe_index:
+        # Less than a whole GOP in the segment: nothing worth copying
+        return [('encode', start, end)]
+
+    copy_start = keyframes[first_keyframe_index]
+    copy_end = keyframes[last_keyframe_index]
+    parts = []
+    if copy_start > start:
+        parts.append(('encode', start, copy_start))
+    parts.append(('copy', copy_start, copy_end))
+    if end > copy_end:
+        parts.append(('encode', copy_end, end))
+
+    return parts
@@ -0,0 +1,96 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import ffmpeg
+
+from decorators.tracing import count, span
+
+DEFAULT_ENCODER_THREADS = 2
+DEFAULT_RETRIES = 1
+# Number of ffmpeg stderr lines kept when describing a failed job
+ERROR_TAIL_LINES = 5
+
+
+def get_pool_size(encoder_threads=DEFAULT_ENCODER_THREADS, cpu_count=None):
+    """
+    Return how many ffmpeg processes can run at once without oversubscribing the CPU, given how many threads each
+    encoder uses.
+    """
+    cpu_count = cpu_count or os.cpu_count() or 1
+    return max(1, cpu_count // max(encoder_threads, 1))
+
+
+def describe_error(error):
+    """
+    Return a one-paragraph description of a failed job's error, including the end of ffmpeg's output when captured.
+    """
+    if isinstance(error, ffmpeg.Error) and error.stderr:
+        stderr_tail = error.stderr.decode(errors='replace').strip().splitlines()[-ERROR_TAIL_LINES:]
+        return f"{error}\n" + "\n".join(stderr_tail)
+    return str(error)
+
+
+def run_job(job_id, render, retries):
+    """
+    Run a single render job, retrying it on failure. Never raises: the outcome is reported in the returned dict.
+    """
+    attempts = 0
+    error = None
+    start_time = time.perf_counter()
+    with span('render', job=str(job_id)):
+        while attempts <= retries:
+            attempts += 1
+            try:
+                render()
+                error = None
+                break
+            except Exception as e:
+                error = e
+                print(f"{job_id} failed (attempt {attempts}/{retries + 1}): {e}")
+        count('clips' if error is None else 'failed_clips')
+
+    return {
+        "id": job_id,
+        "ok": error is None,
+        "error": error,
+        "attempts": attempts,
+        "duration_s": time.perf_counter() - start_time,
+    }
+
+
+def render_jobs(jobs, max_workers=None, encoder_threads=DEFAULT_ENCODER_THREADS, retries=DEFAULT_RETRIES):
+    """
+    Run render jobs through a bounded pool of workers, each driving one ffmpeg subprocess at a time.
+
+    Args:
+        jobs (list): (job_id, render) tuples, where render is a callable that runs ffmpeg and raises on failure.
+        max_workers (int): Maximum number of concurrent jobs. Defaults to get_pool_size(encoder_threads).
+        encoder_threads (int): Number of threads each ffmpeg encoder is expected to use.
+        retries (int): Number of times a failed job is retried.
+
+    Returns:
+        list: One result dict ("id", "ok", "error", "attempts", "duration_s") per job, in the same order as jobs.
+    """
+    max_workers = max_workers or get_pool_size(encoder_threads)
+    start_time = time.perf_counter()
+
+    # ffmpeg does the work in its own process, so threads are enough to keep max_workers of them busy
+    with span('render_jobs', max_workers=max_workers), ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(run_job, job_id, render, retries) for job_id, render in jobs]
+        results = [future.result() for future in futures]
+
+    wall_s = time.perf_counter() - start_time
+    print_render_report(results, wall_s, max_workers)
+    return results
+
+
+def print_render_report(results, wall_s, max_workers):
+    for result in results:
+        status = "ok" if result["ok"] else "FAILED"
+        print(f"{result['id']}: {status} in {result['duration_s']:.2f}s ({result['attempts']} attempt(s))")
+
+    job_s = sum(result["duration_s"] for result in results)
+    parallelism = job_s / wall_s if wall_s else 0
+    print(f"Rendered {len(results)} jobs with {max_workers} workers in {wall_s:.2f}s "
+          f"({job_s:.2f}s of job time, {parallelism:.1f}x parallelism)")
@@ -1,14 +1,28 @@
 import argparse
 import json
+import os
 from datetime import datetime
 from pathlib import Path
 
 import cv2 as cv
 import ffmpeg
 
-from .analyze_movements import analyze_movements
+from .analyze_movements import ALGO_MOG2, ALGOS, compute_motion_scores, create_back_sub, detect_movements
+from .checkpoint import DEFAULT_CHECKPOINT_INTERVAL_S, MotionCheckpoint
+from .ffmpeg_decode import DEFAULT_DECODER_THREADS, compute_motion_scores_ffmpeg
 from decorators.all_decorators import record_performance
+from decorators.tracing import CHROME_TRACE_SUFFIX, enable_tracing, span, write_trace
+from .frame_pipeline import DEFAULT_QUEUE_SIZE, compute_motion_scores_pipelined
 from .generate_single_clip import generate_single_clip
+from .parallel_analyze import compute_motion_scores_parallel
+from .roi import parse_roi
+from video_cutter.extract_segments import METHOD_AUTO, METHODS
+from video_cutter.interval_file import FORMAT_INTERVALS, FORMAT_JSON, FORMATS, get_output_path, load_intervals, \
+    write_intervals
+from .sweep import (SUBTRACTOR_PARAMS, SWEEP_PARAMS, compute_sweep_scores, expand_sweep, get_subtractor_key,
+                    parse_sweep, print_sweep_report, save_sweep_report, summarize_movements)
+from .score_cache import (DEFAULT_CACHE_DIR, DEFAULT_CACHE_LIMIT_MB, get_cache_key, hash_video, load_motion_scores,
+                          save_motion_scores)
 
 DEFAULT_MOG2_VAR_THRESHOLD = 1000
 DEFAULT_MOG2_HISTORY = 500
@@ -16,8 +30,11 @@ DEFAULT_MOG2_SHADOWS = False
 
 DEFAULT_WHITE_PIXEL_COUNT = 3000
 DEFAULT_OUTPUT_DIR = Path('output')
-DEFAULT_MOVEMENT_TIME_ADDITION = 4
-DEFAULT_POST_PROCESS_FRAME_TUNING_ADDITION = 3
+DEFAULT_MOVEMENT_GAP_MS = 4000
+DEFAULT_PADDING_MS = 2000
+# Default warm-up, in multiples of --history. MOG2 only forgets a foreground object after about 3 histories: with a
+# shorter warm-up, the scores after a range start still differ from a single pass.
+DEFAULT_WARMUP_HISTORIES = 3
 
 
 def get_timestamp():
@@ -39,7 +56,7 @@ def extract_clip(input_video, output_clip, start_time, end_time):
         print(f"Error generating clip {output_clip}: {e}")
 
 
-def parse_args():
+def build_parser():
     parser = argparse.ArgumentParser(description='This program shows how to use background subtraction methods provided by \
          OpenCV. You can process both videos and images.')
 
@@ -53,8 +70,10 @@ def parse_args():
                         default=None)
     parser.add_argument('--algo',
                         type=str,
-                        help='Background subtraction method (KNN, MOG2).',
-                        default='MOG2')
+                        choices=ALGOS,
+                        help='Background subtraction method (KNN, MOG2). --mvmt is its threshold: the variance \
+                             threshold of MOG2, or the squared distance threshold of KNN.',
+                        default=ALGO_MOG2)
     parser.add_argument('--mvmt',
                         type=int,
                         help='Movement threshold. Increase to reduce sensitivity, but might miss subtle movements.',
@@ -68,59 +87,331 @@ def parse_args():
                         action='store_true',
                         help='If true, will try to detect shadows.',
                         default=DEFAULT_MOG2_SHADOWS)
+    parser.add_argument('--white_pixels',
+                        type=int,
+                        help='Minimum number of foreground pixels (in a full-resolution frame) for a frame to count as \
+                             an intensive movement.',
+                        default=DEFAULT_WHITE_PIXEL_COUNT)
+    parser.add_argument('--movement_gap_ms',
+                        type=int,
+                        help='Intensive frames less than this many milliseconds apart are part of the same movement.',
+                        default=DEFAULT_MOVEMENT_GAP_MS)
+    parser.add_argument('--padding_ms',
+                        type=int,
+                        help='Number of milliseconds added to the end of every movement, after its last intensive \
+                             frame.',
+                        default=DEFAULT_PADDING_MS)
+    parser.add_argument('--workers',
+                        type=int,
+                        help='Number of processes used to analyze the video. Each process analyzes its own time range \
+                             of the video. Defaults to 1, i.e. a single pass over the whole video.',
+                        default=1)
+    parser.add_argument('--warmup',
+                        type=int,
+                        help='Number of analyzed frames each process feeds to its background model before its time \
+                             range starts when --workers is greater than 1, and before the resume point of an \
+                             analysis resumed from a checkpoint. Defaults to 3 times --history, after which the scores \
+                             match those of a single pass.',
+                        default=None)
+    parser.add_argument('--pipeline',
+                        action='store_true',
+                        help='If true, will decode frames in a separate thread from the background subtraction, and \
+                             print the throughput of each stage.',
+                        default=False)
+    parser.add_argument('--queue_size',
+                        type=int,
+                        help='Number of preallocated frame buffers shared by the decode and analysis stages. Only used \
+                             with --pipeline.',
+                        default=DEFAULT_QUEUE_SIZE)
+    parser.add_argument('--decoder',
+                        type=str,
+                        choices=['opencv', 'ffmpeg'],
+                        help='Frame source of the analysis. "ffmpeg" decodes, skips, crops, downscales and converts \
+                             frames to grayscale in a multithreaded ffmpeg process, and pipes raw frames to the \
+                             background subtraction. Not used with --workers, and --pipeline is ignored with it.',
+                        default='opencv')
+    parser.add_argument('--decoder_threads',
+                        type=int,
+                        help='Number of threads of the ffmpeg decoder. Defaults to 0, i.e. chosen by ffmpeg.',
+                        default=DEFAULT_DECODER_THREADS)
+    parser.add_argument('--analysis_width',
+                        type=int,
+                        help='Downscale frames to this width (keeping the aspect ratio) before analyzing them. The \
+                             white pixel threshold is scaled accordingly. Defaults to the video resolution.',
+                        default=None)
+    parser.add_argument('--grayscale',
+                        action='store_true',
+                        help='If true, will analyze grayscale frames instead of BGR frames.',
+                        default=False)
+    parser.add_argument('--frame_step',
+                        type=int,
+                        help='Only analyze every Nth frame. Note that --history counts analyzed frames only.',
+                        default=1)
+    parser.add_argument('--roi',
+                        type=str,
+                        help='Region of interest, e.g. the court: only the movements inside of it are counted, and \
+                             frames are cropped to it before the background subtraction. Either "x,y,w,h" for a \
+                             rectangle, "x1,y1,x2,y2,x3,y3,..." for a polygon, or the path to a JSON file holding \
+                             {"rect": [x, y, w, h]} or {"polygon": [[x1, y1], ...]}, and optionally "unit": "%%". \
+                             Coordinates are in pixels of the video, or in percent of its size when they all end with \
+                             "%%", e.g. "20%%,35%%,60%%,60%%". --white_pixels still counts full-resolution pixels.',
+                        default=None)
+    parser.add_argument('--cache_dir',
+                        type=str,
+                        help='Directory where the per-frame motion scores of analyzed videos are cached. Re-running \
+                             with the same video, --mvmt, --history, --shadows and analysis profile replays the \
+                             cached scores instead of decoding the video again.',
+                        default=str(DEFAULT_CACHE_DIR))
+    parser.add_argument('--cache_limit_mb',
+                        type=int,
+                        help='Maximum size of the cache directory. Least recently used entries are evicted first.',
+                        default=DEFAULT_CACHE_LIMIT_MB)
+    parser.add_argument('--no_cache',
+                        action='store_true',
+                        help='If true, will neither read nor write cached motion scores (nor checkpoints).',
+                        default=False)
+    parser.add_argument('--checkpoint_interval',
+                        type=int,
+                        help='Save the motion scores computed so far every this many seconds, under the cache \
+                             directory, so that an interrupted analysis resumes where it left off when run again with \
+                             the same video and parameters. 0 disables checkpoints. Not used with --workers.',
+                        default=DEFAULT_CHECKPOINT_INTERVAL_S)
     parser.add_argument('--generateclips',
                         action='store_true',
                         help='If true, will automatically generate video clips.',
                         default=False)
+    parser.add_argument('--extract_method',
+                        type=str,
+                        choices=METHODS,
+                        help='How the merged clip is cut out of the video: "trim" and "select" filter graphs are \
+                             frame-accurate, "copy" does not re-encode but snaps cuts to keyframes, and "auto" picks \
+                             "trim" or "select" depending on the number of movements.',
+                        default=METHOD_AUTO)
+    parser.add_argument('--output_dir',
+                        type=str,
+                        help='Directory where the intensive movements JSON file and the merged clip are written.',
+                        default=str(DEFAULT_OUTPUT_DIR))
+    parser.add_argument('--sweep',
+                        type=str,
+                        action='append',
+                        help='Parameter to sweep, as "name=value1,value2,...", e.g. --sweep mvmt=500,1000,2000 \
+                             --sweep algo=MOG2,KNN. Every combination is evaluated from a single decode of the video, \
+                             with one background subtractor per distinct algo, history, mvmt and shadows, and gets its \
+                             own intensive movements JSON file, next to a comparison table. Can be repeated, for algo, \
+                             history, mvmt, shadows, white_pixels, movement_gap_ms and padding_ms. --workers, \
+                             --decoder, --pipeline and checkpoints are not used with it.',
+                        default=None)
+    parser.add_argument('--sweep_threads',
+                        type=int,
+                        help='Number of threads feeding each frame to the background subtractors of a sweep. Defaults \
+                             to 0, i.e. one per subtractor, up to the number of cores.',
+                        default=0)
+    parser.add_argument('--trace',
+                        type=str,
+                        help=f'Path to a JSON file where the time, CPU time, peak memory and counters of every stage \
+                             are written at the end of the run. Files ending with {CHROME_TRACE_SUFFIX} are written \
+                             as Chrome trace events instead, for chrome://tracing or Perfetto.',
+                        default=None)
     parser.add_argument('--movementsjson',
                         type=str,
-                        help='Path to an intensive movements JSON file. If provided, will always generate clips.',
+                        help='Path to an intensive movements JSON file (or interval file). If provided, will always \
+                             generate clips.',
                         default="")
+    parser.add_argument('--movements_format',
+                        type=str,
+                        choices=FORMATS,
+                        help='Format of the intensive movements file: "json", or "intervals", a compact binary file \
+                             of millisecond intervals that is memory-mapped when read (see convert-intervals to \
+                             export it to JSON).',
+                        default=FORMAT_JSON)
 
-    return parser.parse_args()
+    return parser
+
+
+def parse_args():
+    return build_parser().parse_args()
+
+
+def get_job_args(input_video, **params):
+    """
+    Return the arguments of process_video() for input_video, without going through the command line: every parameter
+    defaults to the value of the matching command line option.
+
+    Args:
+        input_video (str): Path to the video.
+        params: Values of other command line options, by destination name, e.g. mvmt=800 or generateclips=True.
+    """
+    args = build_parser().parse_args(['--input', str(input_video)])
+    unknown = set(params) - set(vars(args))
+    if unknown:
+        raise ValueError(f'Unknown parameters: {", ".join(sorted(unknown))}')
+    for name, value in params.items():
+        setattr(args, name, value)
+    return args
+
+
+def analyze_video(input_video, **params):
+    """
+    Detect the intensive movements of a video (and cut them out, with generateclips=True), with the same parameters as
+    the command line (see get_job_args()).
+
+    Returns:
+        dict: "movements_json" (path), "movements" (number of intensive movements), "merged_clip" (path, or None) and
+            "scores_cached" (whether the motion scores were replayed from the cache).
+    """
+    return process_video(get_job_args(input_video, **params))
+
+
+def save_movements(intensive_movements, output_file, movements_format=FORMAT_JSON):
+    """
+    Write intensive movements to output_file (without its suffix), either as JSON or as a binary interval file (see
+    video_cutter.interval_file), and return its path.
+    """
+    output_file = get_output_path(output_file, movements_format)
+    if movements_format == FORMAT_INTERVALS:
+        write_intervals(intensive_movements, output_file)
+    else:
+        with open(output_file, 'w') as f:
+            json.dump(intensive_movements, f, indent=4)
+    return str(output_file)
+
+
+def get_score_params(args, roi=None):
+    """
+    Return the parameters that the motion scores of a video depend on, which key them in the score cache.
+    """
+    params = {
+        'algo': args.algo,
+        'history': args.history,
+        'mvmt': args.mvmt,
+        'shadows': args.shadows,
+        'analysis_width': args.analysis_width,
+        'grayscale': args.grayscale,
+        'frame_step': args.frame_step,
+        'roi': roi,
+        # ffmpeg and OpenCV don't scale frames identically
+        'decoder': args.decoder if args.workers <= 1 else 'opencv',
+    }
+    if args.workers > 1:
+        # Scores differ from a single pass after the start of each range, depending on how the video is split and how
+        # long the background models are warmed up
+        params['workers'] = args.workers
+        params['warmup'] = get_warmup_frames(args)
+    return params
+
+
+def get_warmup_frames(args):
+    return args.history * DEFAULT_WARMUP_HISTORIES if args.warmup is None else args.warmup
+
+
+def compute_movement_scores(args, input_video, capture, roi=None, checkpoint=None):
+    """
+    Decode the video and compute the white pixel count of every analyzed frame, using the mode selected by args.
+    """
+    warmup_frames = get_warmup_frames(args)
+    if args.workers > 1:
+        return compute_motion_scores_parallel(
+            input_video, num_workers=args.workers, warmup_frames=warmup_frames,
+            history=args.history, var_threshold=args.mvmt, detect_shadows=args.shadows, algo=args.algo,
+            analysis_width=args.analysis_width, grayscale=args.grayscale, frame_step=args.frame_step, roi=roi)
+
+    # Setup algorithm, either KNN or MOG2
+    back_sub = create_back_sub(args.history, args.mvmt, args.shadows, args.algo)
+
+    if args.decoder == 'ffmpeg':
+        return compute_motion_scores_ffmpeg(input_video, back_sub, analysis_width=args.analysis_width,
+                                            grayscale=args.grayscale, frame_step=args.frame_step, roi=roi,
+                                            checkpoint=checkpoint, warmup_frames=warmup_frames,
+                                            threads=args.decoder_threads)
+
+    if args.pipeline:
+        return compute_motion_scores_pipelined(capture, back_sub, analysis_width=args.analysis_width,
+                                               grayscale=args.grayscale, frame_step=args.frame_step,
+                                               queue_size=args.queue_size, roi=roi, checkpoint=checkpoint,
+                                               warmup_frames=warmup_frames)
+
+    return compute_motion_scores(capture, back_sub, analysis_width=args.analysis_width, grayscale=args.grayscale,
+                                 frame_step=args.frame_step, roi=roi, checkpoint=checkpoint,
+                                 warmup_frames=warmup_frames)
 
 
-@record_performance
 def get_movements():
     args = parse_args()
+    if args.trace:
+        enable_tracing()
+    try:
+        process_video(args)
+    except FileNotFoundError as e:
+        print(e)
+        exit(0)
+    finally:
+        if args.trace:
+            write_trace(args.trace)
+
 
+@record_performance
+def process_video(args):
+    output_dir = Path(args.output_dir)
     if args.movementsjson:
         print(f"Generating clips from {args.movementsjson} and {args.input}...")
-        generate_single_clip(args.movementsjson, args.input, "output/merged_clips")
-        return
-
-    # Setup algorithm, either KNN or MOG2
-    back_sub = cv.createBackgroundSubtractorMOG2(
-        history=args.history,
-        varThreshold=args.mvmt,
-        detectShadows=args.shadows)
-    # if args.algo == 'MOG2':
-    #     backSub = cv.createBackgroundSubtractorMOG2(varThreshold=100)
-    # else:
-    #     backSub = cv.createBackgroundSubtractorKNN(varThreshold=100)
+        num_movements = len(load_intervals(args.movementsjson))
+        merged_clip = generate_single_clip(args.movementsjson, args.input, output_dir / "merged_clips",
+                                           args.extract_method)
+        return {"movements_json": args.movementsjson, "movements": num_movements, "merged_clip": str(merged_clip),
+                "scores_cached": False}
 
     # Create a video capture object
-    capture = cv.VideoCapture(cv.samples.findFileOrKeep(args.input))
+    input_video = cv.samples.findFileOrKeep(args.input)
+    capture = cv.VideoCapture(input_video)
     if not capture.isOpened():
-        print(f'Unable to open: {args.input}')
-        exit(0)
+        raise FileNotFoundError(f'Unable to open: {args.input}')
+
+    roi = parse_roi(args.roi) if args.roi else None
+    if args.sweep:
+        result = sweep_movements(args, input_video, capture, roi, output_dir)
+        capture.release()
+        return result
+
+    # Replay cached motion scores, if this video has already been analyzed with the same parameters
+    score_params = get_score_params(args, roi)
+    motion_scores = None
+    if not args.no_cache:
+        with span('load_scores'):
+            cache_key = get_cache_key(hash_video(input_video, args.cache_dir), score_params)
+            motion_scores = load_motion_scores(args.cache_dir, cache_key)
+    scores_cached = motion_scores is not None
+
+    if motion_scores is None:
+        checkpoint = None
+        if not args.no_cache and args.checkpoint_interval > 0 and args.workers <= 1:
+            checkpoint = MotionCheckpoint(args.cache_dir, cache_key, args.checkpoint_interval)
+        motion_scores = compute_movement_scores(args, input_video, capture, roi, checkpoint)
+        if not args.no_cache:
+            with span('save_scores'):
+                save_motion_scores(args.cache_dir, cache_key, motion_scores, score_params, args.cache_limit_mb)
+        if checkpoint is not None:
+            checkpoint.remove()
+    capture.release()
 
     # Analyze movements
-    intensive_movements = analyze_movements(capture, back_sub, white_pixel_threshold=DEFAULT_WHITE_PIXEL_COUNT,
-                                            movement_time_addition=DEFAULT_MOVEMENT_TIME_ADDITION,
-                                            post_process_frame_tuning_addition=DEFAULT_POST_PROCESS_FRAME_TUNING_ADDITION)
+    intensive_movements = detect_movements(motion_scores, white_pixel_threshold=args.white_pixels,
+                                           movement_gap_ms=args.movement_gap_ms, padding_ms=args.padding_ms)
 
     # Store movements data
     timestamp = str(get_timestamp())
-    intensive_movements_json = f'output/intensive-movements-{timestamp}-{str(args.mvmt)}mvmt-{str(args.history)}history.json'
-    with open(intensive_movements_json, 'w') as f:
-        json.dump(intensive_movements, f, indent=4)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    intensive_movements_json = save_movements(
+        intensive_movements,
+        output_dir / f'intensive-movements-{timestamp}-{str(args.mvmt)}mvmt-{str(args.history)}history',
+        args.movements_format)
     print(f'Created {intensive_movements_json}')
 
     # Create video clip (if requested)
+    merged_clip = None
     if args.generateclips:
         # generate_clips(intensive_movements_json, args.input, "output")
-        generate_single_clip(intensive_movements_json, args.input, "output/merged_clips")
+        merged_clip = generate_single_clip(intensive_movements_json, args.input, output_dir / "merged_clips",
+                                           args.extract_method)
 
     # for i, movement in enumerate(intensive_movements):
     #     print(f"Generating clip {i + 1}...")
@@ -130,3 +421,74 @@ def get_movements():
     #                  movement["from"] * 1000, movement["to"] * 1000)
 
     print("✨ Done!")
+    return {"movements_json": intensive_movements_json, "movements": len(intensive_movements),
+            "merged_clip": str(merged_clip) if merged_clip else None, "scores_cached": scores_cached}
+
+
+def sweep_movements(args, input_video, capture, roi=None, output_dir=DEFAULT_OUTPUT_DIR):
+    """
+    Detect the intensive movements of a video with every combination of the swept parameters (see --sweep), from a
+    single decode of the video, and write one intensive movements JSON file per combination and a comparison table.
+
+    Returns:
+        dict: "sweep_dir" (path), "configs" (number of combinations) and "comparison_json" (path).
+    """
+    configs = expand_sweep(parse_sweep(args.sweep), {name: getattr(args, name) for name in SWEEP_PARAMS})
+    # The sweep decodes frames itself, with OpenCV, in a single pass
+    subtractor_args = {}
+    for config in configs:
+        subtractor_args.setdefault(get_subtractor_key(config), argparse.Namespace(
+            **{**vars(args), **{name: config[name] for name in SUBTRACTOR_PARAMS}, 'workers': 1,
+               'decoder': 'opencv'}))
+
+    # Subtractors whose scores are already cached are not run again
+    motion_scores = {}
+    cache_keys = {}
+    if not args.no_cache:
+        with span('load_scores'):
+            video_hash = hash_video(input_video, args.cache_dir)
+            for key, config_args in subtractor_args.items():
+                cache_keys[key] = get_cache_key(video_hash, get_score_params(config_args, roi))
+                scores = load_motion_scores(args.cache_dir, cache_keys[key])
+                if scores is not None:
+                    motion_scores[key] = scores
+
+    subtract_s = {}
+    missing = [key for key in subtractor_args if key not in motion_scores]
+    if missing:
+        back_subs = [create_back_sub(config_args.history, config_args.mvmt, config_args.shadows, config_args.algo)
+                     for config_args in (subtractor_args[key] for key in missing)]
+        num_threads = args.sweep_threads or min(len(back_subs), os.cpu_count() or 1)
+        computed, computed_s = compute_sweep_scores(capture, back_subs, analysis_width=args.analysis_width,
+                                                    grayscale=args.grayscale, frame_step=args.frame_step, roi=roi,
+                                                    num_threads=num_threads)
+        for key, scores, back_sub_s in zip(missing, computed, computed_s):
+            motion_scores[key] = scores
+            subtract_s[key] = back_sub_s
+            if not args.no_cache:
+                with span('save_scores'):
+                    save_motion_scores(args.cache_dir, cache_keys[key], scores,
+                                       get_score_params(subtractor_args[key], roi), args.cache_limit_mb)
+
+    sweep_dir = Path(output_dir) / f'sweep-{get_timestamp()}'
+    sweep_dir.mkdir(parents=True, exist_ok=True)
+    rows = []
+    for i, config in enumerate(configs):
+        key = get_subtractor_key(config)
+        scores = motion_scores[key]
+        intensive_movements = detect_movements(scores, white_pixel_threshold=config['white_pixels'],
+                                               movement_gap_ms=config['movement_gap_ms'],
+                                               padding_ms=config['padding_ms'])
+        movements_json = save_movements(
+            intensive_movements,
+            sweep_dir / f'intensive-movements-{i:02d}-{config["algo"]}-{config["mvmt"]}mvmt-{config["history"]}history',
+            args.movements_format)
+
+        duration_s = scores['total_frames'] / scores['fps'] if scores['fps'] else 0
+        rows.append({**config, **summarize_movements(intensive_movements, duration_s),
+                     "subtract_s": subtract_s.get(key), "movements_json": str(movements_json)})
+
+    print_sweep_report(rows)
+    comparison_json = sweep_dir / 'comparison.json'
+    save_sweep_report(rows, comparison_json)
+    return {"sweep_dir": str(sweep_dir), "configs": len(configs), "comparison_json": str(comparison_json)}
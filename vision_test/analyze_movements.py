@@ -1,78 +1,264 @@
+import time
+from array import array
+
 import cv2 as cv
+import numpy as np
+
+from decorators.tracing import add_stage, count, span, traced
+from .detect_intervals import detect_intervals, estimate_frame_times_ms
+from .roi import count_white_pixels, crop_to_roi, describe_roi, get_roi_geometry
+
+ALGO_MOG2 = 'MOG2'
+ALGO_KNN = 'KNN'
+ALGOS = [ALGO_MOG2, ALGO_KNN]
 
 
-def analyze_movements(capture, back_sub, *, white_pixel_threshold, movement_time_addition,
-                      post_process_frame_tuning_addition):
+def create_back_sub(history, var_threshold, detect_shadows, algo=ALGO_MOG2):
     """
-    Return an array containing the start and end times of intensive movements in the video.
+    Create the background subtractor used to detect motion.
+
+    Args:
+        var_threshold (float): Threshold on the distance between a pixel and the background model: the squared
+            Mahalanobis distance for MOG2, the squared distance to the nearest samples for KNN.
+        algo (str): "MOG2" (Gaussian mixture) or "KNN" (k-nearest neighbours).
     """
+    if algo == ALGO_KNN:
+        return cv.createBackgroundSubtractorKNN(
+            history=history,
+            dist2Threshold=var_threshold,
+            detectShadows=detect_shadows)
+    if algo != ALGO_MOG2:
+        raise ValueError(f'Unknown background subtraction method: {algo}')
+    return cv.createBackgroundSubtractorMOG2(
+        history=history,
+        varThreshold=var_threshold,
+        detectShadows=detect_shadows)
 
-    # Store the timestamps when intensive movements happen
-    intensive_movements = []
 
-    # Video fps
+def get_video_properties(capture):
+    """
+    Return the fps, the (estimated) frame count, and the (width, height) of the video.
+    """
     fps = capture.get(cv.CAP_PROP_FPS)
     total_frames = int(capture.get(cv.CAP_PROP_FRAME_COUNT))
+    source_size = (int(capture.get(cv.CAP_PROP_FRAME_WIDTH)), int(capture.get(cv.CAP_PROP_FRAME_HEIGHT)))
+    return fps, total_frames, source_size
+
+
+def get_analysis_size(source_size, analysis_width):
+    """
+    Return the (width, height) frames are analyzed at, keeping the source aspect ratio. None means the source size.
+    """
+    source_width, source_height = source_size
+    if not analysis_width or analysis_width >= source_width:
+        return None
+    # Keep both dimensions even, as most scalers and codecs expect
+    analysis_height = max(round(source_height * analysis_width / source_width / 2) * 2, 2)
+    return analysis_width, analysis_height
+
+
+def scale_white_pixel_threshold(white_pixel_threshold, source_size, analysis_size):
+    """
+    Scale a white pixel threshold tuned for full-resolution frames to the analysis resolution.
+    """
+    if analysis_size is None:
+        return white_pixel_threshold
+    source_width, source_height = source_size
+    analysis_width, analysis_height = analysis_size
+    return round(white_pixel_threshold * analysis_width * analysis_height / (source_width * source_height))
+
+
+def read_frame(capture, frame_step=1):
+    """
+    Return the next frame to analyze, skipping frame_step - 1 frames before it.
+
+    Skipped frames are only grabbed, never retrieved, so they skip the colour conversion and copy into a Python array.
+    """
+    for _ in range(frame_step - 1):
+        if not capture.grab():
+            return False, None
+    return capture.read()
+
+
+def get_frame_time_ms(capture):
+    """
+    Return the presentation time of the frame just read from capture, in milliseconds from the start of the video, as
+    reported by the container (its PTS) rather than estimated from the frame rate.
+    """
+    return max(round(capture.get(cv.CAP_PROP_POS_MSEC)), 0)
+
+
+def prepare_frame(frame, analysis_size, grayscale, roi_geometry=None):
+    """
+    Crop the frame to the region of interest, then downscale it and/or convert it to grayscale before it is fed to the
+    background subtractor.
+    """
+    if roi_geometry is not None:
+        frame = crop_to_roi(frame, roi_geometry)
+        analysis_size = roi_geometry['size']
+    if analysis_size is not None:
+        frame = cv.resize(frame, analysis_size, interpolation=cv.INTER_AREA)
+    if grayscale:
+        frame = cv.cvtColor(frame, cv.COLOR_BGR2GRAY)
+    return frame
+
+
+def get_analysis_roi(roi, source_size, analysis_size):
+    """
+    Return the geometry of the region of interest (see roi.get_roi_geometry()), or None to analyze whole frames.
+    """
+    return get_roi_geometry(roi, source_size, analysis_size) if roi else None
+
+
+def print_analysis_profile(source_size, analysis_size, grayscale, frame_step, roi_geometry=None):
+    print(f'Analysis profile: {analysis_size or source_size} {"gray" if grayscale else "BGR"}, every {frame_step} '
+          f'frame(s)' + (f', {describe_roi(roi_geometry)}' if roi_geometry else ''))
+
+
+def make_motion_scores(fps, total_frames, source_size, analysis_size, frames, white_pixels, times_ms=None):
+    """
+    Bundle the white pixel count of every analyzed frame with what is needed to turn them into intensive movements.
+
+    Args:
+        fps (float): Video fps.
+        total_frames (int): Frame count reported by the container.
+        source_size (tuple): (width, height) of the video.
+        analysis_size (tuple): (width, height) the frames were analyzed at, or None for the source size.
+        frames (Sequence[int]): 1-based position of each analyzed frame, as reported by CAP_PROP_POS_FRAMES.
+        white_pixels (Sequence[int]): White pixel count of the foreground mask of each analyzed frame.
+        times_ms (Sequence[int]): Presentation time of each analyzed frame, in milliseconds (see get_frame_time_ms()).
+            Estimated from frames and fps when not provided.
+    """
+    return {
+        "fps": fps,
+        "total_frames": total_frames,
+        "source_size": tuple(source_size),
+        "analysis_size": tuple(analysis_size) if analysis_size else None,
+        "frames": np.asarray(frames, dtype=np.int32),
+        "white_pixels": np.asarray(white_pixels, dtype=np.int32),
+        "times_ms": (np.asarray(times_ms, dtype=np.int32) if times_ms is not None
+                     else estimate_frame_times_ms(frames, fps)),
+    }
+
+
+def start_motion_scores(capture, checkpoint, warmup_frames, frame_step):
+    """
+    Return (frames, times_ms, white_pixels, resume_position, start_position) to start an analysis with: empty scores
+    from the start of the video, or the scores of a checkpoint, with the video seeked to the warm-up window preceding
+    it (see MotionCheckpoint.resume()).
+    """
+    if checkpoint is None:
+        return array('i'), array('i'), array('i'), 0, 0
+    return checkpoint.resume(capture, warmup_frames, frame_step)
+
+
+@traced()
+def compute_motion_scores(capture, back_sub, *, analysis_width=None, grayscale=False, frame_step=1, roi=None,
+                          checkpoint=None, warmup_frames=0):
+    """
+    Run the background subtraction over the whole video, and return the white pixel count and the presentation time of
+    every analyzed frame.
+
+    With a region of interest (a polygon, see roi.parse_roi()), frames are cropped to its bounding box before the
+    background subtraction, and only the white pixels inside of it are counted.
+
+    With a checkpoint (see checkpoint.MotionCheckpoint), the scores computed so far are saved periodically, and an
+    interrupted analysis resumes from the last checkpoint, after feeding warmup_frames frames to the background model.
+    """
+    fps, total_frames, source_size = get_video_properties(capture)
+    analysis_size = get_analysis_size(source_size, analysis_width)
+    roi_geometry = get_analysis_roi(roi, source_size, analysis_size)
     print(f'Video FPS: {fps}')
     print(f'Processing {total_frames:,} frames')
+    print_analysis_profile(source_size, analysis_size, grayscale, frame_step, roi_geometry)
 
-    frame_count = 0
+    frames, times_ms, white_pixels, resume_position, start_position = start_motion_scores(capture, checkpoint,
+                                                                                         warmup_frames, frame_step)
+    frame_count = start_position
+    # Time spent in each stage, accumulated over all frames
+    decode_s = subtract_s = count_s = 0.0
     while True:
-        # capture.read() grabs, decodes, and returns the next video frame
-        ret, frame = capture.read()
+        # read_frame() skips frame_step - 1 frames, then grabs, decodes, and returns the next video frame
+        decode_start = time.perf_counter()
+        ret, frame = read_frame(capture, frame_step)
+        subtract_start = time.perf_counter()
+        decode_s += subtract_start - decode_start
         if frame is None:
             break
 
         # Apply the background subtraction algorithm to the frame
-        fg_mask = back_sub.apply(frame)
+        fg_mask = back_sub.apply(prepare_frame(frame, analysis_size, grayscale, roi_geometry))
+        count_start = time.perf_counter()
+        subtract_s += count_start - subtract_start
 
-        # Count white pixels
-        white_pixels = cv.countNonZero(fg_mask)
+        # Count white pixels, except in the warm-up window of a resumed analysis
+        current_frame = int(capture.get(cv.CAP_PROP_POS_FRAMES))
+        if current_frame > resume_position:
+            frames.append(current_frame)
+            times_ms.append(get_frame_time_ms(capture))
+            white_pixels.append(count_white_pixels(fg_mask, roi_geometry))
+            if checkpoint is not None:
+                checkpoint.update(frames, times_ms, white_pixels, current_frame)
+        count_s += time.perf_counter() - count_start
 
         # Show the white pixels count
-        # cv.putText(frame, str(white_pixels), (15, 35),
+        # cv.putText(frame, str(white_pixels[-1]), (15, 35),
         #            cv.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255))
 
-        # Store intensive movements
-        if white_pixels > white_pixel_threshold:
-            current_frame = int(capture.get(cv.CAP_PROP_POS_FRAMES))
-            current_time_ms = (current_frame * 1000)  # ms
-            current_time_s = int(current_frame / fps)
-
-            current_time = current_time_s
-
-            if not intensive_movements or current_time > intensive_movements[-1]["to"] + movement_time_addition:
-                intensive_movements.append({"from": current_time, "to": current_time})
-            else:
-                intensive_movements[-1]["to"] = current_time
-
-            # if current_time > previous_intensive_movements_frame_end:
-            #     to_time = current_time + DEFAULT_MOVEMENT_TIME_ADDITION
-            #     intensive_movements.append(
-            #         {"from": current_time,
-            #          "to": to_time})
-            #     previous_intensive_movements_frame_end = to_time
-
         # Log progress
-        frame_count += 1
-        if frame_count % (total_frames // 10) == 0:
+        frame_count += frame_step
+        if frame_count % max(total_frames // 10 // frame_step * frame_step, frame_step) == 0 and total_frames:
             print(f"Processing: {frame_count / total_frames * 100:.2f}% complete")
 
-    # Post-processing
-    for movement in intensive_movements:
-        movement["to"] += post_process_frame_tuning_addition
-    i = 0
-    while i < len(intensive_movements) - 1:
-        if intensive_movements[i]["to"] >= intensive_movements[i + 1]["from"]:
-            intensive_movements[i]["to"] = max(intensive_movements[i]["to"], intensive_movements[i + 1]["to"])
-            del intensive_movements[i + 1]
-        else:
-            i += 1
+    num_analyzed = (frame_count - start_position) // frame_step
+    add_stage('decode', decode_s, num_analyzed + 1)
+    add_stage('subtract', subtract_s, num_analyzed)
+    add_stage('count', count_s, num_analyzed)
+    count('frames', num_analyzed)
+    return make_motion_scores(fps, total_frames, source_size, analysis_size, frames, white_pixels, times_ms)
 
+
+def print_movements_summary(intensive_movements, caller):
     # Sum up all the durations in intensive_movements
     total_duration = 0
     for movement in intensive_movements:
         total_duration += movement["to"] - movement["from"]
 
-    print(f'Finished analyze_movements. Found {len(intensive_movements)}. Total duration: {total_duration}s.')
+    print(f'Finished {caller}. Found {len(intensive_movements)}. Total duration: {round(total_duration, 3)}s.')
+
+
+def detect_movements(motion_scores, *, white_pixel_threshold, movement_gap_ms, padding_ms):
+    """
+    Return an array containing the start and end times of intensive movements, given the white pixel count of every
+    analyzed frame (see compute_motion_scores()).
+
+    white_pixel_threshold is given for full-resolution frames, and is scaled down to the analysis resolution.
+    """
+    white_pixel_threshold = scale_white_pixel_threshold(white_pixel_threshold, motion_scores["source_size"],
+                                                        motion_scores["analysis_size"])
+    print(f'White pixel threshold: {white_pixel_threshold}')
+
+    with span('segment'):
+        intensive_movements = detect_intervals(motion_scores["white_pixels"], motion_scores["fps"],
+                                               white_pixel_threshold=white_pixel_threshold,
+                                               movement_gap_ms=movement_gap_ms, padding_ms=padding_ms,
+                                               times_ms=motion_scores["times_ms"])
+        count('movements', len(intensive_movements))
+
+    print_movements_summary(intensive_movements, 'detect_movements')
     return intensive_movements
+
+
+def analyze_movements(capture, back_sub, *, white_pixel_threshold, movement_gap_ms, padding_ms, analysis_width=None,
+                      grayscale=False, frame_step=1, roi=None):
+    """
+    Return an array containing the start and end times of intensive movements in the video.
+
+    The analysis profile (analysis_width, grayscale, frame_step) trades accuracy for speed. white_pixel_threshold is
+    always given for full-resolution frames, and is scaled down to the analysis resolution. roi restricts the analysis
+    to a region of interest (see compute_motion_scores()).
+    """
+    motion_scores = compute_motion_scores(capture, back_sub, analysis_width=analysis_width, grayscale=grayscale,
+                                          frame_step=frame_step, roi=roi)
+    return detect_movements(motion_scores, white_pixel_threshold=white_pixel_threshold,
+                            movement_gap_ms=movement_gap_ms, padding_ms=padding_ms)
@@ -0,0 +1,511 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from pathlib import Path
+
+import cv2 as cv
+
+from . import analyze_video, build_parser, get_job_args, get_score_params
+from .analyze_movements import get_video_properties
+from .generate_single_clip import generate_single_clip
+from .roi import parse_roi
+from .score_cache import get_indexed_hash, hash_video
+from video_cutter.render_pool import DEFAULT_ENCODER_THREADS
+
+DEFAULT_BATCH_DIR = Path('output/batch')
+VIDEO_EXTENSIONS = {'.mp4', '.mov', '.mkv', '.avi', '.m4v', '.webm'}
+# Written in the output directory of every video, to skip it in later batches with the same parameters
+RESULT_FILE_NAME = 'batch-result.json'
+# Parameters that change the files written for a video, on top of those of its motion scores
+RESULT_PARAMS = ('white_pixels', 'movement_gap_ms', 'padding_ms', 'generateclips', 'extract_method', 'movements_format')
+
+STAGE_ANALYZE = 'analyze'
+STAGE_CLIPS = 'clips'
+# Fresh interpreters: OpenCV and ffmpeg state is not shared with the parent
+START_METHOD = 'spawn'
+# Times a task is resubmitted after a worker process died while it ran, e.g. killed for running out of memory. A dead
+# worker breaks the whole pool, so the task that was running next to it is resubmitted too.
+MAX_RESUBMITS = 2
+
+STATUS_DONE = 'done'
+STATUS_CACHED = 'cached'
+STATUS_SKIPPED = 'skipped'
+STATUS_FAILED = 'failed'
+
+
+def get_cpu_budget(cpu_budget=None):
+    return cpu_budget or os.cpu_count() or 1
+
+
+def parse_analysis_params(argv):
+    """
+    Return the analysis parameters given as command line options (see vision_test.build_parser()), as
+    {destination name: value} for the options that differ from their default.
+    """
+    defaults = vars(build_parser().parse_args(['--input', '']))
+    values = vars(build_parser().parse_args(['--input', '', *argv]))
+    return {name: value for name, value in values.items() if name != 'input' and value != defaults[name]}
+
+
+def read_manifest(manifest_file):
+    """
+    Return the videos listed in a manifest, as {"input", "name", "params"} dicts.
+
+    Args:
+        manifest_file (str): Either a JSON file holding a list of paths or of {"input", "name", "params"} objects,
+            where "name" (the output subdirectory) and "params" (analysis parameters of that video only) are optional,
+            or a text file with one path per line. Relative paths are relative to the manifest.
+    """
+    manifest_file = Path(manifest_file)
+    if manifest_file.suffix == '.json':
+        with open(manifest_file, 'r') as f:
+            entries = json.load(f)
+    else:
+        with open(manifest_file, 'r') as f:
+            entries = [line.strip() for line in f if line.strip() and not line.lstrip().startswith('#')]
+
+    videos = []
+    for entry in entries:
+        entry = {'input': entry} if isinstance(entry, str) else dict(entry)
+        if 'input' not in entry:
+            raise ValueError(f'Manifest entry without an "input": {entry}')
+        videos.append({
+            'input': str(manifest_file.parent / Path(entry['input']).expanduser()),
+            'name': entry.get('name'),
+            'params': entry.get('params', {}),
+        })
+    return videos
+
+
+def find_videos(input_path):
+    """
+    Return the videos of a directory (and its subdirectories), or of a manifest (see read_manifest()).
+    """
+    input_path = Path(input_path)
+    if input_path.is_dir():
+        return [{'input': str(path), 'name': None, 'params': {}} for path in sorted(input_path.rglob('*'))
+                if path.suffix.lower() in VIDEO_EXTENSIONS and path.is_file()]
+    if input_path.is_file():
+        return read_manifest(input_path)
+    raise FileNotFoundError(f'No such directory or manifest: {input_path}')
+
+
+def get_result_key(video_hash, args, roi):
+    """
+    Return a key of everything the outputs of a video depend on: its content, and the analysis parameters.
+    """
+    params = {**get_score_params(args, roi), **{name: getattr(args, name) for name in RESULT_PARAMS}}
+    key_data = json.dumps({'video': video_hash, 'params': params}, sort_keys=True)
+    return hashlib.blake2b(key_data.encode(), digest_size=16).hexdigest()
+
+
+def load_batch_result(output_dir, result_key):
+    """
+    Return the result of an earlier batch for this video, if it had the same key and its files still exist.
+    """
+    result_file = Path(output_dir) / RESULT_FILE_NAME
+    try:
+        with open(result_file, 'r') as f:
+            record = json.load(f)
+    except (OSError, ValueError):
+        return None
+    result = record.get('result') or {}
+    files = [result.get('movements_json'), result.get('merged_clip')]
+    if record.get('key') != result_key or not all(Path(file).exists() for file in files if file):
+        return None
+    return result
+
+
+def find_batch_result(input_video, params, force=False, indexed_only=False):
+    """
+    Return the (result key, result of an earlier batch) of a video analyzed with params (see load_batch_result()).
+
+    Args:
+        force (bool): If true, ignore earlier results: only the key is returned.
+        indexed_only (bool): If true, only use the hash the hash index remembers, and return (None, None) when the
+            video would have to be hashed, which reads all of it.
+    """
+    args = get_job_args(input_video, **params)
+    if indexed_only:
+        video_hash = get_indexed_hash(input_video, args.cache_dir)
+        if video_hash is None:
+            return None, None
+    else:
+        video_hash = hash_video(input_video, args.cache_dir)
+
+    roi = parse_roi(args.roi) if args.roi else None
+    result_key = get_result_key(video_hash, args, roi)
+    return result_key, None if force else load_batch_result(params['output_dir'], result_key)
+
+
+def save_batch_result(output_dir, result_key, result):
+    with open(Path(output_dir) / RESULT_FILE_NAME, 'w') as f:
+        json.dump({'key': result_key, 'result': result}, f, indent=4)
+
+
+def get_analysis_cores(args):
+    """
+    Return how many cores the analysis of a video keeps busy with args.
+    """
+    if args.workers > 1:
+        return args.workers
+    if args.decoder == 'ffmpeg':
+        # ffmpeg decodes with its threads while this process runs the background subtraction
+        return 1 + args.decoder_threads
+    return 1
+
+
+def plan_videos(videos, output_dir, params=None, cpu_budget=None, force=False):
+    """
+    Prepare the analysis of every video: resolve its parameters and output directory, read its length, and find out
+    what is already cached.
+
+    Hashing a video reads all of it, so only videos whose hash is already known (see
+    score_cache.get_indexed_hash()) are looked up here. The others are hashed and looked up by their analysis task,
+    concurrently with the other tasks.
+
+    Args:
+        videos (list): {"input", "name", "params"} dicts (see find_videos()).
+        output_dir (str): Directory of the batch. Each video gets a subdirectory, named after it.
+        params (dict): Analysis parameters of every video (see vision_test.get_job_args()), overridden by the
+            parameters of each video.
+        cpu_budget (int): Number of cores of the batch. No single analysis is given more.
+        force (bool): If true, will analyze videos again even if their results are already there.
+
+    Returns:
+        list: One dict per video, with "name", "input", "params", "output_dir", "frames", "duration_s", "cores",
+            "generate_clips", "result_key", "find_result" (whether the analysis task has to look the result up), and
+            "result" when the video can be skipped.
+    """
+    cpu_budget = get_cpu_budget(cpu_budget)
+    names = set()
+    plans = []
+    for video in videos:
+        name = video['name'] or Path(video['input']).stem
+        unique_name, i = name, 1
+        while unique_name in names:
+            i += 1
+            unique_name = f'{name}-{i}'
+        names.add(unique_name)
+        video_dir = Path(output_dir) / unique_name
+
+        video_params = {**(params or {}), **video['params'], 'output_dir': str(video_dir)}
+        args = get_job_args(video['input'], **video_params)
+        # Keep every analysis within the budget: ffmpeg would otherwise start a thread per core of the machine
+        if args.workers > cpu_budget:
+            video_params['workers'] = args.workers = cpu_budget
+        if args.decoder == 'ffmpeg' and args.workers <= 1:
+            decoder_threads = min(args.decoder_threads or 1, max(cpu_budget - 1, 1))
+            video_params['decoder_threads'] = args.decoder_threads = decoder_threads
+
+        plan = {
+            'name': unique_name,
+            'input': video['input'],
+            'params': video_params,
+            'output_dir': str(video_dir),
+            'frames': 0,
+            'duration_s': 0,
+            'cores': min(get_analysis_cores(args), cpu_budget),
+            'generate_clips': args.generateclips,
+            'extract_method': args.extract_method,
+            'result_key': None,
+            'find_result': False,
+            'result': None,
+            'force': force,
+        }
+        plans.append(plan)
+
+        capture = cv.VideoCapture(video['input'])
+        if not capture.isOpened():
+            # Reported as a failure of its analysis
+            continue
+        fps, plan['frames'], _ = get_video_properties(capture)
+        capture.release()
+        plan['duration_s'] = plan['frames'] / fps if fps else 0
+        if args.no_cache:
+            continue
+
+        plan['result_key'], plan['result'] = find_batch_result(video['input'], video_params, force,
+                                                               indexed_only=True)
+        plan['find_result'] = plan['result_key'] is None
+    return plans
+
+
+def run_analysis(input_video, params, cores, find_result=False, force=False):
+    """
+    Body of an analysis task: detect the movements of a video, without cutting clips, with at most cores threads.
+
+    Args:
+        find_result (bool): If true, hash the video first, and skip its analysis when an earlier batch already
+            analyzed it with the same parameters (see find_batch_result()). The hash is reused by the score cache.
+
+    Returns:
+        dict: The result of analyze_video(), with "analysis_s". With find_result, also "result_key", and only
+            "result_key" and "result" when the video is skipped.
+    """
+    cv.setNumThreads(cores)
+    start_time = time.perf_counter()
+    found = {}
+    if find_result:
+        found['result_key'], result = find_batch_result(input_video, params, force)
+        if result is not None:
+            return {**found, 'result': result}
+
+    result = analyze_video(input_video, **{**params, 'generateclips': False})
+    return {**result, **found, 'analysis_s': time.perf_counter() - start_time}
+
+
+def run_clips(movements_json, input_video, output_dir, method, encoder_threads):
+    """
+    Body of a clip generation task: cut the movements found by run_analysis() into a single clip.
+    """
+    start_time = time.perf_counter()
+    merged_clip = generate_single_clip(movements_json, input_video, Path(output_dir) / 'merged_clips', method,
+                                       encoder_threads)
+    return {'merged_clip': str(merged_clip), 'clips_s': time.perf_counter() - start_time}
+
+
+def next_task(clip_tasks, analysis_tasks, free_cores, num_running):
+    """
+    Return the next task to start, if it fits in the free cores. Clips come first, so that videos are finished
+    (and their results written) as early as possible. A task bigger than the whole budget runs alone.
+    """
+    tasks = clip_tasks or analysis_tasks
+    if not tasks:
+        return None
+    _, cores, _ = tasks[0]
+    if cores <= free_cores or not num_running:
+        return tasks.popleft()
+    return None
+
+
+def submit_task(executor, task, plans, summaries):
+    stage, cores, i = task
+    plan = plans[i]
+    if stage == STAGE_ANALYZE:
+        return executor.submit(run_analysis, plan['input'], plan['params'], cores, plan['find_result'], plan['force'])
+    return executor.submit(run_clips, summaries[i]['movements_json'], plan['input'], plan['output_dir'],
+                           plan['extract_method'], cores)
+
+
+def create_pool(cpu_budget):
+    return ProcessPoolExecutor(max_workers=cpu_budget, mp_context=multiprocessing.get_context(START_METHOD))
+
+
+def restart_pool(executor, cpu_budget):
+    """
+    Replace a pool broken by the death of one of its worker processes with a new one. Every task the broken pool was
+    running has failed once this returns.
+    """
+    print('A worker process died: restarting the worker pool')
+    executor.shutdown(wait=True)
+    return create_pool(cpu_budget)
+
+
+def run_batch(plans, cpu_budget=None, encoder_threads=DEFAULT_ENCODER_THREADS):
+    """
+    Analyze the planned videos (see plan_videos()) then cut their clips, in worker processes, without ever running
+    tasks that need more than cpu_budget cores at once. Analyses take one core each (more with --workers or the ffmpeg
+    decoder), and clip generation encoder_threads cores.
+
+    If a worker process dies, the pool is restarted, and the tasks it was running are resubmitted, up to MAX_RESUBMITS
+    times each.
+
+    Returns:
+        list: One summary dict per video (see summarize_video()), in the same order as plans.
+    """
+    cpu_budget = get_cpu_budget(cpu_budget)
+    summaries = [summarize_video(plan) for plan in plans]
+
+    analysis_tasks = deque()
+    for i, plan in enumerate(plans):
+        if plan['result'] is not None:
+            print_skipped_video(plan)
+            continue
+        analysis_tasks.append((STAGE_ANALYZE, plan['cores'], i))
+    clip_tasks = deque()
+
+    print(f'Analyzing {len(analysis_tasks)} of {len(plans)} video(s) with a budget of {cpu_budget} core(s)')
+    free_cores = cpu_budget
+    running = {}
+    resubmits = {}
+    executor = create_pool(cpu_budget)
+    try:
+        while analysis_tasks or clip_tasks or running:
+            task = next_task(clip_tasks, analysis_tasks, free_cores, len(running))
+            if task is not None:
+                try:
+                    future = submit_task(executor, task, plans, summaries)
+                except BrokenProcessPool:
+                    # An idle worker died since the last task finished
+                    (clip_tasks if task[0] == STAGE_CLIPS else analysis_tasks).appendleft(task)
+                    executor = restart_pool(executor, cpu_budget)
+                    continue
+                running[future] = task
+                free_cores -= task[1]
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            pool_broken = False
+            for future in done:
+                task = running.pop(future)
+                stage, cores, i = task
+                free_cores += cores
+                summary = summaries[i]
+                try:
+                    outcome = future.result()
+                except Exception as e:
+                    if isinstance(e, BrokenProcessPool):
+                        pool_broken = True
+                        resubmits[task] = resubmits.get(task, 0) + 1
+                        if resubmits[task] <= MAX_RESUBMITS:
+                            print(f"Resubmitting the {stage} task of {summary['input']}: its worker pool broke")
+                            (clip_tasks if stage == STAGE_CLIPS else analysis_tasks).appendleft(task)
+                            continue
+                    summary['status'] = STATUS_FAILED
+                    summary['error'] = f'{stage}: {type(e).__name__}: {e}'
+                    print(f"Failed to {stage} {summary['input']}: {summary['error']}")
+                    continue
+
+                if 'result_key' in outcome:
+                    plans[i]['result_key'] = outcome.pop('result_key')
+                if 'result' in outcome:
+                    plans[i]['result'] = outcome['result']
+                    summary.update(summarize_video(plans[i]))
+                    print_skipped_video(plans[i])
+                    continue
+                summary.update(outcome)
+
+                if stage == STAGE_ANALYZE and plans[i]['generate_clips'] and summary['movements']:
+                    clip_tasks.append((STAGE_CLIPS, min(encoder_threads, cpu_budget), i))
+                    continue
+                summary['status'] = STATUS_CACHED if summary['scores_cached'] else STATUS_DONE
+                finish_video(plans[i], summary)
+
+            if pool_broken:
+                # The other tasks of the broken pool are collected by the next wait()
+                executor = restart_pool(executor, cpu_budget)
+    finally:
+        executor.shutdown(wait=True)
+    return summaries
+
+
+def print_skipped_video(plan):
+    print(f"Skipping {plan['input']}: already analyzed with the same parameters in {plan['output_dir']}")
+
+
+def summarize_video(plan):
+    summary = {
+        'name': plan['name'],
+        'input': plan['input'],
+        'status': STATUS_SKIPPED if plan['result'] is not None else None,
+        'frames': plan['frames'],
+        'duration_s': plan['duration_s'],
+        'movements': None,
+        'movements_json': None,
+        'merged_clip': None,
+        'scores_cached': False,
+        'analysis_s': 0,
+        'clips_s': 0,
+        'error': None,
+    }
+    if plan['result'] is not None:
+        summary.update({name: plan['result'].get(name) for name in ('movements', 'movements_json', 'merged_clip')})
+    return summary
+
+
+def finish_video(plan, summary):
+    """
+    Fill in the throughput of a finished video, and record its result for later batches.
+    """
+    # Replaying cached scores doesn't decode the video
+    analysis_s = summary['analysis_s'] if not summary['scores_cached'] else 0
+    summary['fps'] = summary['frames'] / analysis_s if analysis_s else None
+    processing_s = summary['analysis_s'] + summary['clips_s']
+    summary['realtime_factor'] = summary['duration_s'] / processing_s if processing_s else None
+    if plan['result_key'] is not None:
+        save_batch_result(plan['output_dir'], plan['result_key'],
+                          {name: summary[name] for name in ('movements', 'movements_json', 'merged_clip')})
+
+
+def make_batch_report(summaries, wall_s, cpu_budget, encoder_threads):
+    """
+    Return the report of a batch: its settings and totals, and the summary of every video.
+    """
+    statuses = {}
+    for summary in summaries:
+        statuses[summary['status']] = statuses.get(summary['status'], 0) + 1
+    processed = [summary for summary in summaries if summary['status'] in (STATUS_DONE, STATUS_CACHED)]
+    duration_s = sum(summary['duration_s'] for summary in processed)
+    busy_s = sum(summary['analysis_s'] + summary['clips_s'] for summary in processed)
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'cpu_budget': cpu_budget,
+        'encoder_threads': encoder_threads,
+        'wall_s': wall_s,
+        'videos': len(summaries),
+        'statuses': statuses,
+        'duration_s': duration_s,
+        # Seconds of video processed per second of batch
+        'realtime_factor': duration_s / wall_s if wall_s else None,
+        # Average number of videos processed at once
+        'parallelism': busy_s / wall_s if wall_s else None,
+        'summaries': summaries,
+    }
+
+
+def print_batch_report(report):
+    width = max([len(summary['name']) for summary in report['summaries']] + [24])
+    print(f'{"video":<{width}} {"status":>8} {"length":>8} {"analysis":>9} {"fps":>7} {"clips":>8} {"realtime":>9} '
+          f'{"movements":>9}')
+    for summary in report['summaries']:
+        fps = f"{summary['fps']:.0f}" if summary.get('fps') else ''
+        realtime = f"{summary['realtime_factor']:.1f}x" if summary.get('realtime_factor') else ''
+        movements = summary['movements'] if summary['movements'] is not None else ''
+        print(f"{summary['name']:<{width}} {summary['status']:>8} {summary['duration_s']:>7.0f}s "
+              f"{summary['analysis_s']:>8.2f}s {fps:>7} {summary['clips_s']:>7.2f}s {realtime:>9} {movements:>9}")
+        if summary['error']:
+            print(f"    {summary['error']}")
+    statuses = ', '.join(f'{number} {status}' for status, number in report['statuses'].items())
+    print(f"Processed {report['videos']} video(s) ({statuses}) in {report['wall_s']:.2f}s with a budget of "
+          f"{report['cpu_budget']} core(s): {report['realtime_factor'] or 0:.1f}x realtime, "
+          f"{report['parallelism'] or 0:.1f}x parallelism")
+
+
+def analyze_batch(input_path, output_dir=DEFAULT_BATCH_DIR, params=None, cpu_budget=None,
+                  encoder_threads=DEFAULT_ENCODER_THREADS, force=False, report_file=None):
+    """
+    Detect the intensive movements of every video of a directory or a manifest (and cut them out, with
+    generateclips=True), within a budget of CPU cores, and write a report of the batch.
+
+    Args:
+        input_path (str): Directory of videos, or manifest (see read_manifest()).
+        output_dir (str): Directory of the batch. Each video gets a subdirectory, named after it.
+        params (dict): Analysis parameters of every video (see vision_test.get_job_args()).
+        cpu_budget (int): Number of cores shared by the analyses and the ffmpeg encoders. Defaults to all of them.
+        encoder_threads (int): Number of threads of the ffmpeg encoder of each video's clip.
+        force (bool): If true, will analyze videos again even if their results are already there.
+        report_file (str): Path to the JSON report. Defaults to <output_dir>/batch-report-<timestamp>.json.
+
+    Returns:
+        dict: The report (see make_batch_report()).
+    """
+    cpu_budget = get_cpu_budget(cpu_budget)
+    start_time = time.perf_counter()
+    plans = plan_videos(find_videos(input_path), output_dir, params, cpu_budget, force)
+    summaries = run_batch(plans, cpu_budget, encoder_threads)
+    report = make_batch_report(summaries, time.perf_counter() - start_time, cpu_budget, encoder_threads)
+
+    print_batch_report(report)
+    report_file = Path(report_file or Path(output_dir) / f'batch-report-{int(datetime.now().timestamp())}.json')
+    report_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(report_file, 'w') as f:
+        json.dump(report, f, indent=4)
+    print(f'Created {report_file}')
+    return report
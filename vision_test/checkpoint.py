@@ -0,0 +1,129 @@
+import json
+import os
+import time
+from array import array
+from pathlib import Path
+
+import cv2 as cv
+import numpy as np
+
+from .score_cache import CACHE_VERSION, SCORE_DTYPE
+
+DEFAULT_CHECKPOINT_INTERVAL_S = 60
+CHECKPOINT_DIR_NAME = 'checkpoints'
+
+
+class MotionCheckpoint:
+    """
+    Periodically save the white pixel counts and frame times computed so far and the position reached in the video, so
+    that an interrupted analysis resumes from there instead of from the start.
+
+    Scores are appended to a binary file, and a JSON file records how many of them are complete, so that saving a
+    checkpoint costs the same at the end of a long video as at its start.
+
+    Args:
+        cache_dir (str): Directory of the motion score cache. Checkpoints are kept in its checkpoints/ subdirectory.
+        key (str): Cache key of the analysis (see score_cache.get_cache_key()): a checkpoint only resumes the
+            analysis of the same video with the same parameters.
+        interval_s (float): Minimum time between two checkpoints, in seconds.
+    """
+
+    def __init__(self, cache_dir, key, interval_s=DEFAULT_CHECKPOINT_INTERVAL_S):
+        checkpoint_dir = Path(cache_dir) / CHECKPOINT_DIR_NAME
+        checkpoint_dir.mkdir(parents=True, exist_ok=True)
+        self.scores_path = checkpoint_dir / f'{key}.bin'
+        self.meta_path = checkpoint_dir / f'{key}.json'
+        self.interval_s = interval_s
+        self.num_saved = 0
+        self.last_save_time = time.monotonic()
+
+    def load(self):
+        """
+        Return (frames, times_ms, white_pixels, position) from the checkpoint, where position is the 1-based position
+        of the last analyzed frame, or None if there is no usable checkpoint.
+        """
+        if not self.meta_path.exists():
+            # Scores appended before the first checkpoint was complete
+            self.remove()
+            return None
+        try:
+            with open(self.meta_path, 'r') as f:
+                meta = json.load(f)
+            scores = np.fromfile(self.scores_path, dtype=SCORE_DTYPE, count=meta['num_scores'])
+        except (OSError, ValueError, KeyError) as e:
+            print(f'Ignoring unreadable checkpoint {self.meta_path}: {e}')
+            self.remove()
+            return None
+        if meta.get('version') != CACHE_VERSION or len(scores) != meta['num_scores']:
+            self.remove()
+            return None
+
+        # Anything written after the last complete checkpoint is dropped
+        with open(self.scores_path, 'r+b') as f:
+            f.truncate(scores.nbytes)
+        self.num_saved = len(scores)
+        print(f'Resuming from a checkpoint at frame {meta["position"]:,} ({len(scores):,} scores)')
+        return (array('i', scores['frame']), array('i', scores['time_ms']), array('i', scores['white_pixels']),
+                meta['position'])
+
+    def save(self, frames, times_ms, white_pixels, position):
+        """
+        Append the scores computed since the last checkpoint, then record the new position.
+        """
+        scores = np.empty(len(frames) - self.num_saved, dtype=SCORE_DTYPE)
+        scores['frame'] = frames[self.num_saved:]
+        scores['time_ms'] = times_ms[self.num_saved:]
+        scores['white_pixels'] = white_pixels[self.num_saved:]
+        with open(self.scores_path, 'ab') as f:
+            f.write(scores.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        self.num_saved = len(frames)
+
+        tmp_meta_path = self.meta_path.with_suffix('.tmp')
+        with open(tmp_meta_path, 'w') as f:
+            json.dump({'version': CACHE_VERSION, 'num_scores': self.num_saved, 'position': position}, f)
+        os.replace(tmp_meta_path, self.meta_path)
+        self.last_save_time = time.monotonic()
+
+    def update(self, frames, times_ms, white_pixels, position):
+        """
+        Save a checkpoint if the last one is older than the interval.
+        """
+        if time.monotonic() - self.last_save_time >= self.interval_s:
+            self.save(frames, times_ms, white_pixels, position)
+
+    def get_resume_point(self, warmup_frames, frame_step=1):
+        """
+        Load the checkpoint, if any, and return where to resume from: the background model is fed warmup_frames
+        analyzed frames before the first frame that is not in the checkpoint. The model itself can't be saved, so it is
+        rebuilt this way, like at the start of a range of the parallel analysis.
+
+        Returns:
+            tuple: (frames, times_ms, white_pixels, resume_position, start_position): the scores so far, the position
+                of the last frame they include (0 for none), and the position to start decoding from.
+        """
+        state = self.load()
+        if state is None:
+            return array('i'), array('i'), array('i'), 0, 0
+
+        frames, times_ms, white_pixels, resume_position = state
+        # Stay aligned on frame_step, so that the same frames are analyzed as in an uninterrupted run
+        start_position = max(resume_position - warmup_frames * frame_step, 0)
+        return frames, times_ms, white_pixels, resume_position, start_position
+
+    def resume(self, capture, warmup_frames, frame_step=1):
+        """
+        Same as get_resume_point(), and seek the video to the start position.
+        """
+        frames, times_ms, white_pixels, resume_position, start_position = self.get_resume_point(warmup_frames,
+                                                                                                frame_step)
+        if start_position:
+            capture.set(cv.CAP_PROP_POS_FRAMES, start_position)
+        return frames, times_ms, white_pixels, resume_position, start_position
+
+    def remove(self):
+        for path in (self.scores_path, self.meta_path):
+            if path.exists():
+                os.remove(path)
+
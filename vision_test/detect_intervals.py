@@ -0,0 +1,54 @@
+import numpy as np
+
+from video_cutter.interval_file import to_seconds
+
+
+def estimate_frame_times_ms(frames, fps):
+    """
+    Return the presentation times, in milliseconds, of 1-based frame positions, assuming a constant frame rate.
+    """
+    frames = np.asarray(frames)
+    if not fps:
+        return np.zeros(len(frames), dtype=np.int32)
+    return np.round((frames - 1) * 1000 / fps).astype(np.int32)
+
+
+def detect_intervals(white_pixels, fps, *, white_pixel_threshold, movement_gap_ms, padding_ms, times_ms=None):
+    """
+    Turn per-frame white pixel counts into intensive movement intervals, using vectorized NumPy operations only.
+
+    A frame is intensive when its white pixel count is above white_pixel_threshold. Consecutive intensive frames less
+    than movement_gap_ms apart belong to the same movement. A movement starts at the presentation time of its first
+    intensive frame, and ends once its last intensive frame has been shown, plus padding_ms. Movements that overlap as
+    a result are merged.
+
+    Args:
+        white_pixels (np.ndarray): White pixel count of each analyzed frame.
+        fps (float): Video fps, which gives the duration of a frame.
+        white_pixel_threshold (int): White pixel count above which a frame is intensive.
+        movement_gap_ms (int): Maximum gap, in milliseconds, between two intensive frames of the same movement.
+        padding_ms (int): Number of milliseconds added to the end of every movement.
+        times_ms (np.ndarray): Presentation time of each analyzed frame, in milliseconds. Defaults to the times of
+            frames 1, 2, 3, etc. at a constant frame rate.
+
+    Returns:
+        list: {"from", "to"} dicts, in seconds, at millisecond precision.
+    """
+    white_pixels = np.asarray(white_pixels)
+    if times_ms is None:
+        times_ms = estimate_frame_times_ms(np.arange(1, len(white_pixels) + 1), fps)
+
+    intensive_times = np.asarray(times_ms, dtype=np.int64)[white_pixels > white_pixel_threshold]
+    if len(intensive_times) == 0:
+        return []
+    frame_ms = round(1000 / fps) if fps else 0
+
+    # A new movement starts wherever the gap to the previous intensive frame is larger than movement_gap_ms. Padding
+    # then merges two movements back whenever the next one starts before the end of the padded previous one, so a gap
+    # only survives post-processing if it is larger than both.
+    max_gap = max(movement_gap_ms, frame_ms + padding_ms)
+    breaks = np.flatnonzero(np.diff(intensive_times) > max_gap)
+    starts = intensive_times[np.concatenate(([0], breaks + 1))]
+    ends = intensive_times[np.concatenate((breaks, [len(intensive_times) - 1]))] + frame_ms + padding_ms
+
+    return [{"from": to_seconds(start), "to": to_seconds(end)} for start, end in zip(starts.tolist(), ends.tolist())]
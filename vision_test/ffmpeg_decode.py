@@ -0,0 +1,246 @@
+import bisect
+import queue
+import re
+import threading
+import time
+from array import array
+
+import cv2 as cv
+import ffmpeg
+import numpy as np
+
+from decorators.tracing import add_stage, count, traced
+from .analyze_movements import (get_analysis_roi, get_analysis_size, get_video_properties, make_motion_scores,
+                                print_analysis_profile)
+from .roi import count_white_pixels
+
+ANALYZE_DURATION = '10M'
+PROBE_SIZE = '50M'
+# 0 lets ffmpeg use as many decoding and filtering threads as it sees fit
+DEFAULT_DECODER_THREADS = 0
+# Frame times are recorded in whole milliseconds
+TIME_PRECISION_S = 0.001
+# Presentation time of a frame, in the line the showinfo filter logs for it
+SHOWINFO_PREFIX = b'[Parsed_showinfo'
+PTS_TIME_PATTERN = re.compile(rb'\bpts_time:\s*(-?[0-9.]+)')
+
+
+def get_output_size(source_size, analysis_size, roi_geometry):
+    """
+    Return the (width, height) of the frames fed to the background subtractor, like prepare_frame() outputs them.
+    """
+    if roi_geometry is not None:
+        x0, y0, x1, y1 = roi_geometry['crop']
+        return roi_geometry['size'] or (x1 - x0, y1 - y0)
+    return analysis_size or source_size
+
+
+def get_stream_start_time(input_video):
+    """
+    Return the start time of the first video stream, in seconds, which OpenCV subtracts from the times it reports.
+    """
+    probe = ffmpeg.probe(str(input_video), select_streams='v:0', analyzeduration=ANALYZE_DURATION, probesize=PROBE_SIZE)
+    start_time = probe['streams'][0].get('start_time', 'N/A') if probe['streams'] else 'N/A'
+    return 0.0 if start_time == 'N/A' else float(start_time)
+
+
+def get_resume_time(frames, times_ms, start_position):
+    """
+    Return the time recorded for the frame at start_position, in seconds from the start of the stream, or None for the
+    start of the video. Unlike a time estimated from the frame rate, it is right for variable frame rate videos too.
+    """
+    if not start_position:
+        return None
+    i = bisect.bisect_left(frames, start_position)
+    if i == len(frames) or frames[i] != start_position:
+        raise ValueError(f'The checkpoint has no time for frame {start_position}: it cannot be resumed from there.')
+    return times_ms[i] / 1000
+
+
+def read_frame_times(stderr, frame_times, log_lines):
+    """
+    Body of the thread that reads the stderr of a frame stream: the presentation time of every frame, in seconds, goes
+    to the frame_times queue, and the lines that are not about a frame to log_lines. None is queued once ffmpeg exits.
+    """
+    for line in stderr:
+        if line.startswith(SHOWINFO_PREFIX):
+            match = PTS_TIME_PATTERN.search(line)
+            if match:
+                frame_times.put(float(match.group(1)))
+        else:
+            log_lines.append(line)
+    frame_times.put(None)
+
+
+def open_frame_stream(input_video, output_size, *, grayscale=False, frame_step=1, roi_geometry=None,
+                      start_time=0, after_time=None, threads=DEFAULT_DECODER_THREADS):
+    """
+    Start an ffmpeg process that decodes input_video with its own threads, keeps every frame_step-th frame, crops and
+    scales them the way prepare_frame() does, and writes them to its stdout as raw BGR (or grayscale) pixels.
+
+    Raw frames carry no timestamp: the showinfo filter logs the presentation time of each one to stderr instead, where
+    a thread reads them in order. Timestamps are kept as they are in the container (copyts), even after a seek.
+
+    ffmpeg seeks to start_time (in seconds from the start of the stream) rounded to the time base of the stream, so
+    the first frame may be the one presented just before it. With after_time (a presentation time in the container, in
+    seconds), only the frames presented after it are kept, and counted for frame_step.
+
+    Returns:
+        dict: "process", "frame_times" (queue of presentation times, in seconds, None once ffmpeg exits), "reader"
+            (thread reading stderr) and "log" (lines of stderr not about a frame).
+    """
+    input_kwargs = dict(analyzeduration=ANALYZE_DURATION, probesize=PROBE_SIZE, threads=threads)
+    if start_time:
+        input_kwargs['ss'] = start_time
+    stream = ffmpeg.input(str(input_video), **input_kwargs).video
+
+    if after_time is not None:
+        stream = stream.filter('select', f'gt(t,{after_time})')
+    if frame_step > 1:
+        # Same frames as read_frame(): the frame_step-th, the 2 * frame_step-th...
+        stream = stream.filter('select', f'not(mod(n+1,{frame_step}))')
+    if roi_geometry is not None:
+        x0, y0, x1, y1 = roi_geometry['crop']
+        stream = stream.crop(x0, y0, x1 - x0, y1 - y0)
+    # Area averaging, like cv.INTER_AREA. A no-op when the size doesn't change.
+    stream = stream.filter('scale', output_size[0], output_size[1], flags='area')
+    # No checksum: it would cost as much as a copy of every frame
+    stream = stream.filter('showinfo', checksum=0)
+
+    process = (stream
+               .output('pipe:', format='rawvideo', pix_fmt='gray' if grayscale else 'bgr24', vsync='passthrough')
+               .global_args('-loglevel', 'info', '-hide_banner', '-nostats', '-nostdin', '-copyts',
+                            '-filter_threads', str(threads))
+               .run_async(pipe_stdout=True, pipe_stderr=True))
+
+    frame_times = queue.Queue()
+    log_lines = []
+    reader = threading.Thread(target=read_frame_times, args=(process.stderr, frame_times, log_lines), daemon=True)
+    reader.start()
+    return {"process": process, "frame_times": frame_times, "reader": reader, "log": log_lines}
+
+
+def get_frame_time(frame_stream):
+    """
+    Return the presentation time, in seconds, of the frame just read from a frame stream.
+    """
+    frame_time = frame_stream['frame_times'].get()
+    if frame_time is None:
+        raise RuntimeError('ffmpeg logged no presentation time for the frame just read.')
+    return frame_time
+
+
+def close_frame_stream(frame_stream):
+    """
+    Wait for the ffmpeg process to exit, and raise ffmpeg.Error if it failed.
+    """
+    process = frame_stream['process']
+    process.stdout.close()
+    frame_stream['reader'].join()
+    process.stderr.close()
+    if process.wait() != 0:
+        raise ffmpeg.Error('ffmpeg', None, b''.join(frame_stream['log']))
+
+
+def read_frame_into(stream, buffer):
+    """
+    Fill buffer with the next frame of the stream, and return the number of bytes read: less than the size of the
+    buffer at the end of the stream. The pipe hands frames over in small chunks.
+    """
+    view = memoryview(buffer).cast('B')
+    size = 0
+    while size < len(view):
+        read = stream.readinto(view[size:])
+        if not read:
+            break
+        size += read
+    return size
+
+
+@traced()
+def compute_motion_scores_ffmpeg(input_video, back_sub, *, analysis_width=None, grayscale=False, frame_step=1,
+                                 roi=None, checkpoint=None, warmup_frames=0, threads=DEFAULT_DECODER_THREADS):
+    """
+    Version of compute_motion_scores() where frames come from an ffmpeg process instead of cv.VideoCapture. ffmpeg
+    decodes, skips, crops, downscales and converts frames to grayscale with its own threads, in parallel with the
+    background subtraction, and hands them over through a pipe into a single reused buffer. Frames are timed by their
+    presentation timestamps, like in the other paths, so variable frame rate videos are timed right too.
+
+    Args:
+        threads (int): Number of decoding and filtering threads of ffmpeg. 0 lets ffmpeg decide.
+    """
+    capture = cv.VideoCapture(input_video)
+    if not capture.isOpened():
+        raise FileNotFoundError(f'Unable to open: {input_video}')
+    fps, total_frames, source_size = get_video_properties(capture)
+    capture.release()
+    stream_start_time = get_stream_start_time(input_video)
+
+    analysis_size = get_analysis_size(source_size, analysis_width)
+    roi_geometry = get_analysis_roi(roi, source_size, analysis_size)
+    output_width, output_height = get_output_size(source_size, analysis_size, roi_geometry)
+    print(f'Video FPS: {fps}')
+    print(f'Processing {total_frames:,} frames decoded by ffmpeg')
+    print_analysis_profile(source_size, analysis_size, grayscale, frame_step, roi_geometry)
+
+    if checkpoint is not None:
+        frames, times_ms, white_pixels, resume_position, start_position = checkpoint.get_resume_point(warmup_frames,
+                                                                                                      frame_step)
+    else:
+        frames, times_ms, white_pixels, resume_position, start_position = array('i'), array('i'), array('i'), 0, 0
+
+    # Resume right after the frame at start_position, found by its recorded time: seek to it, then drop it and the
+    # frames before it
+    resume_time = get_resume_time(frames, times_ms, start_position)
+    after_time = None if resume_time is None else stream_start_time + resume_time + TIME_PRECISION_S / 2
+
+    buffer = np.empty((output_height, output_width) if grayscale else (output_height, output_width, 3), dtype=np.uint8)
+    frame_stream = open_frame_stream(input_video, (output_width, output_height), grayscale=grayscale,
+                                     frame_step=frame_step, roi_geometry=roi_geometry, start_time=resume_time or 0,
+                                     after_time=after_time, threads=threads)
+    process = frame_stream['process']
+
+    current_frame = start_position
+    progress_step = max(total_frames // frame_step // 10, 1)
+    num_analyzed = 0
+    # Time spent in each stage, accumulated over all frames. Reading is mostly waiting for ffmpeg.
+    read_s = subtract_s = count_s = 0.0
+    try:
+        while True:
+            read_start = time.perf_counter()
+            size = read_frame_into(process.stdout, buffer)
+            subtract_start = time.perf_counter()
+            read_s += subtract_start - read_start
+            if size < buffer.nbytes:
+                break
+            current_frame += frame_step
+            # Same time as get_frame_time_ms() reports in the other paths
+            time_ms = max(round((get_frame_time(frame_stream) - stream_start_time) * 1000), 0)
+
+            fg_mask = back_sub.apply(buffer)
+            count_start = time.perf_counter()
+            subtract_s += count_start - subtract_start
+
+            # Count white pixels, except in the warm-up window of a resumed analysis
+            if current_frame > resume_position:
+                frames.append(current_frame)
+                times_ms.append(time_ms)
+                white_pixels.append(count_white_pixels(fg_mask, roi_geometry))
+                if checkpoint is not None:
+                    checkpoint.update(frames, times_ms, white_pixels, current_frame)
+            count_s += time.perf_counter() - count_start
+
+            num_analyzed += 1
+            if num_analyzed % progress_step == 0 and total_frames:
+                print(f"Processing: {current_frame / total_frames * 100:.2f}% complete")
+    except BaseException:
+        process.kill()
+        process.wait()
+        raise
+    close_frame_stream(frame_stream)
+
+    add_stage('read', read_s, num_analyzed + 1)
+    add_stage('subtract', subtract_s, num_analyzed)
+    add_stage('count', count_s, num_analyzed)
+    count('frames', num_analyzed)
+    return make_motion_scores(fps, total_frames, source_size, analysis_size, frames, white_pixels, times_ms)
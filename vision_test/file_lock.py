@@ -0,0 +1,49 @@
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# How often a Windows process waiting for a lock tries to take it again, in seconds
+LOCK_POLL_INTERVAL_S = 0.05
+
+
+def _lock(lock_file):
+    if fcntl is not None:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return
+
+    # msvcrt.locking() only blocks for 10 seconds before raising, so keep trying without blocking instead
+    lock_file.seek(0)
+    while True:
+        try:
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+            return
+        except OSError:
+            time.sleep(LOCK_POLL_INTERVAL_S)
+
+
+def _unlock(lock_file):
+    if fcntl is not None:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        return
+
+    lock_file.seek(0)
+    msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def lock_file(lock_path):
+    """
+    Hold an exclusive lock on lock_path, created if needed, between the processes of the machine: flock on Unix, and a
+    lock on the first byte of the file on Windows. The lock is released when the process dies.
+    """
+    with open(lock_path, 'a+') as f:
+        _lock(f)
+        try:
+            yield
+        finally:
+            _unlock(f)
@@ -0,0 +1,135 @@
+import queue
+import threading
+import time
+
+import cv2 as cv
+import numpy as np
+
+from decorators.tracing import add_stage, count, traced
+from .analyze_movements import (get_analysis_roi, get_analysis_size, get_frame_time_ms, get_video_properties,
+                                make_motion_scores, prepare_frame, print_analysis_profile, start_motion_scores)
+from .roi import count_white_pixels
+
+DEFAULT_QUEUE_SIZE = 8
+
+
+def print_stage_throughput(stage, frame_count, busy_s, wait_s):
+    fps = frame_count / busy_s if busy_s else 0
+    print(f'{stage}: {frame_count:,} frames in {busy_s:.2f}s busy ({fps:.1f} fps), {wait_s:.2f}s waiting')
+
+
+def decode_frames(capture, free_buffers, decoded_frames, frame_step, stats):
+    """
+    Producer: decode frames into buffers taken from free_buffers, and hand them over through decoded_frames.
+
+    A None item marks the end of the video. If decoding fails, the exception is handed over instead. A None buffer
+    stops the producer early.
+    """
+    try:
+        while True:
+            wait_start = time.perf_counter()
+            buffer = free_buffers.get()
+            if buffer is None:
+                break
+            decode_start = time.perf_counter()
+            stats['wait_s'] += decode_start - wait_start
+
+            ret = True
+            for _ in range(frame_step - 1):
+                ret = capture.grab()
+                if not ret:
+                    break
+            # capture.read() decodes straight into the buffer when its size and type match the frame
+            ret, frame = capture.read(buffer) if ret else (False, None)
+            if not ret or frame is None:
+                break
+            current_frame = int(capture.get(cv.CAP_PROP_POS_FRAMES))
+            time_ms = get_frame_time_ms(capture)
+
+            stats['busy_s'] += time.perf_counter() - decode_start
+            stats['frames'] += 1
+            decoded_frames.put((current_frame, time_ms, frame))
+    except Exception as e:
+        decoded_frames.put(e)
+        return
+
+    decoded_frames.put(None)
+
+
+@traced()
+def compute_motion_scores_pipelined(capture, back_sub, *, analysis_width=None, grayscale=False, frame_step=1,
+                                    queue_size=DEFAULT_QUEUE_SIZE, roi=None, checkpoint=None, warmup_frames=0):
+    """
+    Pipelined version of compute_motion_scores(). A producer thread decodes frames while the calling thread runs the
+    background subtraction and counts white pixels. OpenCV releases the GIL in both stages, so they overlap.
+
+    The two stages exchange queue_size preallocated frame buffers, which bounds memory regardless of the video length.
+    Throughput of each stage is printed at the end: the stage that spends the least time waiting is the bottleneck.
+    Regions of interest and checkpoints work as in compute_motion_scores().
+    """
+    fps, total_frames, source_size = get_video_properties(capture)
+    analysis_size = get_analysis_size(source_size, analysis_width)
+    roi_geometry = get_analysis_roi(roi, source_size, analysis_size)
+    print(f'Video FPS: {fps}')
+    print(f'Processing {total_frames:,} frames with a {queue_size}-frame pipeline')
+    print_analysis_profile(source_size, analysis_size, grayscale, frame_step, roi_geometry)
+
+    source_width, source_height = source_size
+    free_buffers = queue.Queue()
+    for _ in range(queue_size):
+        free_buffers.put(np.empty((source_height, source_width, 3), dtype=np.uint8))
+    # Not bounded itself: the decoder can't hold more than the queue_size buffers, plus the end marker
+    decoded_frames = queue.Queue()
+
+    # Seek before the decoder starts reading
+    frames, times_ms, white_pixels, resume_position, _ = start_motion_scores(capture, checkpoint, warmup_frames,
+                                                                             frame_step)
+
+    decode_stats = {'frames': 0, 'busy_s': 0.0, 'wait_s': 0.0}
+    analyze_stats = {'frames': 0, 'busy_s': 0.0, 'wait_s': 0.0}
+    decoder = threading.Thread(target=decode_frames,
+                               args=(capture, free_buffers, decoded_frames, frame_step, decode_stats),
+                               daemon=True)
+    decoder.start()
+
+    progress_step = max(total_frames // frame_step // 10, 1)
+    try:
+        while True:
+            wait_start = time.perf_counter()
+            item = decoded_frames.get()
+            analyze_start = time.perf_counter()
+            analyze_stats['wait_s'] += analyze_start - wait_start
+
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+
+            current_frame, time_ms, frame = item
+            fg_mask = back_sub.apply(prepare_frame(frame, analysis_size, grayscale, roi_geometry))
+            if current_frame > resume_position:
+                frames.append(current_frame)
+                times_ms.append(time_ms)
+                white_pixels.append(count_white_pixels(fg_mask, roi_geometry))
+                if checkpoint is not None:
+                    checkpoint.update(frames, times_ms, white_pixels, current_frame)
+            # The buffer can be reused by the decoder as soon as the subtractor is done with it
+            free_buffers.put(frame)
+
+            analyze_stats['busy_s'] += time.perf_counter() - analyze_start
+            analyze_stats['frames'] += 1
+            if analyze_stats['frames'] % progress_step == 0 and total_frames:
+                print(f"Processing: {current_frame / total_frames * 100:.2f}% complete")
+    finally:
+        # Stop the decoder if the analysis failed while it was waiting for a buffer, so that it never outlives the call
+        free_buffers.put(None)
+        decoder.join()
+
+    print_stage_throughput('Decode', decode_stats['frames'], decode_stats['busy_s'], decode_stats['wait_s'])
+    print_stage_throughput('Analyze', analyze_stats['frames'], analyze_stats['busy_s'], analyze_stats['wait_s'])
+    # The stages overlap, so their times add up to more than the wall time
+    add_stage('decode', decode_stats['busy_s'], decode_stats['frames'])
+    add_stage('subtract+count', analyze_stats['busy_s'], analyze_stats['frames'])
+    count('frames', analyze_stats['frames'])
+
+    return make_motion_scores(fps, total_frames, source_size, analysis_size, frames, white_pixels, times_ms)
@@ -1,9 +1,13 @@
 import ffmpeg
-import json
 from datetime import datetime
+from functools import partial
 from pathlib import Path
-import os
 from decorators.all_decorators import record_performance
+from video_cutter.cut_clip import CUT_ENCODE, cut_clip
+from video_cutter.extract_segments import CUT_MODE_METHODS, METHOD_AUTO, extract_segments
+from video_cutter.interval_file import load_intervals
+from video_cutter.keyframe_index import load_keyframe_index
+from video_cutter.render_pool import DEFAULT_ENCODER_THREADS, describe_error, render_jobs
 
 ANALYZE_DURATION = '10M'  # Increase analyzeduration (10 million microseconds = 10 seconds)
 PROBE_SIZE = '50M'  # Increase probesize to 50 megabytes
@@ -32,38 +36,14 @@ def generate_large_clip(data, input_video, output_dir_path):
     ffmpeg.run(output_stream)
 
 
-def generate_large_clip_2(data, input_video, output_dir_path):
-    # Create temporary files for each time period
-    temp_files = []
-    for i, d in enumerate(data):
-        start_time = d['from']
-        duration = d['to'] - start_time
-        temp_file = f"temp_{i}.mp4"
-        ffmpeg.input(input_video, ss=start_time, t=duration, analyzeduration=ANALYZE_DURATION,
-                     probesize=PROBE_SIZE).output(temp_file).run()
-        temp_files.append(temp_file)
-
-    # Create a temporary text file listing all the video segments
-    concat_file_path = output_dir_path / "concat_list.txt"
-    with open(concat_file_path, 'w') as f:
-        for temp_file in temp_files:
-            f.write(f"file '{os.path.abspath(temp_file)}'\n")
-
-    # Use the concat demuxer to concatenate the segments
-    (ffmpeg.input(
-        concat_file_path,
-        format='concat',
-        safe=0)
-     .output("clip_merged.mp4", c='copy').run())
-
-    # Clean up the temporary files
-    os.remove(concat_file_path)
-    for temp_file in temp_files:
-        os.remove(temp_file)
+def generate_large_clip_2(data, input_video, output_dir_path, method=METHOD_AUTO):
+    # Cut and join every segment with a single ffmpeg process, without temporary files
+    extract_segments(input_video, data, output_dir_path / "clip_merged.mp4", method)
 
 
 @record_performance
-def generate_clips(movements_data_file="", input_video="", base_output_dir=""):
+def generate_clips(movements_data_file="", input_video="", base_output_dir="", cut_mode=CUT_ENCODE, max_workers=None,
+                   encoder_threads=DEFAULT_ENCODER_THREADS):
     """
     Generate clips from an input intensive-movements.json file.
 
@@ -71,6 +51,9 @@ def generate_clips(movements_data_file="", input_video="", base_output_dir=""):
         movements_data_file (str): Path to the intensive-movements.json file relative to where the script is run.
         input_video (str): Path to the video used by intensive-movements.json.
         base_output_dir (str): The parent directory where the output clips will be saved under. A new directory (prefixed with a timestamp) will be created under this provided output directory path, and the videos will be put under this new directory.
+        cut_mode (str): "encode" re-encodes every clip. "snap" stream-copies every clip from the keyframe preceding its start, and "smart" only re-encodes the partial GOPs at each end of a clip. Both use the keyframe index of input_video.
+        max_workers (int): Maximum number of clips rendered concurrently. Defaults to the number of CPU cores divided by encoder_threads.
+        encoder_threads (int): Number of threads given to each ffmpeg encoder.
 
     Returns:
         None: This function does not return any value.
@@ -85,29 +68,31 @@ def generate_clips(movements_data_file="", input_video="", base_output_dir=""):
     output_dir_path = Path(base_output_dir) / f"{output_prefix}_clips"
     output_dir_path.mkdir(exist_ok=True)
 
-    with open(movements_data_file, 'r') as f:
-        data = json.load(f)
+    data = load_intervals(movements_data_file)
 
-    count = 0
-    err_count = 0
-    clip_paths = []
+    keyframes = load_keyframe_index(input_video) if cut_mode != CUT_ENCODE else None
+
+    jobs = []
     for i, movement in enumerate(data):
         start_time_sec = movement["from"]
         end_time_sec = movement["to"]
-        activity_duration = end_time_sec - start_time_sec
 
         clip_id = str(i + 1)
-        print(f"Generating clip {clip_id}...")
         output_file_path = output_dir_path / f"clip_{clip_id}_{str(start_time_sec)}-{str(end_time_sec)}.mp4"
-        clip_paths.append(str(output_file_path))
+        jobs.append((f"clip_{clip_id}", partial(cut_clip, input_video, start_time_sec, end_time_sec, output_file_path,
+                                                cut_mode, keyframes, quiet=True, pix_fmt=PIXEL_FORMAT,
+                                                threads=encoder_threads)))
+
+    print(f"Generating {len(jobs)} clips...")
+    results = render_jobs(jobs, max_workers, encoder_threads)
 
-        try:
-            ffmpeg.input(input_video, ss=start_time_sec, t=activity_duration,
-                         analyzeduration=ANALYZE_DURATION, probesize=PROBE_SIZE).output(
-                str(output_file_path), pix_fmt=PIXEL_FORMAT).run()
+    count = 0
+    err_count = 0
+    for result in results:
+        if result["ok"]:
             count += 1
-        except ffmpeg.Error as e:
-            print(f"Error generating clip {str(output_file_path)}: {e}")
+        else:
+            print(f"Error generating clip {result['id']}: {describe_error(result['error'])}")
             err_count += 1
 
     result_msg = f"{movements_data_file} + {input_video}: {count} clips generated with {err_count} errors."
@@ -116,4 +101,4 @@ def generate_clips(movements_data_file="", input_video="", base_output_dir=""):
     print(result_msg)
 
     print(f'Generated {count} clips. Now creating a merged video...')
-    generate_large_clip_2(data, input_video, output_dir_path)
+    generate_large_clip_2(data, input_video, output_dir_path, CUT_MODE_METHODS[cut_mode])
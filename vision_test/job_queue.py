@@ -0,0 +1,189 @@
+import hashlib
+import json
+import os
+import socket
+import time
+from pathlib import Path
+
+import psutil
+
+from .file_lock import lock_file
+
+DEFAULT_QUEUE_DIR = Path('output/jobs')
+# A job whose worker died, or whose analysis raised, is retried until it has been attempted this many times
+DEFAULT_MAX_ATTEMPTS = 2
+
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+
+def get_job_id(object_name, generation):
+    """
+    Return the id of the job for a given version of a stored object: duplicate events for the same upload map to the
+    same job, while overwriting the object (a new generation) makes a new one.
+    """
+    return hashlib.blake2b(f'{object_name}#{generation}'.encode(), digest_size=8).hexdigest()
+
+
+def is_process_alive(pid):
+    # Not os.kill(pid, 0), which terminates the process on Windows
+    return psutil.pid_exists(pid)
+
+
+class FileJobQueue:
+    """
+    A job queue kept in a directory, shared by every process of the machine that opens it: a status record per job in
+    records/, and an empty token per job waiting to run in queued/.
+
+    State changes are serialized by a lock file. Records are replaced atomically, so they can be read at any time
+    without taking the lock.
+    """
+
+    def __init__(self, queue_dir=DEFAULT_QUEUE_DIR, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.queue_dir = Path(queue_dir)
+        self.max_attempts = max_attempts
+        self.records_dir = self.queue_dir / 'records'
+        self.queued_dir = self.queue_dir / 'queued'
+        self.results_dir = self.queue_dir / 'results'
+        for directory in (self.records_dir, self.queued_dir, self.results_dir):
+            directory.mkdir(parents=True, exist_ok=True)
+        self.lock_path = self.queue_dir / 'lock'
+
+    def lock(self):
+        return lock_file(self.lock_path)
+
+    def get_record_path(self, job_id):
+        return self.records_dir / f'{job_id}.json'
+
+    def get_output_dir(self, job_id):
+        return self.results_dir / job_id
+
+    def get_job(self, job_id):
+        """
+        Return the status record of a job, or None if it was never submitted.
+        """
+        try:
+            with open(self.get_record_path(job_id), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def list_jobs(self, status=None):
+        jobs = []
+        for record_path in sorted(self.records_dir.glob('*.json')):
+            job = self.get_job(record_path.stem)
+            if job is not None and (status is None or job['status'] == status):
+                jobs.append(job)
+        return sorted(jobs, key=lambda job: job['submitted_at'])
+
+    def save_job(self, job):
+        record_path = self.get_record_path(job['id'])
+        tmp_path = record_path.with_suffix(f'.{os.getpid()}.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(job, f, indent=4)
+        os.replace(tmp_path, record_path)
+
+    def enqueue(self, job):
+        job['status'] = STATUS_QUEUED
+        job['queued_at'] = time.time()
+        self.save_job(job)
+        (self.queued_dir / job['id']).touch()
+
+    def submit(self, object_name, generation, input_video, params=None):
+        """
+        Queue the analysis of input_video, unless this generation of the object already has a job, whatever its
+        status: a job that failed has already been retried as many times as allowed.
+
+        Returns:
+            tuple: (job, created), where job is the status record, and created is False for a duplicate.
+        """
+        job_id = get_job_id(object_name, generation)
+        with self.lock():
+            job = self.get_job(job_id)
+            if job is not None:
+                return job, False
+
+            job = {
+                "id": job_id,
+                "object_name": object_name,
+                "generation": generation,
+                "input": str(input_video),
+                "params": params or {},
+                "output_dir": str(self.get_output_dir(job_id)),
+                "status": None,
+                "attempts": 0,
+                "submitted_at": time.time(),
+                "worker": None,
+                "result": None,
+                "error": None,
+            }
+            self.enqueue(job)
+            return job, True
+
+    def claim(self):
+        """
+        Take the oldest queued job and mark it as running in this process.
+
+        Returns:
+            dict: The status record of the job, or None if no job is waiting.
+        """
+        with self.lock():
+            for token in sorted(self.queued_dir.iterdir(), key=lambda token: token.stat().st_mtime_ns):
+                token.unlink()
+                job = self.get_job(token.name)
+                if job is None:
+                    # Its record was deleted by hand: there is nothing left to run
+                    print(f"Dropping queued job {token.name}, which has no status record")
+                    continue
+                job['status'] = STATUS_RUNNING
+                job['attempts'] += 1
+                job['started_at'] = time.time()
+                job['worker'] = {"host": socket.gethostname(), "pid": os.getpid()}
+                self.save_job(job)
+                return job
+            return None
+
+    def finish(self, job_id, result=None, error=None):
+        """
+        Record the outcome of a running job: its result, or the error that made it fail. A failed job is queued again
+        as long as it has attempts left.
+        """
+        with self.lock():
+            job = self.get_job(job_id)
+            job['finished_at'] = time.time()
+            job['result'] = result
+            job['error'] = error
+            if error is None:
+                job['status'] = STATUS_DONE
+                self.save_job(job)
+            else:
+                self.fail(job)
+
+    def fail(self, job):
+        if job['attempts'] < self.max_attempts:
+            self.enqueue(job)
+        else:
+            job['status'] = STATUS_FAILED
+            self.save_job(job)
+
+    def recover(self):
+        """
+        Fail the running jobs of this host whose worker process is gone (e.g. killed for running out of memory). They
+        are queued again when they have attempts left.
+
+        Returns:
+            int: Number of jobs queued again.
+        """
+        host = socket.gethostname()
+        num_requeued = 0
+        with self.lock():
+            for job in self.list_jobs(STATUS_RUNNING):
+                worker = job['worker']
+                if worker['host'] != host or is_process_alive(worker['pid']):
+                    continue
+                job['error'] = f"The worker (pid {worker['pid']}) exited before finishing the job"
+                self.fail(job)
+                num_requeued += job['status'] == STATUS_QUEUED
+        return num_requeued
@@ -0,0 +1,144 @@
+import multiprocessing
+import os
+import time
+import traceback
+
+from . import analyze_video, get_job_args
+from .job_queue import DEFAULT_QUEUE_DIR, STATUS_DONE, STATUS_FAILED, FileJobQueue
+
+# How often idle workers look for new jobs, and waiters for finished ones, in seconds
+POLL_INTERVAL_S = 1
+
+
+def get_num_workers(cpu_count=None):
+    """
+    Return how many videos are analyzed at once: one per core, since each analysis mostly keeps a single core busy
+    with decoding and background subtraction.
+    """
+    return cpu_count or os.cpu_count() or 1
+
+
+def submit_video(queue, object_name, generation, input_video, params=None):
+    """
+    Queue the analysis of a version of a stored object (see FileJobQueue.submit()), once its parameters are known to
+    be valid, so that a typo fails the submission instead of every attempt of the job.
+    """
+    get_job_args(input_video, **(params or {}))
+    return queue.submit(object_name, generation, input_video, params)
+
+
+def run_job(queue, job):
+    """
+    Analyze the video of a claimed job and record the outcome. Never raises: a failure is recorded in the job.
+    """
+    print(f"Running job {job['id']} ({job['object_name']}, attempt {job['attempts']})...")
+    try:
+        result = analyze_video(job['input'], output_dir=job['output_dir'], **job['params'])
+    except Exception as e:
+        traceback.print_exc()
+        queue.finish(job['id'], error=f'{type(e).__name__}: {e}')
+        return False
+
+    queue.finish(job['id'], result=result)
+    return True
+
+
+def job_worker(queue_dir=DEFAULT_QUEUE_DIR, stop_when_empty=False, poll_interval_s=POLL_INTERVAL_S):
+    """
+    Body of a worker process: run queued jobs one after the other.
+
+    Args:
+        queue_dir (str): Directory of the FileJobQueue.
+        stop_when_empty (bool): If true, exit as soon as no job is waiting. Otherwise, wait for new jobs forever.
+        poll_interval_s (float): How often to look for new jobs when none is waiting.
+    """
+    queue = FileJobQueue(queue_dir)
+    while True:
+        job = queue.claim()
+        if job is None:
+            if stop_when_empty:
+                return
+            time.sleep(poll_interval_s)
+            continue
+        run_job(queue, job)
+
+
+def start_worker(queue_dir=DEFAULT_QUEUE_DIR, stop_when_empty=False):
+    # A fresh interpreter: OpenCV and ffmpeg state is not shared with the parent
+    context = multiprocessing.get_context('spawn')
+    worker = context.Process(target=job_worker, args=(str(queue_dir), stop_when_empty), daemon=not stop_when_empty)
+    worker.start()
+    return worker
+
+
+def recover_jobs(queue_dir=DEFAULT_QUEUE_DIR):
+    """
+    Queue the jobs left running by dead workers again (see FileJobQueue.recover()).
+    """
+    requeued = FileJobQueue(queue_dir).recover()
+    if requeued:
+        print(f"Queued {requeued} interrupted job(s) again.")
+    return requeued
+
+
+def start_workers(queue_dir=DEFAULT_QUEUE_DIR, num_workers=None, stop_when_empty=False):
+    """
+    Start worker processes that run the jobs of the queue concurrently. Jobs left running by dead workers are queued
+    again first.
+
+    Returns:
+        list: The worker processes.
+    """
+    recover_jobs(queue_dir)
+    return [start_worker(queue_dir, stop_when_empty) for _ in range(num_workers or get_num_workers())]
+
+
+def replace_dead_workers(workers, queue_dir=DEFAULT_QUEUE_DIR, num_workers=None):
+    """
+    Replace the workers that died (e.g. killed for running out of memory) with new ones, and queue their jobs again,
+    while the other workers keep running.
+
+    Args:
+        workers (list): The worker processes, updated in place.
+
+    Returns:
+        list: workers.
+    """
+    # is_alive() reaps dead workers: until then, their pid still exists, and recover() would take them for alive
+    alive = [worker for worker in workers if worker.is_alive()]
+    for worker in workers:
+        if worker not in alive:
+            print(f"Worker {worker.pid} exited with code {worker.exitcode}.")
+    recover_jobs(queue_dir)
+    while len(alive) < (num_workers or get_num_workers()):
+        alive.append(start_worker(queue_dir))
+    workers[:] = alive
+    return workers
+
+
+def process_jobs(queue_dir=DEFAULT_QUEUE_DIR, num_workers=None):
+    """
+    Run every queued job with worker processes, and return once the queue is empty.
+    """
+    for worker in start_workers(queue_dir, num_workers, stop_when_empty=True):
+        worker.join()
+
+
+def wait_for_job(queue, job_id, timeout_s=None, poll_interval_s=POLL_INTERVAL_S, on_poll=None):
+    """
+    Wait until a job is done or has failed for good, and return its status record.
+
+    Args:
+        timeout_s (float): Raise a TimeoutError if the job is still queued or running after this many seconds.
+        on_poll (Callable): Called every time the job is found unfinished, e.g. to replace dead workers.
+    """
+    start_time = time.monotonic()
+    while True:
+        job = queue.get_job(job_id)
+        if job['status'] in (STATUS_DONE, STATUS_FAILED):
+            return job
+        if timeout_s is not None and time.monotonic() - start_time > timeout_s:
+            raise TimeoutError(f"Job {job_id} is still {job['status']} after {timeout_s}s.")
+        if on_poll is not None:
+            on_poll()
+        time.sleep(poll_interval_s)
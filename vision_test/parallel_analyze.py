@@ -0,0 +1,128 @@
+import math
+import multiprocessing
+from array import array
+
+import cv2 as cv
+import numpy as np
+
+from decorators.tracing import count, traced
+from .analyze_movements import (ALGO_MOG2, create_back_sub, get_analysis_roi, get_analysis_size, get_frame_time_ms,
+                                get_video_properties, make_motion_scores, prepare_frame, print_analysis_profile,
+                                read_frame)
+from .roi import count_white_pixels
+
+
+def split_frame_ranges(total_frames, num_chunks, warmup_frames, frame_step=1):
+    """
+    Split a video into contiguous frame ranges, each preceded by a warm-up window.
+
+    Args:
+        total_frames (int): Number of frames in the video.
+        num_chunks (int): Number of ranges to split the video into.
+        warmup_frames (int): Number of frames fed to the background model before a range starts. These frames overlap
+            with the end of the previous range and are never recorded as movements.
+        frame_step (int): Only every frame_step-th frame is analyzed. Ranges and warm-up windows are aligned to it, so
+            that every range analyzes the same frames as a single pass would. The warm-up window spans
+            warmup_frames * frame_step frames of the video, so that the model is fed warmup_frames frames whatever the
+            step, like in a single pass, where history counts analyzed frames.
+
+    Returns:
+        list: (warmup_start, start, end) frame indexes for each range. The last range's end is None, meaning "until the
+            end of the video", since the container's frame count is only an estimate.
+    """
+    if total_frames <= 0:
+        return [(0, 0, None)]
+
+    chunk_size = math.ceil(total_frames / num_chunks / frame_step) * frame_step
+    warmup_frames *= frame_step
+    ranges = []
+    for i in range(num_chunks):
+        start = i * chunk_size
+        if start >= total_frames:
+            break
+        end = start + chunk_size if i < num_chunks - 1 else None
+        ranges.append((max(start - warmup_frames, 0), start, end))
+
+    return ranges
+
+
+def compute_chunk_scores(input_video, warmup_start, start, end, *, history, var_threshold, detect_shadows,
+                         algo=ALGO_MOG2, analysis_width=None, grayscale=False, frame_step=1, roi=None):
+    """
+    Run background subtraction over a single frame range and return the (frames, times_ms, white_pixels) of its analyzed
+    frames.
+    """
+    capture = cv.VideoCapture(input_video)
+    if not capture.isOpened():
+        raise IOError(f'Unable to open: {input_video}')
+
+    _, _, source_size = get_video_properties(capture)
+    analysis_size = get_analysis_size(source_size, analysis_width)
+    roi_geometry = get_analysis_roi(roi, source_size, analysis_size)
+    capture.set(cv.CAP_PROP_POS_FRAMES, warmup_start)
+
+    # Each worker has its own background model, settled on the warm-up window before the range starts
+    back_sub = create_back_sub(history, var_threshold, detect_shadows, algo)
+
+    frames = array('i')
+    times_ms = array('i')
+    white_pixels = array('i')
+    current_frame = warmup_start
+    while end is None or current_frame < end:
+        ret, frame = read_frame(capture, frame_step)
+        if frame is None:
+            break
+        # Same 1-based position that capture.get(cv.CAP_PROP_POS_FRAMES) reports in the serial path
+        current_frame += frame_step
+
+        fg_mask = back_sub.apply(prepare_frame(frame, analysis_size, grayscale, roi_geometry))
+        if current_frame <= start:
+            continue
+
+        frames.append(current_frame)
+        times_ms.append(get_frame_time_ms(capture))
+        white_pixels.append(count_white_pixels(fg_mask, roi_geometry))
+
+    capture.release()
+    print(f'Finished frames {start:,}-{current_frame:,}.')
+    return frames, times_ms, white_pixels
+
+
+@traced()
+def compute_motion_scores_parallel(input_video, *, num_workers, warmup_frames, history, var_threshold,
+                                   detect_shadows, algo=ALGO_MOG2, analysis_width=None, grayscale=False, frame_step=1,
+                                   roi=None):
+    """
+    Parallel version of compute_motion_scores(). The video is split into one frame range per worker, and each range is
+    analyzed in its own process with its own background subtractor.
+
+    Scores match the serial path, except within the first warm-up window of each range, where the background model
+    has seen fewer frames than it would have in a single pass.
+    """
+    capture = cv.VideoCapture(input_video)
+    if not capture.isOpened():
+        raise IOError(f'Unable to open: {input_video}')
+    fps, total_frames, source_size = get_video_properties(capture)
+    capture.release()
+    analysis_size = get_analysis_size(source_size, analysis_width)
+
+    ranges = split_frame_ranges(total_frames, num_workers, warmup_frames, frame_step)
+    print(f'Video FPS: {fps}')
+    print(f'Processing {total_frames:,} frames in {len(ranges)} chunks ({warmup_frames} warm-up frames each)')
+    print_analysis_profile(source_size, analysis_size, grayscale, frame_step,
+                           get_analysis_roi(roi, source_size, analysis_size))
+
+    tasks = [(input_video, warmup_start, start, end) for warmup_start, start, end in ranges]
+    chunk_kwargs = dict(history=history, var_threshold=var_threshold, detect_shadows=detect_shadows, algo=algo,
+                        analysis_width=analysis_width, grayscale=grayscale, frame_step=frame_step, roi=roi)
+
+    with multiprocessing.Pool(num_workers) as pool:
+        async_results = [pool.apply_async(compute_chunk_scores, task, chunk_kwargs) for task in tasks]
+        chunk_scores = [async_result.get() for async_result in async_results]
+
+    # Ranges are contiguous and in order, so their scores simply follow each other
+    frames, times_ms, white_pixels = (
+        np.concatenate([np.frombuffer(scores[i], dtype=np.int32) for scores in chunk_scores]) for i in range(3))
+    # Workers run in their own processes: their CPU time shows up as children CPU time once the pool is closed
+    count('frames', len(frames))
+    return make_motion_scores(fps, total_frames, source_size, analysis_size, frames, white_pixels, times_ms)
@@ -0,0 +1,125 @@
+import json
+import math
+import os
+
+import cv2 as cv
+import numpy as np
+
+
+UNIT_PIXELS = 'px'
+UNIT_PERCENT = '%'
+UNITS = [UNIT_PIXELS, UNIT_PERCENT]
+
+
+def parse_roi(value):
+    """
+    Return a region of interest, as {"polygon": [[x, y], ...], "unit": "px" | "%"}.
+
+    Args:
+        value (str): Either "x,y,w,h" for a rectangle, "x1,y1,x2,y2,x3,y3,..." for a polygon, or the path to a JSON
+            file holding {"rect": [x, y, w, h]} or {"polygon": [[x1, y1], [x2, y2], ...]}, and optionally a "unit".
+            Coordinates are in pixels of the video, or in percent of its width and height when every one of them ends
+            with "%" (or when the JSON file's "unit" is "%"). Mixing both is an error.
+    """
+    if os.path.isfile(value):
+        with open(value, 'r') as f:
+            data = json.load(f)
+        unit = data.get('unit', UNIT_PIXELS)
+        if unit not in UNITS:
+            raise ValueError(f'Unknown region of interest unit in {value}: {unit} (expected one of {UNITS}).')
+        if 'rect' in data:
+            return make_roi(rect_to_polygon(data['rect']), unit)
+        if 'polygon' in data:
+            return make_roi([[float(x), float(y)] for x, y in data['polygon']], unit)
+        raise ValueError(f'{value} must hold a "rect" or a "polygon".')
+
+    coordinates = [coordinate.strip() for coordinate in value.split(',')]
+    percents = [coordinate.endswith(UNIT_PERCENT) for coordinate in coordinates]
+    if any(percents) and not all(percents):
+        raise ValueError(f'A region of interest must be all in pixels or all in percent, got: {value}')
+    unit = UNIT_PERCENT if all(percents) else UNIT_PIXELS
+    numbers = [float(coordinate.rstrip(UNIT_PERCENT)) for coordinate in coordinates]
+
+    if len(numbers) == 4:
+        return make_roi(rect_to_polygon(numbers), unit)
+    if len(numbers) % 2:
+        raise ValueError(f'A region of interest needs pairs of coordinates, got {len(numbers)} numbers: {value}')
+    return make_roi([numbers[i:i + 2] for i in range(0, len(numbers), 2)], unit)
+
+
+def rect_to_polygon(rect):
+    x, y, width, height = (float(number) for number in rect)
+    return [[x, y], [x + width, y], [x + width, y + height], [x, y + height]]
+
+
+def make_roi(points, unit=UNIT_PIXELS):
+    if len(points) < 3:
+        raise ValueError(f'A region of interest needs at least 3 points, got {len(points)}.')
+    xs, ys = zip(*points)
+    if unit == UNIT_PIXELS and (max(xs) - min(xs) < 2 or max(ys) - min(ys) < 2):
+        # Most likely fractions of the frame size, which regions used to be given in
+        raise ValueError(f'The region of interest {points} is less than 2 pixels wide or high: give fractions of the '
+                         f'frame size in percent instead, e.g. "50%".')
+    return {"polygon": points, "unit": unit}
+
+
+def get_roi_geometry(roi, source_size, analysis_size=None):
+    """
+    Return how to restrict the analysis of frames to a region of interest.
+
+    Args:
+        roi (dict): The region (see parse_roi()), in pixels of the source video or in percent of its size.
+        source_size (tuple): (width, height) of the video.
+        analysis_size (tuple): (width, height) the full frames would be analyzed at, or None for the source size.
+
+    Returns:
+        dict: "crop", the (x0, y0, x1, y1) bounding box of the region in the source frame, "size", the (width, height)
+            the crop is analyzed at, or None to keep it as is, and "mask", a uint8 mask of that size that is non-zero
+            inside the region, or None when the region fills its bounding box.
+    """
+    source_width, source_height = source_size
+    polygon = np.array(roi['polygon'], dtype=np.float64)
+    if roi['unit'] == UNIT_PERCENT:
+        polygon *= (source_width / 100, source_height / 100)
+    polygon = polygon.clip(0, (source_width, source_height))
+
+    x0, y0 = (math.floor(value) for value in polygon.min(axis=0))
+    x1, y1 = (math.ceil(value) for value in polygon.max(axis=0))
+    if x1 <= x0 or y1 <= y0:
+        raise ValueError(f"The region of interest {roi['polygon']} ({roi['unit']}) is outside of the "
+                         f"{source_width}x{source_height} video.")
+
+    # Same scale as the full frames, so that white pixel thresholds keep meaning the same thing
+    scale = analysis_size[0] / source_width if analysis_size else 1
+    size = (max(round((x1 - x0) * scale), 1), max(round((y1 - y0) * scale), 1)) if analysis_size else None
+    mask_width, mask_height = size or (x1 - x0, y1 - y0)
+
+    mask = np.zeros((mask_height, mask_width), dtype=np.uint8)
+    shifted = np.rint((polygon - (x0, y0)) * (mask_width / (x1 - x0), mask_height / (y1 - y0))).astype(np.int32)
+    cv.fillPoly(mask, [shifted], 255)
+
+    return {
+        "crop": (x0, y0, x1, y1),
+        "size": size,
+        "mask": None if cv.countNonZero(mask) == mask.size else mask,
+    }
+
+
+def describe_roi(roi):
+    x0, y0, x1, y1 = roi['crop']
+    shape = 'rectangle' if roi['mask'] is None else 'polygon'
+    return f'{shape} in ({x0}, {y0})-({x1}, {y1})'
+
+
+def crop_to_roi(frame, roi):
+    x0, y0, x1, y1 = roi['crop']
+    return frame[y0:y1, x0:x1]
+
+
+def count_white_pixels(fg_mask, roi=None):
+    """
+    Count the foreground pixels of a mask, only within the region of interest if there is one.
+    """
+    if roi is not None and roi['mask'] is not None:
+        return cv.countNonZero(cv.bitwise_and(fg_mask, roi['mask']))
+    return cv.countNonZero(fg_mask)
@@ -0,0 +1,194 @@
+import hashlib
+import json
+import os
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+from .analyze_movements import make_motion_scores
+from .file_lock import lock_file
+
+DEFAULT_CACHE_DIR = Path('output/cache')
+DEFAULT_CACHE_LIMIT_MB = 1024
+# Bump whenever the way motion scores are computed changes, so that older cache entries are ignored
+CACHE_VERSION = 2
+
+HASH_CHUNK_SIZE = 16 * 1024 * 1024
+HASH_INDEX_FILE = 'video_hashes.json'
+HASH_LOCK_FILE = 'video_hashes.lock'
+SCORE_DTYPE = np.dtype([('frame', '<i4'), ('time_ms', '<i4'), ('white_pixels', '<i4')])
+
+
+@contextmanager
+def lock_hash_index(cache_dir):
+    """
+    Serialize updates of the hash index between the processes of the machine (job workers, batch analyses).
+    """
+    Path(cache_dir).mkdir(parents=True, exist_ok=True)
+    with lock_file(Path(cache_dir) / HASH_LOCK_FILE):
+        yield
+
+
+def load_hash_index(cache_dir):
+    index_path = Path(cache_dir) / HASH_INDEX_FILE
+    if not index_path.exists():
+        return {}
+    with open(index_path, 'r') as f:
+        return json.load(f)
+
+
+def get_indexed_hash(input_video, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Return the hash of the video remembered by the hash index, or None if the video was never hashed, or has changed
+    since (its size or modification time differ).
+    """
+    stat = os.stat(input_video)
+    entry = load_hash_index(cache_dir).get(os.path.realpath(input_video))
+    if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+        return entry['hash']
+    return None
+
+
+def hash_video(input_video, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Return the BLAKE2 hash of the video's content.
+
+    Hashing a multi-GB video takes a few seconds, so hashes are remembered per path, size and modification time.
+    """
+    indexed_hash = get_indexed_hash(input_video, cache_dir)
+    if indexed_hash is not None:
+        return indexed_hash
+
+    stat = os.stat(input_video)
+    video_hash = hashlib.blake2b(digest_size=16)
+    with open(input_video, 'rb') as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            video_hash.update(chunk)
+
+    # Other processes may have updated the index while the video was hashed: read it again under the lock, so that
+    # their entries are kept
+    with lock_hash_index(cache_dir):
+        hash_index = load_hash_index(cache_dir)
+        hash_index[os.path.realpath(input_video)] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                                                     'hash': video_hash.hexdigest()}
+        # Replace the index atomically, so that readers never see it half-written
+        index_path = Path(cache_dir) / HASH_INDEX_FILE
+        tmp_index_path = index_path.with_suffix(f'.{os.getpid()}.tmp')
+        with open(tmp_index_path, 'w') as f:
+            json.dump(hash_index, f, indent=4)
+        os.replace(tmp_index_path, index_path)
+
+    return video_hash.hexdigest()
+
+
+def get_cache_key(video_hash, params):
+    """
+    Return the cache key of the motion scores of a video, given the parameters they were computed with.
+
+    Only parameters that change the scores belong in params (subtractor and analysis profile). Parameters applied
+    when replaying the scores, such as the white pixel threshold, must be left out.
+    """
+    key_data = json.dumps({'version': CACHE_VERSION, 'video': video_hash, 'params': params}, sort_keys=True)
+    return hashlib.blake2b(key_data.encode(), digest_size=16).hexdigest()
+
+
+def get_cache_paths(cache_dir, key):
+    return Path(cache_dir) / f'{key}.npy', Path(cache_dir) / f'{key}.json'
+
+
+def load_motion_scores(cache_dir, key):
+    """
+    Return the cached motion scores for key, memory-mapped from disk, or None on a cache miss.
+    """
+    scores_path, meta_path = get_cache_paths(cache_dir, key)
+    if not scores_path.exists() or not meta_path.exists():
+        return None
+
+    try:
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+        scores = np.load(scores_path, mmap_mode='r')
+    except (OSError, ValueError) as e:
+        print(f'Ignoring unreadable cache entry {key}: {e}')
+        remove_cache_entry(cache_dir, key)
+        return None
+
+    if meta.get('version') != CACHE_VERSION or scores.dtype != SCORE_DTYPE:
+        remove_cache_entry(cache_dir, key)
+        return None
+
+    # Mark the entry as recently used, for eviction
+    os.utime(scores_path)
+    os.utime(meta_path)
+
+    print(f'Loaded {len(scores):,} cached motion scores from {scores_path}')
+    return make_motion_scores(meta['fps'], meta['total_frames'], meta['source_size'], meta['analysis_size'],
+                              scores['frame'], scores['white_pixels'], scores['time_ms'])
+
+
+def save_motion_scores(cache_dir, key, motion_scores, params, limit_mb=DEFAULT_CACHE_LIMIT_MB):
+    """
+    Store motion scores under key, then evict the least recently used entries if the cache grew past limit_mb.
+    """
+    Path(cache_dir).mkdir(parents=True, exist_ok=True)
+    scores_path, meta_path = get_cache_paths(cache_dir, key)
+
+    scores = np.empty(len(motion_scores['frames']), dtype=SCORE_DTYPE)
+    scores['frame'] = motion_scores['frames']
+    scores['time_ms'] = motion_scores['times_ms']
+    scores['white_pixels'] = motion_scores['white_pixels']
+    # Write to temporary files first, so that an interrupted run never leaves a truncated entry behind. They are named
+    # after the process, as two processes analyzing copies of the same video save the same entry at the same time.
+    tmp_scores_path = scores_path.with_suffix(f'.{os.getpid()}.tmp')
+    with open(tmp_scores_path, 'wb') as f:
+        np.save(f, scores)
+    os.replace(tmp_scores_path, scores_path)
+
+    meta = {
+        'version': CACHE_VERSION,
+        'params': params,
+        'fps': motion_scores['fps'],
+        'total_frames': motion_scores['total_frames'],
+        'source_size': motion_scores['source_size'],
+        'analysis_size': motion_scores['analysis_size'],
+    }
+    tmp_meta_path = meta_path.with_suffix(f'.{os.getpid()}.tmp')
+    with open(tmp_meta_path, 'w') as f:
+        json.dump(meta, f, indent=4)
+    os.replace(tmp_meta_path, meta_path)
+    print(f'Cached {len(scores):,} motion scores in {scores_path}')
+
+    evict_cache_entries(cache_dir, limit_mb * 1024 * 1024, keep=key)
+
+
+def remove_cache_entry(cache_dir, key):
+    for cache_path in get_cache_paths(cache_dir, key):
+        if cache_path.exists():
+            os.remove(cache_path)
+
+
+def evict_cache_entries(cache_dir, limit_bytes, keep=None):
+    """
+    Remove the least recently used cache entries until the cache fits within limit_bytes. The entry keep is never
+    removed.
+    """
+    entries = []
+    for scores_path in Path(cache_dir).glob('*.npy'):
+        _, meta_path = get_cache_paths(cache_dir, scores_path.stem)
+        try:
+            size = scores_path.stat().st_size + (meta_path.stat().st_size if meta_path.exists() else 0)
+            entries.append((scores_path.stat().st_mtime, size, scores_path.stem))
+        except FileNotFoundError:
+            # Evicted by another process in the meantime
+            continue
+
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, key in sorted(entries):
+        if total_size <= limit_bytes:
+            break
+        if key == keep:
+            continue
+        remove_cache_entry(cache_dir, key)
+        total_size -= size
+        print(f'Evicted cache entry {key}')
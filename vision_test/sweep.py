@@ -0,0 +1,168 @@
+import itertools
+import json
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2 as cv
+
+from decorators.tracing import add_stage, count, traced
+from .analyze_movements import (ALGOS, get_analysis_roi, get_analysis_size, get_frame_time_ms, get_video_properties,
+                                make_motion_scores, prepare_frame, print_analysis_profile, read_frame)
+from .roi import count_white_pixels
+
+
+def parse_bool(value):
+    if value.lower() in ('1', 'true', 'yes', 'y'):
+        return True
+    if value.lower() in ('0', 'false', 'no', 'n'):
+        return False
+    raise ValueError(f'Not a boolean: {value}')
+
+
+def parse_algo(value):
+    algo = value.upper()
+    if algo not in ALGOS:
+        raise ValueError(f'Unknown background subtraction method: {value}')
+    return algo
+
+
+# Parameters that can be swept, with the parser of their values
+SWEEP_PARAMS = {
+    'algo': parse_algo,
+    'history': int,
+    'mvmt': int,
+    'shadows': parse_bool,
+    'white_pixels': int,
+    'movement_gap_ms': int,
+    'padding_ms': int,
+}
+# Parameters of the background subtractor. Configurations that only differ by the other parameters share a subtractor,
+# and are only applied to its scores.
+SUBTRACTOR_PARAMS = ('algo', 'history', 'mvmt', 'shadows')
+
+
+def parse_sweep(options):
+    """
+    Return the values to sweep, as {parameter: [values]}.
+
+    Args:
+        options (list): "name=value1,value2,..." strings, e.g. "mvmt=500,1000,2000" or "algo=MOG2,KNN".
+    """
+    grid = {}
+    for option in options:
+        name, _, values = option.partition('=')
+        name = name.strip()
+        if name not in SWEEP_PARAMS:
+            raise ValueError(f'Cannot sweep "{name}". Choose from: {", ".join(SWEEP_PARAMS)}')
+        if not values:
+            raise ValueError(f'No values to sweep for "{name}": {option}')
+        grid[name] = [SWEEP_PARAMS[name](value.strip()) for value in values.split(',')]
+    return grid
+
+
+def expand_sweep(grid, base):
+    """
+    Return every combination of the swept values, as configurations holding all the SWEEP_PARAMS: the parameters that
+    are not swept keep their value in base.
+    """
+    names = list(grid)
+    return [{**base, **dict(zip(names, values))} for values in itertools.product(*(grid[name] for name in names))]
+
+
+def get_subtractor_key(config):
+    return tuple(config[name] for name in SUBTRACTOR_PARAMS)
+
+
+@traced()
+def compute_sweep_scores(capture, back_subs, *, analysis_width=None, grayscale=False, frame_step=1, roi=None,
+                         num_threads=1):
+    """
+    Version of compute_motion_scores() for several background subtractors: every frame is decoded and prepared once,
+    then fed to each subtractor, from a pool of num_threads threads (OpenCV releases the GIL while it subtracts).
+
+    Returns:
+        tuple: (motion_scores, subtract_s): the motion scores computed by each subtractor, and the time each one spent
+            subtracting and counting, in the same order as back_subs.
+    """
+    fps, total_frames, source_size = get_video_properties(capture)
+    analysis_size = get_analysis_size(source_size, analysis_width)
+    roi_geometry = get_analysis_roi(roi, source_size, analysis_size)
+    print(f'Video FPS: {fps}')
+    print(f'Processing {total_frames:,} frames with {len(back_subs)} background subtractor(s)')
+    print_analysis_profile(source_size, analysis_size, grayscale, frame_step, roi_geometry)
+
+    frames = array('i')
+    times_ms = array('i')
+    white_pixels = [array('i') for _ in back_subs]
+    subtract_s = [0.0] * len(back_subs)
+
+    def subtract(i, frame):
+        start = time.perf_counter()
+        white_pixels[i].append(count_white_pixels(back_subs[i].apply(frame), roi_geometry))
+        subtract_s[i] += time.perf_counter() - start
+
+    decode_s = 0.0
+    frame_count = 0
+    progress_step = max(total_frames // 10 // frame_step * frame_step, frame_step)
+    with ThreadPoolExecutor(max_workers=max(num_threads, 1)) as executor:
+        while True:
+            decode_start = time.perf_counter()
+            ret, frame = read_frame(capture, frame_step)
+            if frame is None:
+                break
+            frame = prepare_frame(frame, analysis_size, grayscale, roi_geometry)
+            decode_s += time.perf_counter() - decode_start
+
+            frames.append(int(capture.get(cv.CAP_PROP_POS_FRAMES)))
+            times_ms.append(get_frame_time_ms(capture))
+            if num_threads > 1:
+                list(executor.map(subtract, range(len(back_subs)), itertools.repeat(frame)))
+            else:
+                for i in range(len(back_subs)):
+                    subtract(i, frame)
+
+            frame_count += frame_step
+            if frame_count % progress_step == 0 and total_frames:
+                print(f"Processing: {frame_count / total_frames * 100:.2f}% complete")
+
+    add_stage('decode', decode_s, len(frames) + 1)
+    for i, back_sub_s in enumerate(subtract_s):
+        add_stage(f'subtract_{i}', back_sub_s, len(frames))
+    count('frames', len(frames))
+    count('subtractors', len(back_subs))
+    motion_scores = [make_motion_scores(fps, total_frames, source_size, analysis_size, frames, back_sub_pixels,
+                                        times_ms) for back_sub_pixels in white_pixels]
+    return motion_scores, subtract_s
+
+
+def summarize_movements(intensive_movements, duration_s):
+    """
+    Return how much of the video a set of intensive movements covers.
+    """
+    durations = [movement['to'] - movement['from'] for movement in intensive_movements]
+    total_s = round(sum(durations), 3)
+    return {
+        "movements": len(durations),
+        "total_s": total_s,
+        "share": total_s / duration_s if duration_s else None,
+        "mean_s": total_s / len(durations) if durations else 0,
+        "longest_s": max(durations, default=0),
+    }
+
+
+def print_sweep_report(rows):
+    print(f'{"#":>3} {"algo":>5} {"history":>7} {"mvmt":>6} {"shadows":>7} {"white px":>8} {"gap ms":>6} {"pad ms":>6} '
+          f'{"movements":>9} {"total":>8} {"share":>6} {"mean":>7} {"longest":>7} {"subtract":>9}')
+    for i, row in enumerate(rows):
+        share = f'{row["share"] * 100:.1f}%' if row['share'] is not None else ''
+        subtract = f'{row["subtract_s"]:.2f}s' if row['subtract_s'] is not None else 'cached'
+        print(f'{i:>3} {row["algo"]:>5} {row["history"]:>7} {row["mvmt"]:>6} {str(row["shadows"]):>7} '
+              f'{row["white_pixels"]:>8} {row["movement_gap_ms"]:>6} {row["padding_ms"]:>6} {row["movements"]:>9} '
+              f'{row["total_s"]:>7.1f}s {share:>6} {row["mean_s"]:>6.1f}s {row["longest_s"]:>6.1f}s {subtract:>9}')
+
+
+def save_sweep_report(rows, output_file):
+    with open(output_file, 'w') as f:
+        json.dump(rows, f, indent=4)
+    print(f'Created {output_file}')
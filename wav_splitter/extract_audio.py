@@ -0,0 +1,91 @@
+import ffmpeg
+import numpy as np
+
+from decorators.tracing import count, traced
+from .wav_file import build_pcm_fmt, write_wav
+
+SAMPLE_RATE = 16000  # What the pyannote models expect: anything else is resampled by pyannote on every call
+SEGMENT_DURATION = 10 * 60  # Same as split-wav
+ANALYZE_DURATION = '10M'
+PROBE_SIZE = '50M'
+
+
+def open_audio_stream(input_video, sample_rate=SAMPLE_RATE):
+    """
+    Start an ffmpeg process that demuxes and decodes the first audio track of input_video, and writes it to its stdout
+    as 16-bit mono PCM at sample_rate. The video track is never decoded.
+    """
+    return (ffmpeg
+            .input(str(input_video), analyzeduration=ANALYZE_DURATION, probesize=PROBE_SIZE)
+            .output('pipe:', format='s16le', acodec='pcm_s16le', ac=1, ar=sample_rate, map='0:a:0')
+            .global_args('-loglevel', 'error')
+            .run_async(pipe_stdout=True, pipe_stderr=True))
+
+
+def close_audio_stream(process):
+    """
+    Wait for the ffmpeg process to exit, and raise ffmpeg.Error if it failed.
+    """
+    process.stdout.close()
+    stderr = process.stderr.read()
+    process.stderr.close()
+    if process.wait() != 0:
+        raise ffmpeg.Error('ffmpeg', None, stderr)
+
+
+@traced()
+def read_audio(input_video, sample_rate=SAMPLE_RATE):
+    """
+    Return the audio track of input_video as a mono float32 array in [-1, 1], decoded in a single pass, without
+    writing anything to disk.
+    """
+    process = open_audio_stream(input_video, sample_rate)
+    try:
+        data = process.stdout.read()
+    finally:
+        close_audio_stream(process)
+
+    samples = np.frombuffer(data, dtype=np.int16).astype(np.float32) / 32768
+    count('audio_s', len(samples) / sample_rate)
+    print(f"Read {len(samples) / sample_rate:.1f}s of audio from {input_video}")
+    return samples
+
+
+@traced()
+def extract_audio_segments(input_video, output_dir, segment_duration=SEGMENT_DURATION, sample_rate=SAMPLE_RATE):
+    """
+    Decode the audio track of input_video once, and stream it straight into segment_duration-long WAV segments
+    (segment_1.wav, segment_2.wav, ...), the same way split_wav names them. No full-length WAV file is written, and
+    only one segment is held in memory at a time.
+
+    Returns:
+        list: Paths of the segments.
+    """
+    fmt = build_pcm_fmt(1, sample_rate)
+    buffer = memoryview(bytearray(round(segment_duration * sample_rate) * 2))
+    segment_paths = []
+
+    process = open_audio_stream(input_video, sample_rate)
+    try:
+        while True:
+            # Fill the buffer with a whole segment: the pipe hands the samples over in small chunks
+            size = 0
+            while size < len(buffer):
+                read = process.stdout.readinto(buffer[size:])
+                if not read:
+                    break
+                size += read
+            if not size:
+                break
+
+            segment_path = f'{output_dir}/segment_{len(segment_paths) + 1}.wav'
+            write_wav(segment_path, fmt, buffer[:size])
+            segment_paths.append(segment_path)
+            if size < len(buffer):
+                break
+    finally:
+        close_audio_stream(process)
+
+    count('segments', len(segment_paths))
+    print(f"Extracted the audio of {input_video} into {len(segment_paths)} segments.")
+    return segment_paths
@@ -3,6 +3,8 @@ import multiprocessing
 
 import ffmpeg
 
+from .wav_file import get_duration, read_wav_header, slice_wav, write_wav
+
 
 def split_wav(input_file, start_time, duration, output_file):
     """Splits the WAV file using ffmpeg for a given start time and duration."""
@@ -24,8 +26,32 @@ def get_wav_duration(input_file):
     return duration
 
 
+def get_segment_path(output_dir, i):
+    return f'{output_dir}/segment_{i + 1}.wav'
+
+
+def split_wav_natively(input_file, output_dir, segment_duration, header):
+    """
+    Splits a PCM WAV file into segments by copying slices of its memory-mapped samples behind a new header, without
+    decoding anything or starting any process. This is bound by disk bandwidth only.
+    """
+    num_segments = 0
+    for i, samples in slice_wav(input_file, header, segment_duration):
+        write_wav(get_segment_path(output_dir, i), header['fmt'], samples)
+        num_segments += 1
+    return num_segments
+
+
 def split_wav_in_parallel(input_file, output_dir, segment_duration, num_cores):
     """Splits the WAV file into segments in parallel."""
+    header = read_wav_header(input_file)
+    if header is not None:
+        print(f"Splitting {input_file} (duration: {get_duration(header)}s) natively...")
+        num_segments = split_wav_natively(input_file, output_dir, segment_duration, header)
+        print(f"Finished splitting {input_file} into {num_segments} segments.")
+        return
+
+    # Compressed or unusual formats: fall back to ffmpeg
     # Get the total duration of the WAV file
     total_duration = get_wav_duration(input_file)
     # Calculate the number of segments needed
@@ -38,7 +64,7 @@ def split_wav_in_parallel(input_file, output_dir, segment_duration, num_cores):
     for i in range(num_segments):
         start_time = i * segment_duration
         duration = min(segment_duration, total_duration - start_time)
-        output_file = f'{output_dir}/segment_{i + 1}.wav'
+        output_file = get_segment_path(output_dir, i)
         tasks.append((input_file, start_time, duration, output_file))
 
     # Use multiprocessing to split the WAV in parallel
@@ -0,0 +1,114 @@
+import mmap
+import os
+import struct
+
+# Sample formats that can be cut anywhere on a block boundary: PCM, IEEE float, and WAVE_FORMAT_EXTENSIBLE (which
+# wraps one of them)
+SLICEABLE_FORMATS = {0x0001, 0x0003, 0xFFFE}
+# Size of a 32-bit chunk that is actually given by the ds64 chunk of an RF64 file
+RF64_PLACEHOLDER_SIZE = 0xFFFFFFFF
+
+
+def read_wav_header(input_file):
+    """
+    Parse the RIFF (or RF64) header of a WAV file, without reading its samples.
+
+    Returns:
+        dict: "fmt" (raw fmt chunk), "audio_format", "num_channels", "sample_rate", "block_align", "data_offset" and
+            "data_size" (in bytes), or None when the file isn't a WAV file this module can slice.
+    """
+    file_size = os.path.getsize(input_file)
+    with open(input_file, 'rb') as f:
+        riff_id, _, wave_id = struct.unpack('<4sI4s', f.read(12))
+        if riff_id not in (b'RIFF', b'RF64') or wave_id != b'WAVE':
+            return None
+
+        fmt = None
+        ds64_data_size = None
+        while True:
+            chunk_header = f.read(8)
+            if len(chunk_header) < 8:
+                return None
+            chunk_id, chunk_size = struct.unpack('<4sI', chunk_header)
+
+            if chunk_id == b'data':
+                if fmt is None:
+                    return None
+                data_offset = f.tell()
+                if chunk_size == RF64_PLACEHOLDER_SIZE and ds64_data_size is not None:
+                    chunk_size = ds64_data_size
+                break
+            chunk = f.read(chunk_size + chunk_size % 2)  # Chunks are padded to an even size
+            if chunk_id == b'fmt ':
+                fmt = chunk[:chunk_size]
+            elif chunk_id == b'ds64':
+                ds64_data_size = struct.unpack_from('<Q', chunk, 8)[0]
+
+    audio_format, num_channels, sample_rate, _, block_align = struct.unpack_from('<HHIIH', fmt)
+    if audio_format not in SLICEABLE_FORMATS or not block_align:
+        return None
+
+    return {
+        "fmt": fmt,
+        "audio_format": audio_format,
+        "num_channels": num_channels,
+        "sample_rate": sample_rate,
+        "block_align": block_align,
+        "data_offset": data_offset,
+        # Writers that stream their output (e.g. ffmpeg to a pipe) leave the size unset, or too large
+        "data_size": min(chunk_size, file_size - data_offset),
+    }
+
+
+def get_duration(header):
+    return header['data_size'] // header['block_align'] / header['sample_rate']
+
+
+def build_pcm_fmt(num_channels, sample_rate, bits_per_sample=16):
+    """
+    Return the fmt chunk of integer PCM samples.
+    """
+    block_align = num_channels * bits_per_sample // 8
+    return struct.pack('<HHIIHH', 0x0001, num_channels, sample_rate, sample_rate * block_align, block_align,
+                       bits_per_sample)
+
+
+def build_wav_header(fmt, data_size):
+    """
+    Return the RIFF header of a WAV file holding data_size bytes of samples in the format described by fmt.
+    """
+    fmt_chunk = struct.pack('<4sI', b'fmt ', len(fmt)) + fmt + b'\0' * (len(fmt) % 2)
+    riff_size = 4 + len(fmt_chunk) + 8 + data_size + data_size % 2
+    return struct.pack('<4sI4s', b'RIFF', riff_size, b'WAVE') + fmt_chunk + struct.pack('<4sI', b'data', data_size)
+
+
+def slice_wav(input_file, header, segment_duration):
+    """
+    Yield (index, samples) for every segment_duration-long slice of the samples of a WAV file, where samples is a
+    memoryview over the memory-mapped file: nothing is decoded or copied until it is written out.
+    """
+    segment_size = round(segment_duration * header['sample_rate']) * header['block_align']
+    data_end = header['data_offset'] + header['data_size']
+    with open(input_file, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            data = memoryview(mapped)
+            try:
+                for i, start in enumerate(range(header['data_offset'], data_end, segment_size)):
+                    samples = data[start:min(start + segment_size, data_end)]
+                    try:
+                        yield i, samples
+                    finally:
+                        samples.release()
+            finally:
+                data.release()
+
+
+def write_wav(output_file, fmt, samples):
+    """
+    Write a WAV file made of a header and the given sample bytes, which are handed to the OS as they are.
+    """
+    with open(output_file, 'wb') as f:
+        f.write(build_wav_header(fmt, len(samples)))
+        f.write(samples)
+        if len(samples) % 2:
+            f.write(b'\0')